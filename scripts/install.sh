@@ -26,6 +26,13 @@ apt install -y python3 python3-pip python3-venv
 echo "📚 Installing system dependencies..."
 apt install -y git curl wget nginx certbot python3-certbot-nginx
 
+# Document previews: LibreOffice with its Python bindings for the system
+# python3, which the preview pool runs its UNO bridge under, and poppler
+# for rasterizing pages
+echo "📄 Installing document preview dependencies..."
+apt install -y libreoffice-writer libreoffice-calc libreoffice-impress \
+    python3-uno poppler-utils
+
 # Create virtual environment
 echo "🔧 Setting up Python virtual environment..."
 cd /root/discord-indexer
@@ -47,6 +54,7 @@ pip install werkzeug==2.3.7
 echo "🔐 Setting permissions..."
 chmod +x src/bot.py
 chmod +x src/web_app.py
+chmod +x src/preview_worker.py
 chmod +x setup_db.py
 chmod +x install.sh
 
@@ -58,11 +66,13 @@ python3 setup_db.py
 echo "⚙️ Installing systemd services..."
 cp discord-indexer-bot.service /etc/systemd/system/
 cp discord-indexer-web.service /etc/systemd/system/
+cp discord-indexer-preview.service /etc/systemd/system/
 
 # Reload systemd and enable services
 systemctl daemon-reload
 systemctl enable discord-indexer-bot.service
 systemctl enable discord-indexer-web.service
+systemctl enable discord-indexer-preview.service
 
 # Create nginx configuration
 echo "🌐 Setting up Nginx..."
@@ -149,9 +159,11 @@ echo "2. Change the default username/password in config/config.json"
 echo "3. Start the services:"
 echo "   systemctl start discord-indexer-bot"
 echo "   systemctl start discord-indexer-web"
+echo "   systemctl start discord-indexer-preview"
 echo "4. Check service status:"
 echo "   systemctl status discord-indexer-bot"
 echo "   systemctl status discord-indexer-web"
+echo "   systemctl status discord-indexer-preview"
 echo "5. Set up SSL certificate:"
 echo "   certbot --nginx -d lettner.tech -d www.lettner.tech"
 echo ""
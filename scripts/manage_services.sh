@@ -8,15 +8,18 @@ case "$1" in
         # Copy service files to systemd directory
         sudo cp /root/discord-indexer/discord-indexer-bot.service /etc/systemd/system/
         sudo cp /root/discord-indexer/discord-indexer-web.service /etc/systemd/system/
+        sudo cp /root/discord-indexer/discord-indexer-preview.service /etc/systemd/system/
         
         # Reload systemd and enable services
         sudo systemctl daemon-reload
         sudo systemctl enable discord-indexer-bot.service
         sudo systemctl enable discord-indexer-web.service
+        sudo systemctl enable discord-indexer-preview.service
         
         # Start services
         sudo systemctl start discord-indexer-bot.service
         sudo systemctl start discord-indexer-web.service
+        sudo systemctl start discord-indexer-preview.service
         
         echo "Services started successfully!"
         ;;
@@ -24,12 +27,14 @@ case "$1" in
         echo "Stopping Discord Indexer services..."
         sudo systemctl stop discord-indexer-bot.service
         sudo systemctl stop discord-indexer-web.service
+        sudo systemctl stop discord-indexer-preview.service
         echo "Services stopped."
         ;;
     restart)
         echo "Restarting Discord Indexer services..."
         sudo systemctl restart discord-indexer-bot.service
         sudo systemctl restart discord-indexer-web.service
+        sudo systemctl restart discord-indexer-preview.service
         echo "Services restarted."
         ;;
     status)
@@ -38,25 +43,30 @@ case "$1" in
         echo ""
         echo "Discord Indexer Web Status:"
         sudo systemctl status discord-indexer-web.service
+        echo ""
+        echo "Discord Indexer Preview Worker Status:"
+        sudo systemctl status discord-indexer-preview.service
         ;;
     logs)
         if [ "$2" = "bot" ]; then
             sudo journalctl -u discord-indexer-bot.service -f
         elif [ "$2" = "web" ]; then
             sudo journalctl -u discord-indexer-web.service -f
+        elif [ "$2" = "preview" ]; then
+            sudo journalctl -u discord-indexer-preview.service -f
         else
-            echo "Usage: $0 logs [bot|web]"
+            echo "Usage: $0 logs [bot|web|preview]"
         fi
         ;;
     *)
-        echo "Usage: $0 {start|stop|restart|status|logs [bot|web]}"
+        echo "Usage: $0 {start|stop|restart|status|logs [bot|web|preview]}"
         echo ""
         echo "Commands:"
-        echo "  start   - Install and start both services"
-        echo "  stop    - Stop both services"
-        echo "  restart - Restart both services"
-        echo "  status  - Show status of both services"
-        echo "  logs    - Show logs (specify 'bot' or 'web')"
+        echo "  start   - Install and start all services"
+        echo "  stop    - Stop all services"
+        echo "  restart - Restart all services"
+        echo "  status  - Show status of all services"
+        echo "  logs    - Show logs (specify 'bot', 'web' or 'preview')"
         exit 1
         ;;
 esac
\ No newline at end of file
@@ -38,14 +38,22 @@ nohup python3 src/web_app.py > logs/web_app.log 2>&1 &
 WEB_PID=$!
 echo "Web app started with PID: $WEB_PID"
 
+# Start preview worker in background
+echo "Starting preview worker..."
+nohup python3 src/preview_worker.py > logs/preview_worker.log 2>&1 &
+PREVIEW_PID=$!
+echo "Preview worker started with PID: $PREVIEW_PID"
+
 # Save PIDs for later reference
 echo $BOT_PID > bot.pid
 echo $WEB_PID > web_app.pid
+echo $PREVIEW_PID > preview_worker.pid
 
 echo ""
 echo "Discord Indexer started successfully!"
 echo "Bot PID: $BOT_PID (log: logs/bot.log)"
 echo "Web App PID: $WEB_PID (log: logs/web_app.log)"
+echo "Preview Worker PID: $PREVIEW_PID (log: logs/preview_worker.log)"
 echo "Web interface available at: http://localhost:5000"
 echo ""
 echo "To stop the applications, run: scripts/stop_apps.sh"
@@ -22,6 +22,12 @@ else
     echo "  Web Service: not installed"
 fi
 
+if [ -f "/etc/systemd/system/discord-indexer-preview.service" ]; then
+    echo "  Preview Worker Service: $(sudo systemctl is-active discord-indexer-preview.service 2>/dev/null || echo 'inactive')"
+else
+    echo "  Preview Worker Service: not installed"
+fi
+
 echo ""
 echo "Manual Processes:"
 
@@ -66,9 +72,29 @@ fi
 
 echo ""
 
+# Check preview worker status
+echo "Preview Worker:"
+if [ -f "preview_worker.pid" ]; then
+    PREVIEW_PID=$(cat preview_worker.pid)
+    if kill -0 $PREVIEW_PID 2>/dev/null; then
+        echo "  Status: RUNNING (PID: $PREVIEW_PID)"
+        echo "  Log file: logs/preview_worker.log"
+        if [ -f "logs/preview_worker.log" ]; then
+            echo "  Last log entry: $(tail -n 1 logs/preview_worker.log)"
+        fi
+    else
+        echo "  Status: NOT RUNNING (stale PID file)"
+        rm -f preview_worker.pid
+    fi
+else
+    echo "  Status: NOT RUNNING (no PID file)"
+fi
+
+echo ""
+
 # Check for any python processes related to the project
 echo "Related Python Processes:"
-ps aux | grep -E "(bot\.py|web_app\.py)" | grep -v grep | while read line; do
+ps aux | grep -E "(bot\.py|web_app\.py|preview_worker\.py)" | grep -v grep | while read line; do
     echo "  $line"
 done
 
@@ -41,11 +41,17 @@ if [ -f "/etc/systemd/system/discord-indexer-bot.service" ]; then
     sudo systemctl stop discord-indexer-bot.service 2>/dev/null || echo "Service not running or failed to stop"
 fi
 
+if [ -f "/etc/systemd/system/discord-indexer-preview.service" ]; then
+    echo "Stopping discord-indexer-preview service..."
+    sudo systemctl stop discord-indexer-preview.service 2>/dev/null || echo "Service not running or failed to stop"
+fi
+
 # Stop the applications (fallback for manual processes)
 kill_processes "python3 src/bot.py"
 kill_processes "python3 src/web_app.py"
+kill_processes "python3 src/preview_worker.py"
 
 # Remove PID files if they exist
-rm -f bot.pid web_app.pid
+rm -f bot.pid web_app.pid preview_worker.pid
 
 echo "All applications stopped."
\ No newline at end of file
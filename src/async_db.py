@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('DiscordIndexer.AsyncDatabase')
+
+
+class AsyncDatabase:
+    """Asyncio facade for a DatabaseManager.
+
+    Every call is executed on one dedicated thread that owns a long-lived
+    SQLite connection, so coroutines await database work instead of
+    blocking the event loop on locks, busy timeouts or fsyncs. Calls are
+    serialized in submission order.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='sqlite-writer',
+            initializer=db.open_thread_connection
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    def close(self):
+        """Close the thread's connection and stop the executor"""
+        try:
+            self._executor.submit(self.db.close_thread_connection).result()
+        except Exception as e:
+            logger.error(f"Error closing database thread connection: {e}")
+        self._executor.shutdown(wait=True)
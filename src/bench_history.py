@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Compare raw JSON history paging with discord.py's channel.history()
+
+Serves a synthetic channel from a local stand-in for the Discord REST API
+and walks its full history once per path, each in its own process so peak
+RSS is measured separately. Only fetching and row projection are timed;
+nothing is written to the database.
+
+Usage: python src/bench_history.py [--messages 20000]
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from aiohttp import web
+
+CHANNEL_ID = 1100000000000000000
+GUILD_ID = 1000000000000000000
+FIRST_MESSAGE_ID = 1200000000000000000
+
+
+def build_messages(count):
+    """Build message payloads shaped like real gateway/REST payloads"""
+    messages = []
+    for i in range(count):
+        message_id = FIRST_MESSAGE_ID + (i << 22)
+        author = {
+            'id': str(900000000000000000 + i % 50),
+            'username': f'user{i % 50}',
+            'discriminator': '0',
+            'global_name': f'User {i % 50}',
+            'avatar': 'a' * 32,
+            'public_flags': 0
+        }
+        message = {
+            'id': str(message_id),
+            'type': 0,
+            'channel_id': str(CHANNEL_ID),
+            'author': author,
+            'member': {'roles': [str(800000000000000000 + r) for r in range(5)], 'joined_at': '2023-01-01T00:00:00+00:00',
+                       'deaf': False, 'mute': False, 'flags': 0},
+            'content': f'message {i} https://example.com/page/{i} see also https://docs.example.org/{i}' if i % 3 == 0 else f'message {i}',
+            'timestamp': '2024-01-01T00:00:00+00:00',
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [{'type': 'link', 'url': f'https://example.com/page/{i}', 'title': 'Example page',
+                        'description': 'x' * 200}] if i % 3 == 0 else [],
+            'reactions': [{'count': 2, 'me': False, 'emoji': {'id': None, 'name': '👍'}}] if i % 5 == 0 else [],
+            'pinned': False,
+            'flags': 0,
+            'components': []
+        }
+        if i % 4 == 0:
+            message['attachments'].append({
+                'id': str(message_id + 1),
+                'filename': f'file{i}.pdf',
+                'size': 123456,
+                'url': f'https://cdn.discordapp.com/attachments/{CHANNEL_ID}/{message_id + 1}/file{i}.pdf?ex=66000000&is=65f00000&hm=abcdef',
+                'proxy_url': f'https://media.discordapp.net/attachments/{CHANNEL_ID}/{message_id + 1}/file{i}.pdf',
+                'content_type': 'application/pdf'
+            })
+        messages.append(message)
+    messages.reverse()  # newest first, like the API
+    return messages
+
+
+def json_response(body, headers=None):
+    # discord.py only decodes bodies whose content type is exactly application/json
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    return web.Response(body=body.encode() if isinstance(body, str) else body, headers=headers)
+
+
+def make_app(count):
+    messages = build_messages(count)
+    encoded = {}
+
+    async def get_user(request):
+        return json_response(json.dumps({'id': '1', 'username': 'bench', 'discriminator': '0', 'bot': True,
+                                         'avatar': None}))
+
+    async def get_application(request):
+        user = {'id': '1', 'username': 'bench', 'discriminator': '0', 'avatar': None}
+        return json_response(json.dumps({'id': '1', 'name': 'bench', 'description': '', 'icon': None,
+                                         'verify_key': '', 'bot_public': True, 'bot_require_code_grant': False,
+                                         'owner': user, 'flags': 0}))
+
+    async def get_channel(request):
+        return json_response(json.dumps({'id': str(CHANNEL_ID), 'type': 0, 'guild_id': str(GUILD_ID), 'name': 'bench',
+                                         'position': 0, 'permission_overwrites': [], 'nsfw': False,
+                                         'parent_id': None}))
+
+    async def get_messages(request):
+        limit = int(request.query.get('limit', 50))
+        before = request.query.get('before')
+        start = 0
+        if before:
+            before = int(before)
+            # messages are sorted newest first
+            lo, hi = 0, len(messages)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if int(messages[mid]['id']) >= before:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = lo
+        key = (start, limit)
+        if key not in encoded:
+            encoded[key] = json.dumps(messages[start:start + limit])
+        return json_response(encoded[key], {'X-RateLimit-Remaining': '5', 'X-RateLimit-Reset-After': '0.0'})
+
+    app = web.Application()
+    app.router.add_get('/api/v10/users/@me', get_user)
+    app.router.add_get('/api/v10/oauth2/applications/@me', get_application)
+    app.router.add_get('/api/v10/channels/{channel_id}', get_channel)
+    app.router.add_get('/api/v10/channels/{channel_id}/messages', get_messages)
+    return app
+
+
+async def run_raw(base_url):
+    import aiohttp
+    from raw_history import RawHistoryFetcher, project_message
+
+    rows = 0
+    messages = 0
+    async with aiohttp.ClientSession() as session:
+        fetcher = RawHistoryFetcher(session, 'bench-token', base_url=base_url)
+        async for page in fetcher.pages(CHANNEL_ID):
+            for payload in page:
+                file_rows, link_rows = project_message(payload, 'bench', GUILD_ID, 'bench guild')
+                rows += len(file_rows) + len(link_rows)
+                messages += 1
+    return messages, rows
+
+
+async def run_model(base_url):
+    import discord
+    from urllib.parse import urlparse
+    from url_utils import extract_urls, parse_cdn_expiry
+
+    discord.http.Route.BASE = base_url
+    client = discord.Client(intents=discord.Intents.default())
+    await client.login('bench-token')
+    rows = 0
+    messages = 0
+    try:
+        channel = await client.fetch_channel(CHANNEL_ID)
+        async for message in channel.history(limit=None):
+            if message.author.bot:
+                continue
+            # Same attribute reads as DatabaseManager.file_row and link_row
+            common = (str(message.id), str(message.channel.id), message.channel.name,
+                      str(message.guild.id) if message.guild else None,
+                      message.guild.name if message.guild else None,
+                      str(message.author.id), str(message.author))
+            file_rows = [common + (a.filename, a.url, a.size, a.content_type, message.content, message.created_at,
+                                    parse_cdn_expiry(a.url))
+                         for a in message.attachments]
+            link_rows = [common + (url, urlparse(url).netloc, message.content, message.created_at)
+                         for url in extract_urls(message.content)] if message.content else []
+            rows += len(file_rows) + len(link_rows)
+            messages += 1
+    finally:
+        await client.close()
+    return messages, rows
+
+
+def child(mode, base_url):
+    from crawler import peak_rss_mb
+
+    started = time.perf_counter()
+    runner = run_raw if mode == 'raw' else run_model
+    messages, rows = asyncio.run(runner(base_url))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'mode': mode, 'messages': messages, 'rows': rows, 'seconds': elapsed,
+                      'messages_per_second': messages / elapsed, 'peak_rss_mb': peak_rss_mb()}))
+
+
+async def main(count, port):
+    runner = web.AppRunner(make_app(count))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    base_url = f'http://127.0.0.1:{port}/api/v10'
+
+    try:
+        for mode in ('model', 'raw'):
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, __file__, '--child', mode, '--base-url', base_url,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                print(f"{mode}: failed with exit code {process.returncode}")
+                print(stderr.decode())
+                continue
+            result = json.loads(stdout.decode().strip().splitlines()[-1])
+            print(f"{mode:>5}: {result['messages']} messages, {result['rows']} rows in {result['seconds']:.2f}s "
+                  f"({result['messages_per_second']:.0f} msg/s), peak RSS {result['peak_rss_mb']:.1f} MB")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--child', choices=['raw', 'model'])
+    parser.add_argument('--base-url')
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.base_url)
+    else:
+        asyncio.run(main(args.messages, args.port))
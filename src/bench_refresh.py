@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Compare bulk attachment URL refresh with one message fetch per file
+
+Serves a local stand-in for the Discord REST API and refreshes every file
+URL of a scratch database once per path: through the refresh-urls endpoint
+with one transaction per batch, and through one message fetch plus one
+committed UPDATE per file.
+
+Usage: python src/bench_refresh.py [--files 5000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from bench_history import json_response
+from schema import ensure_schema
+from url_refresh import REFRESH_BATCH_SIZE, AttachmentURLRefresher, apply_refreshed_urls
+
+CHANNEL_ID = 1100000000000000000
+FIRST_MESSAGE_ID = 1200000000000000000
+
+
+def attachment_url(message_id, signature):
+    return (f'https://cdn.discordapp.com/attachments/{CHANNEL_ID}/{message_id + 1}/file.pdf'
+            f'?ex=66000000&is=65f00000&hm={signature}')
+
+
+def refreshed_url(url):
+    return url.replace('ex=66000000', 'ex=7fffffff').split('&hm=')[0] + '&hm=fresh'
+
+
+def make_app(unrefreshable_every):
+    async def refresh_urls(request):
+        body = await request.json()
+        urls = body['attachment_urls'][:REFRESH_BATCH_SIZE]
+        refreshed = [{'original': url, 'refreshed': refreshed_url(url)}
+                     for i, url in enumerate(urls) if not unrefreshable_every or i % unrefreshable_every]
+        return json_response(json.dumps({'refreshed_urls': refreshed}),
+                             {'X-RateLimit-Remaining': '5', 'X-RateLimit-Reset-After': '0.0'})
+
+    async def get_message(request):
+        message_id = int(request.match_info['message_id'])
+        url = refreshed_url(attachment_url(message_id, 'abcdef'))
+        return json_response(json.dumps({'id': str(message_id), 'attachments': [{'filename': 'file.pdf', 'url': url}]}),
+                             {'X-RateLimit-Remaining': '5', 'X-RateLimit-Reset-After': '0.0'})
+
+    app = web.Application()
+    app.router.add_post('/api/v10/attachments/refresh-urls', refresh_urls)
+    app.router.add_get('/api/v10/channels/{channel_id}/messages/{message_id}', get_message)
+    return app
+
+
+def build_database(path, count):
+    conn = sqlite3.connect(path)
+    ensure_schema(conn)
+    conn.executemany('''
+        INSERT INTO indexed_files
+        (message_id, channel_id, author_id, filename, file_url, timestamp, url_expires_at)
+        VALUES (?, ?, 1, 'file.pdf', ?, 1704067200000, ?)
+    ''', [(FIRST_MESSAGE_ID + (i << 22), CHANNEL_ID, attachment_url(FIRST_MESSAGE_ID + (i << 22), 'abcdef'),
+           0x66000000) for i in range(count)])
+    conn.commit()
+    return conn
+
+
+def candidates(conn):
+    return conn.execute('SELECT id, message_id, channel_id, filename, file_url FROM indexed_files').fetchall()
+
+
+async def run_bulk(conn, base_url):
+    files = candidates(conn)
+    updated = 0
+    leftover = 0
+    async with aiohttp.ClientSession() as session:
+        refresher = AttachmentURLRefresher(session, 'bench-token', base_url=base_url)
+        for i in range(0, len(files), REFRESH_BATCH_SIZE):
+            batch = files[i:i + REFRESH_BATCH_SIZE]
+            refreshed = await refresher.refresh([row[4] for row in batch])
+            updated += apply_refreshed_urls(conn, [(row[0], refreshed[row[4]]) for row in batch if row[4] in refreshed])
+            leftover += sum(1 for row in batch if row[4] not in refreshed)
+    return updated, leftover, refresher.requests
+
+
+async def run_per_file(conn, base_url):
+    files = candidates(conn)
+    updated = 0
+    async with aiohttp.ClientSession() as session:
+        for file_id, message_id, channel_id, filename, _ in files:
+            async with session.get(f'{base_url}/channels/{channel_id}/messages/{message_id}') as response:
+                message = await response.json()
+            for attachment in message['attachments']:
+                if attachment['filename'] == filename:
+                    conn.execute('UPDATE indexed_files SET file_url = ? WHERE id = ?', (attachment['url'], file_id))
+                    conn.commit()
+                    updated += 1
+                    break
+    return updated, 0, len(files)
+
+
+async def main(count, port, unrefreshable_every):
+    runner = web.AppRunner(make_app(unrefreshable_every))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    base_url = f'http://127.0.0.1:{port}/api/v10'
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode, run in (('per-file', run_per_file), ('bulk', run_bulk)):
+                conn = build_database(os.path.join(tmp, f'{mode}.db'), count)
+                started = time.perf_counter()
+                updated, leftover, requests = await run(conn, base_url)
+                elapsed = time.perf_counter() - started
+                conn.close()
+                print(f"{mode:>8}: {updated} URLs updated, {leftover} left for fallback, {requests} requests "
+                      f"in {elapsed:.2f}s ({updated / elapsed:.0f} URLs/s)")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--unrefreshable-every', type=int, default=0,
+                        help='have the stand-in decline every Nth URL of a batch')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.files, args.port, args.unrefreshable_every))
@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
 
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 import json
 import sqlite3
-import re
 import logging
 from datetime import datetime
 import asyncio
+import functools
+import threading
+import time
 from urllib.parse import urlparse
 import aiohttp
+from async_db import AsyncDatabase
+from crawler import ChannelCrawler, RateLimitBudget, peak_rss_mb, rate_limit_trace
+from file_types import PREVIEW_TYPES
+from loop_monitor import LoopLagMonitor
+from migrations import migrate_step, pending_migrations
+from normalize import mime_category, url_registrable_domain
+from raw_history import DISCORD_API, HistoryForbidden, RawHistoryFetcher, project_message
+from rollups import StatsRollup
+from schema import ensure_schema, get_column_type
+from url_refresh import REFRESH_BATCH_SIZE, AttachmentURLRefresher, apply_refreshed_urls, url_identity
+from url_utils import extract_urls, parse_cdn_expiry
+from write_queue import WriteQueue, require_committed
 
 
 
@@ -34,112 +49,335 @@ intents.message_content = True
 intents.guilds = True
 intents.guild_messages = True
 
-bot = commands.Bot(command_prefix=config['discord']['command_prefix'], intents=intents)
+# Concurrent channel crawling under one shared request budget
+crawler_config = config.get('crawler', {})
+rate_budget = RateLimitBudget(
+    rate=crawler_config.get('requests_per_second', 40.0),
+    burst=crawler_config.get('burst', 10)
+)
+
+# Responses to discord.py's own requests, such as history pages, update the
+# budget from their rate-limit headers like RawHistoryFetcher's do
+bot = commands.Bot(command_prefix=config['discord']['command_prefix'], intents=intents,
+                   http_trace=rate_limit_trace(rate_budget))
+
+
+
+INSERT_FILE_SQL = '''
+    INSERT OR IGNORE INTO indexed_files 
+    (message_id, channel_id, guild_id, author_id, filename, file_url, 
+     file_size, file_type, mime_major, mime_minor, timestamp, url_expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_LINK_SQL = '''
+    INSERT OR IGNORE INTO indexed_links 
+    (message_id, channel_id, guild_id, author_id, link_url, link_domain, registrable_domain, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+ENQUEUE_PREVIEW_SQL = '''
+    INSERT OR IGNORE INTO preview_jobs (file_id, priority)
+    SELECT id, ? FROM indexed_files WHERE message_id = ? AND file_url = ? AND deleted_at IS NULL
+'''
+
+# Dimension rows only change when a name or the message text does
+UPSERT_GUILD_SQL = '''
+    INSERT INTO guilds (guild_id, name) VALUES (?, ?)
+    ON CONFLICT(guild_id) DO UPDATE SET name = excluded.name
+    WHERE name IS NOT excluded.name
+'''
+
+UPSERT_CHANNEL_SQL = '''
+    INSERT INTO channels (channel_id, guild_id, name) VALUES (?, ?, ?)
+    ON CONFLICT(channel_id) DO UPDATE SET guild_id = excluded.guild_id, name = excluded.name
+    WHERE guild_id IS NOT excluded.guild_id OR name IS NOT excluded.name
+'''
+
+UPSERT_AUTHOR_SQL = '''
+    INSERT INTO authors (author_id, name) VALUES (?, ?)
+    ON CONFLICT(author_id) DO UPDATE SET name = excluded.name
+    WHERE name IS NOT excluded.name
+'''
 
+UPSERT_MESSAGE_SQL = '''
+    INSERT INTO messages (message_id, channel_id, author_id, content) VALUES (?, ?, ?, ?)
+    ON CONFLICT(message_id) DO UPDATE SET content = excluded.content
+    WHERE content IS NOT excluded.content
+'''
 
 
-# Initialize File Content Indexer
+# Previewable attachments are queued for preview_worker.py to render ahead
+# of time. Old attachments found while crawling history are left to render
+# on request, so they do not push recent previews out of the cache.
+PRERENDER = config.get('previews', {}).get('prerender', True)
+PRERENDER_MAX_AGE_MS = config.get('previews', {}).get('prerender_max_age_days', 30) * 86400 * 1000
+
+
+def epoch_ms(value):
+    """Convert a message time to epoch milliseconds"""
+    return round(value.timestamp() * 1000)
+
+
+def snowflake_ids(row):
+    """The message, channel, guild and author ids of a row as integers"""
+    return (int(row[0]), int(row[1]), int(row[3]) if row[3] else None, int(row[5]))
+
+
+def file_fact(row, timestamp=epoch_ms):
+    """Reduce a file row to its indexed_files columns"""
+    return snowflake_ids(row) + row[7:11] + mime_category(row[10], row[7]) + (timestamp(row[12]), row[13])
+
+
+def link_fact(row, timestamp=epoch_ms):
+    """Reduce a link row to its indexed_links columns"""
+    return snowflake_ids(row) + row[7:9] + (url_registrable_domain(row[7]), timestamp(row[10]))
 
 
 class DatabaseManager:
     def __init__(self, db_path):
         self.db_path = db_path
+        self._local = threading.local()
+        self.rollup = StatsRollup()
+        
+        conn = self.get_connection()
+        try:
+            ensure_schema(conn)
+            self.pending_migrations = pending_migrations(conn)
+        finally:
+            conn.close()
     
     def get_connection(self):
+        # Reuse the long-lived connection if this thread has one
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
         conn = sqlite3.connect(self.db_path, timeout=30.0)
         # Enable WAL mode for better concurrent access
         conn.execute('PRAGMA journal_mode=WAL')
         conn.execute('PRAGMA busy_timeout=30000')
         return conn
     
-    def insert_file(self, message, attachment):
-        """Insert a file attachment into the database"""
+    def release_connection(self, conn):
+        """Close a connection unless it is this thread's long-lived one"""
+        if conn is not getattr(self._local, 'conn', None):
+            conn.close()
+    
+    def open_thread_connection(self):
+        """Open a long-lived connection for the calling thread"""
+        self._local.conn = None
+        self._local.conn = self.get_connection()
+    
+    def close_thread_connection(self):
+        """Close the calling thread's long-lived connection"""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+    
+    @staticmethod
+    def file_row(message, attachment):
+        """Build an indexed_files row for an attachment"""
+        return (
+            str(message.id),
+            str(message.channel.id),
+            message.channel.name,
+            str(message.guild.id) if message.guild else None,
+            message.guild.name if message.guild else None,
+            str(message.author.id),
+            str(message.author),
+            attachment.filename,
+            attachment.url,
+            attachment.size,
+            attachment.content_type,
+            message.content,
+            message.created_at,
+            parse_cdn_expiry(attachment.url)
+        )
+    
+    @staticmethod
+    def link_row(message, url):
+        """Build an indexed_links row for a URL"""
+        return (
+            str(message.id),
+            str(message.channel.id),
+            message.channel.name,
+            str(message.guild.id) if message.guild else None,
+            message.guild.name if message.guild else None,
+            str(message.author.id),
+            str(message.author),
+            url,
+            urlparse(url).netloc,
+            message.content,
+            message.created_at
+        )
+    
+    @staticmethod
+    def _upsert_dimensions(conn, file_rows, link_rows):
+        """Store the guild, channel, author and message of each row once"""
+        guilds, channels, authors, messages = {}, {}, {}, {}
+        for rows, content_index in ((file_rows, 11), (link_rows, 9)):
+            for row in rows:
+                guild_id = int(row[3]) if row[3] else None
+                if guild_id:
+                    guilds[guild_id] = row[4]
+                channels[int(row[1])] = (guild_id, row[2])
+                authors[int(row[5])] = row[6]
+                messages[int(row[0])] = (int(row[1]), int(row[5]), row[content_index])
+        
+        conn.executemany(UPSERT_GUILD_SQL, guilds.items())
+        conn.executemany(UPSERT_CHANNEL_SQL, [(key,) + value for key, value in channels.items()])
+        conn.executemany(UPSERT_AUTHOR_SQL, authors.items())
+        conn.executemany(UPSERT_MESSAGE_SQL, [(key,) + value for key, value in messages.items()])
+    
+    @staticmethod
+    def _timestamp_format(conn, table):
+        """How a fact table stores message times
+        
+        Tables not yet converted by the integer_ids migration keep text
+        timestamps until their rebuild swaps in.
+        """
+        if get_column_type(conn, table, 'timestamp') == 'INTEGER':
+            return epoch_ms
+        return lambda value: value
+    
+    def insert_rows(self, file_rows, link_rows):
+        """Insert batches of file and link rows in a single transaction
+        
+        Rows carry names and message text; those go to the dimension tables
+        and the fact tables only keep the snowflakes.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO indexed_files 
-                (message_id, channel_id, channel_name, guild_id, guild_name, 
-                 author_id, author_name, filename, file_url, file_size, file_type, 
-                 message_content, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                str(message.id),
-                str(message.channel.id),
-                message.channel.name,
-                str(message.guild.id) if message.guild else None,
-                message.guild.name if message.guild else None,
-                str(message.author.id),
-                str(message.author),
-                attachment.filename,
-                attachment.url,
-                attachment.size,
-                attachment.content_type,
-                message.content,
-                message.created_at
-            ))
-            
-            # File successfully inserted
-            file_id = cursor.lastrowid
-            if file_id and cursor.rowcount > 0:  # Only if a new row was inserted
-                conn.commit()
-                logger.info(f"Indexed file: {attachment.filename} from message {message.id}")
-                
-
-                
-                # File content extraction removed
-            else:
-                conn.commit()
-                
-        except Exception as e:
-            logger.error(f"Error inserting file: {e}")
+            with conn:
+                self._upsert_dimensions(conn, file_rows, link_rows)
+                if file_rows:
+                    timestamp = self._timestamp_format(conn, 'indexed_files')
+                    conn.executemany(INSERT_FILE_SQL, [file_fact(row, timestamp) for row in file_rows])
+                    self._enqueue_previews(conn, file_rows)
+                if link_rows:
+                    timestamp = self._timestamp_format(conn, 'indexed_links')
+                    conn.executemany(INSERT_LINK_SQL, [link_fact(row, timestamp) for row in link_rows])
         finally:
-            conn.close()
+            self.release_connection(conn)
     
-
+    @staticmethod
+    def _enqueue_previews(conn, file_rows):
+        """Queue preview jobs for the recent previewable files among file rows"""
+        if not PRERENDER:
+            return
+        cutoff = time.time() * 1000 - PRERENDER_MAX_AGE_MS
+        jobs = [(epoch_ms(row[12]), int(row[0]), row[8]) for row in file_rows
+                if row[10] in PREVIEW_TYPES and epoch_ms(row[12]) >= cutoff]
+        conn.executemany(ENQUEUE_PREVIEW_SQL, jobs)
     
-    def insert_link(self, message, url):
-        """Insert a link into the database"""
+    @staticmethod
+    def _sync_rows(conn, table, url_column, insert_sql, fact, message_id, rows, url_index, key):
+        """Diff one message's stored rows against its current rows"""
+        stored = conn.execute(
+            f'SELECT id, {url_column}, deleted_at FROM {table} WHERE message_id = ?', (message_id,)
+        ).fetchall()
+        current = {key(row[url_index]): row for row in rows}
+        live = {key(url): row_id for row_id, url, deleted_at in stored if deleted_at is None}
+        tombstoned = {key(url): row_id for row_id, url, deleted_at in stored if deleted_at is not None}
+        
+        gone = [(row_id,) for k, row_id in live.items() if k not in current]
+        restored = [(row_id,) for k, row_id in tombstoned.items() if k in current and k not in live]
+        new = [row for k, row in current.items() if k not in live and k not in tombstoned]
+        
+        conn.executemany(f'UPDATE {table} SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?', gone)
+        conn.executemany(f'UPDATE {table} SET deleted_at = NULL WHERE id = ?', restored)
+        timestamp = DatabaseManager._timestamp_format(conn, table)
+        conn.executemany(insert_sql, [fact(row, timestamp) for row in new])
+        return len(new) + len(restored), len(gone)
+    
+    def sync_message(self, message_id, content=None, file_rows=None, link_rows=None):
+        """Bring the stored rows of an edited message in line with the message
+        
+        file_rows and link_rows are the rows the message produces now; None
+        leaves that table untouched. Rows the message no longer produces are
+        tombstoned, new ones inserted and tombstoned ones that reappear
+        restored, all in one transaction. Attachments are matched without
+        their URL signature. Returns the number of rows added and removed.
+        """
+        message_id = int(message_id)
         conn = self.get_connection()
-        cursor = conn.cursor()
+        added = removed = 0
         
         try:
-            parsed_url = urlparse(url)
-            domain = parsed_url.netloc
-            
-            cursor.execute('''
-                INSERT OR IGNORE INTO indexed_links 
-                (message_id, channel_id, channel_name, guild_id, guild_name, 
-                 author_id, author_name, link_url, link_domain, message_content, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                str(message.id),
-                str(message.channel.id),
-                message.channel.name,
-                str(message.guild.id) if message.guild else None,
-                message.guild.name if message.guild else None,
-                str(message.author.id),
-                str(message.author),
-                url,
-                domain,
-                message.content,
-                message.created_at
-            ))
-            
-            # Link successfully inserted
-            link_id = cursor.lastrowid
-            if link_id and cursor.rowcount > 0:  # Only if a new row was inserted
-                conn.commit()
-                logger.info(f"Indexed link: {url} from message {message.id}")
-                
-
-            else:
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Error inserting link: {e}")
+            with conn:
+                self._upsert_dimensions(conn, file_rows or [], link_rows or [])
+                if file_rows is not None:
+                    counts = self._sync_rows(conn, 'indexed_files', 'file_url', INSERT_FILE_SQL, file_fact,
+                                             message_id, file_rows, 8, url_identity)
+                    added, removed = added + counts[0], removed + counts[1]
+                    self._enqueue_previews(conn, file_rows)
+                if link_rows is not None:
+                    counts = self._sync_rows(conn, 'indexed_links', 'link_url', INSERT_LINK_SQL, link_fact,
+                                             message_id, link_rows, 7, lambda url: url)
+                    added, removed = added + counts[0], removed + counts[1]
+                if content is not None:
+                    conn.execute(
+                        'UPDATE messages SET content = ? WHERE message_id = ? AND content IS NOT ?',
+                        (content, message_id, content)
+                    )
+            return added, removed
         finally:
-            conn.close()
+            self.release_connection(conn)
+    
+    def rename_channel(self, channel_id, name):
+        """Record a channel or thread's new name"""
+        conn = self.get_connection()
+        
+        try:
+            conn.execute('UPDATE channels SET name = ? WHERE channel_id = ?', (name, int(channel_id)))
+            conn.commit()
+        finally:
+            self.release_connection(conn)
+    
+    def rename_guild(self, guild_id, name):
+        """Record a guild's new name"""
+        conn = self.get_connection()
+        
+        try:
+            conn.execute('UPDATE guilds SET name = ? WHERE guild_id = ?', (name, int(guild_id)))
+            conn.commit()
+        finally:
+            self.release_connection(conn)
+    
+    def migrate_step(self, chunk_size):
+        """Advance pending schema migrations by one chunk"""
+        conn = self.get_connection()
+        
+        try:
+            return migrate_step(conn, chunk_size)
+        finally:
+            self.release_connection(conn)
+    
+    def tombstone_messages(self, message_ids):
+        """Mark the rows of deleted messages as deleted in one transaction
+        
+        Returns the number of rows tombstoned.
+        """
+        message_ids = [int(message_id) for message_id in message_ids]
+        conn = self.get_connection()
+        
+        try:
+            before = conn.total_changes
+            with conn:
+                for i in range(0, len(message_ids), 500):
+                    chunk = message_ids[i:i + 500]
+                    placeholders = ','.join('?' for _ in chunk)
+                    for table in ('indexed_files', 'indexed_links'):
+                        conn.execute(f'''
+                            UPDATE {table} SET deleted_at = CURRENT_TIMESTAMP
+                            WHERE message_id IN ({placeholders}) AND deleted_at IS NULL
+                        ''', chunk)
+            return conn.total_changes - before
+        finally:
+            self.release_connection(conn)
     
     def get_stats(self):
         """Get indexing statistics"""
@@ -147,18 +385,15 @@ class DatabaseManager:
         cursor = conn.cursor()
         
         try:
-            # Get file count
-            cursor.execute('SELECT COUNT(*) FROM indexed_files')
-            file_count = cursor.fetchone()[0]
-            
-            # Get link count
-            cursor.execute('SELECT COUNT(*) FROM indexed_links')
-            link_count = cursor.fetchone()[0]
+            # Get file and link counts from the rollups
+            file_count = self.rollup.total(conn, 'files')
+            link_count = self.rollup.total(conn, 'links')
             
             # Get latest indexing operation
             cursor.execute('''
                 SELECT operation_type, started_at, completed_at, status, 
-                       messages_processed, files_indexed, links_indexed
+                       messages_processed, files_indexed, links_indexed,
+                       index_mode, pages_saved
                 FROM indexing_stats 
                 ORDER BY started_at DESC LIMIT 1
             ''')
@@ -173,7 +408,7 @@ class DatabaseManager:
             logger.error(f"Error getting stats: {e}")
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def start_indexing_operation(self, operation_type, channel_id=None, channel_name=None):
         """Record the start of an indexing operation"""
@@ -192,9 +427,10 @@ class DatabaseManager:
             logger.error(f"Error starting indexing operation: {e}")
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
     
-    def complete_indexing_operation(self, operation_id, messages_processed, files_indexed, links_indexed):
+    def complete_indexing_operation(self, operation_id, messages_processed, files_indexed, links_indexed,
+                                    index_mode=None, pages_saved=0):
         """Mark an indexing operation as complete"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -203,138 +439,639 @@ class DatabaseManager:
             cursor.execute('''
                 UPDATE indexing_stats 
                 SET completed_at = ?, status = 'completed', 
-                    messages_processed = ?, files_indexed = ?, links_indexed = ?
+                    messages_processed = ?, files_indexed = ?, links_indexed = ?,
+                    index_mode = ?, pages_saved = ?
                 WHERE id = ?
-            ''', (datetime.now(), messages_processed, files_indexed, links_indexed, operation_id))
+            ''', (datetime.now(), messages_processed, files_indexed, links_indexed,
+                  index_mode, pages_saved, operation_id))
             conn.commit()
         except Exception as e:
             logger.error(f"Error completing indexing operation: {e}")
         finally:
-            conn.close()
+            self.release_connection(conn)
+    
+    def get_checkpoint(self, channel_id):
+        """Get the crawl checkpoint for a channel or thread"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT newest_message_id, oldest_message_id, backfill_complete, messages_seen
+                FROM channel_checkpoints WHERE channel_id = ?
+            ''', (int(channel_id),))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return {
+                'newest_message_id': row[0],
+                'oldest_message_id': row[1],
+                'backfill_complete': bool(row[2]),
+                'messages_seen': row[3]
+            }
+        finally:
+            self.release_connection(conn)
     
-    async def refresh_file_urls(self):
-        """Refresh all file URLs in the database"""
+    def save_checkpoint(self, channel_id, guild_id, checkpoint):
+        """Store the crawl checkpoint for a channel or thread"""
+        conn = self.get_connection()
+        
         try:
-            # Get all files that need URL refresh
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, message_id, channel_id, filename FROM indexed_files')
-            files = cursor.fetchall()
-            conn.close()
-            
-            refreshed_count = 0
-            batch_size = 10  # Process in smaller batches
-            
-            for i in range(0, len(files), batch_size):
-                batch = files[i:i + batch_size]
+            conn.execute('''
+                INSERT INTO channel_checkpoints 
+                (channel_id, guild_id, newest_message_id, oldest_message_id, 
+                 backfill_complete, messages_seen, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    guild_id = excluded.guild_id,
+                    newest_message_id = excluded.newest_message_id,
+                    oldest_message_id = excluded.oldest_message_id,
+                    backfill_complete = excluded.backfill_complete,
+                    messages_seen = excluded.messages_seen,
+                    updated_at = excluded.updated_at
+            ''', (
+                int(channel_id),
+                int(guild_id) if guild_id else None,
+                checkpoint['newest_message_id'],
+                checkpoint['oldest_message_id'],
+                int(checkpoint['backfill_complete']),
+                checkpoint['messages_seen']
+            ))
+            conn.commit()
+        finally:
+            self.release_connection(conn)
+    
+    def get_checkpoint_heads(self, guild_id):
+        """Get the newest indexed message of each checkpointed channel in a guild"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT channel_id, newest_message_id FROM channel_checkpoints
+                WHERE guild_id = ? AND newest_message_id IS NOT NULL
+            ''', (int(guild_id),))
+            return dict(cursor.fetchall())
+        finally:
+            self.release_connection(conn)
+    
+    def advance_checkpoints(self, heads):
+        """Move channels' newest indexed message forward after live messages
+        
+        heads maps channel_id to (newest message id, messages seen). All
+        channels are updated in one transaction.
+        """
+        conn = self.get_connection()
+        
+        try:
+            with conn:
+                conn.executemany('''
+                    UPDATE channel_checkpoints SET
+                        newest_message_id = MAX(newest_message_id, ?),
+                        messages_seen = messages_seen + ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE channel_id = ? AND newest_message_id IS NOT NULL
+                ''', [(int(newest), seen, int(channel_id)) for channel_id, (newest, seen) in heads.items()])
+        finally:
+            self.release_connection(conn)
+    
+    def backfill_url_expiry(self, chunk_size=5000):
+        """Parse and store the expiry of file URLs indexed before it was tracked"""
+        conn = self.get_connection()
+        last_id = 0
+        updated = 0
+        
+        try:
+            while True:
+                rows = conn.execute('''
+                    SELECT id, file_url FROM indexed_files
+                    WHERE id > ? AND url_expires_at IS NULL
+                    ORDER BY id LIMIT ?
+                ''', (last_id, chunk_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
                 
-                for file_id, message_id, channel_id, filename in batch:
-                    try:
-                        # Try to get the message and update the URL
-                        channel = bot.get_channel(int(channel_id))
-                        if channel:
-                            message = await channel.fetch_message(int(message_id))
-                            if message and message.attachments:
-                                # Find the matching attachment by filename
-                                for attachment in message.attachments:
-                                    if attachment.filename == filename:
-                                        # Update the URL in database with retry logic
-                                        for retry in range(3):
-                                            conn = None
-                                            try:
-                                                conn = self.get_connection()
-                                                cursor = conn.cursor()
-                                                # Check if this would create a duplicate entry
-                                                cursor.execute(
-                                                    'SELECT COUNT(*) FROM indexed_files WHERE message_id = ? AND file_url = ? AND id != ?',
-                                                    (str(message_id), attachment.url, file_id)
-                                                )
-                                                if cursor.fetchone()[0] == 0:
-                                                    cursor.execute(
-                                                        'UPDATE indexed_files SET file_url = ? WHERE id = ?',
-                                                        (attachment.url, file_id)
-                                                    )
-                                                else:
-                                                    logger.warning(f"Skipping URL update for file {filename} (ID: {file_id}) - would create duplicate entry")
-                                                conn.commit()
-                                                conn.close()
-                                                refreshed_count += 1
-                                                break
-                                            except sqlite3.OperationalError as db_e:
-                                                if conn:
-                                                    conn.close()
-                                                if "database is locked" in str(db_e) and retry < 2:
-                                                    await asyncio.sleep(1 + retry)  # Exponential backoff
-                                                    continue
-                                                else:
-                                                    raise db_e
-                                            except Exception as e:
-                                                if conn:
-                                                    conn.close()
-                                                raise e
-                                        break
-                    except Exception as e:
-                        logger.warning(f"Could not refresh URL for file {filename} (ID: {file_id}): {e}")
-                        continue
+                expiries = [(parse_cdn_expiry(url), file_id) for file_id, url in rows]
+                expiries = [row for row in expiries if row[0] is not None]
+                with conn:
+                    conn.executemany('UPDATE indexed_files SET url_expires_at = ? WHERE id = ?', expiries)
+                updated += len(expiries)
+            return updated
+        finally:
+            self.release_connection(conn)
+    
+    def get_refresh_candidates(self, horizon_seconds, retry_seconds):
+        """Get files whose URL expires within the horizon, soonest first
+        
+        Files without a known expiry come after those. Deleted attachments
+        and files tried in the last retry_seconds are left out, so URLs that
+        could not be refreshed are not tried again on every run.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = int(time.time())
+        
+        try:
+            cursor.execute('''
+                SELECT id, message_id, channel_id, filename, file_url FROM indexed_files
+                WHERE (url_expires_at IS NULL OR url_expires_at < ?)
+                  AND (url_checked_at IS NULL OR url_checked_at < ?)
+                  AND deleted_at IS NULL
+                ORDER BY url_expires_at IS NULL, url_expires_at
+            ''', (now + horizon_seconds, now - retry_seconds))
+            return cursor.fetchall()
+        finally:
+            self.release_connection(conn)
+    
+    def mark_urls_checked(self, file_ids):
+        """Record a refresh attempt on files, whatever its outcome"""
+        conn = self.get_connection()
+        
+        try:
+            with conn:
+                now = int(time.time())
+                conn.executemany('UPDATE indexed_files SET url_checked_at = ? WHERE id = ?',
+                                 [(now, file_id) for file_id in file_ids])
+        finally:
+            self.release_connection(conn)
+    
+    def update_file_url(self, file_id, message_id, file_url):
+        """Update a file's URL unless it would duplicate another row
+        
+        Returns False if the update was skipped.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            # Commits, or rolls back on error, so no transaction is left open
+            # on the thread's long-lived connection
+            with conn:
+                # Check if this would create a duplicate entry
+                cursor.execute(
+                    'SELECT COUNT(*) FROM indexed_files WHERE message_id = ? AND file_url = ? AND id != ?',
+                    (int(message_id), file_url, file_id)
+                )
+                if cursor.fetchone()[0] > 0:
+                    return False
                 
-                # Small delay between batches to reduce database pressure
-                if i + batch_size < len(files):
-                    await asyncio.sleep(0.1)
-            
-            logger.info(f"Refreshed {refreshed_count} file URLs")
-            return refreshed_count
-            
-        except Exception as e:
-            logger.error(f"Error refreshing file URLs: {e}")
-            return 0
+                cursor.execute(
+                    'UPDATE indexed_files SET file_url = ?, url_expires_at = ? WHERE id = ?',
+                    (file_url, parse_cdn_expiry(file_url), file_id)
+                )
+                return True
+        finally:
+            self.release_connection(conn)
+    
+    def update_file_urls(self, updates):
+        """Update the URLs of several files in one transaction
+        
+        updates is a list of (file_id, file_url) pairs. Returns the number of
+        files updated; updates that would duplicate another row are skipped.
+        """
+        conn = self.get_connection()
+        
+        try:
+            return apply_refreshed_urls(conn, updates)
+        finally:
+            self.release_connection(conn)
 
 # Initialize database manager
 db = DatabaseManager(config['database']['path'])
 
-def extract_urls(text):
-    """Extract URLs from text"""
-    url_pattern = re.compile(
-        r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    )
-    urls = url_pattern.findall(text)
+# All database access from coroutines goes through the database thread
+adb = AsyncDatabase(db)
+
+# Group-commit writer used for all message ingestion
+write_queue_config = config.get('write_queue', {})
+write_queue = WriteQueue(
+    adb,
+    batch_size=write_queue_config.get('batch_size', 500),
+    max_delay=write_queue_config.get('max_delay', 0.5)
+)
+
+# Attachment URL refresh settings
+url_refresh_config = config.get('url_refresh', {})
+
+# Event loop lag monitoring
+loop_monitor_config = config.get('loop_monitor', {})
+loop_monitor = LoopLagMonitor(
+    interval=loop_monitor_config.get('interval', 0.5),
+    threshold=loop_monitor_config.get('threshold', 0.25)
+)
+
+async def refresh_from_message(file_id, message_id, channel_id, filename):
+    """Refresh one file URL by fetching its message
+    
+    Returns True if the message still has the attachment.
+    """
+    channel = bot.get_channel(int(channel_id))
+    if not channel:
+        return False
+    
+    message = await channel.fetch_message(int(message_id))
+    if not message or not message.attachments:
+        return False
+    
+    # Find the matching attachment by filename
+    for attachment in message.attachments:
+        if attachment.filename == filename:
+            # Update the URL in database with retry logic
+            for retry in range(3):
+                try:
+                    if not await adb.update_file_url(file_id, message_id, attachment.url):
+                        logger.warning(f"Skipping URL update for file {filename} (ID: {file_id}) - would create duplicate entry")
+                    return True
+                except sqlite3.OperationalError as db_e:
+                    if "database is locked" in str(db_e) and retry < 2:
+                        await asyncio.sleep(1 + retry)  # Exponential backoff
+                        continue
+                    else:
+                        raise db_e
+    return False
+
+async def refresh_urls_in_bulk(files):
+    """Refresh file URLs through the refresh-urls endpoint
+    
+    Each batch of URLs is refreshed with one API request and written back
+    in one transaction. Returns the number of files updated and the
+    candidate rows whose URL the endpoint did not refresh.
+    """
+    refreshed_count = 0
+    leftover = []
     
-    # Clean up URLs by removing trailing punctuation that's commonly found at sentence ends
-    cleaned_urls = []
-    for url in urls:
-        # Remove trailing punctuation like ), ,, ., ;, :, !, ?
-        cleaned_url = re.sub(r'[),.:;!?]+$', '', url)
-        cleaned_urls.append(cleaned_url)
+    async with aiohttp.ClientSession() as session:
+        refresher = AttachmentURLRefresher(session, config['discord']['token'],
+                                           base_url=crawler_config.get('api_base_url', DISCORD_API),
+                                           budget=rate_budget)
+        
+        for i in range(0, len(files), REFRESH_BATCH_SIZE):
+            batch = files[i:i + REFRESH_BATCH_SIZE]
+            try:
+                refreshed = await refresher.refresh([row[4] for row in batch])
+            except Exception as e:
+                logger.warning(f"Bulk URL refresh failed for {len(batch)} files: {e}")
+                refreshed = {}
+            
+            updates = [(row[0], refreshed[row[4]]) for row in batch if row[4] in refreshed]
+            if updates:
+                refreshed_count += await adb.update_file_urls(updates)
+            leftover.extend(row for row in batch if row[4] not in refreshed)
+        
+        logger.info(f"Bulk refreshed {len(files) - len(leftover)} file URLs in {refresher.requests} requests")
     
-    return cleaned_urls
+    return refreshed_count, leftover
+
+async def refresh_file_urls():
+    """Refresh file URLs that expire within the configured horizon"""
+    try:
+        # Store expiries for rows indexed before they were tracked
+        backfilled = await adb.backfill_url_expiry()
+        if backfilled:
+            logger.info(f"Stored URL expiry for {backfilled} previously indexed files")
+        
+        # Get files whose URLs are about to expire
+        horizon_hours = url_refresh_config.get('horizon_hours', 48)
+        files = await adb.get_refresh_candidates(horizon_hours * 3600,
+                                                 url_refresh_config.get('retry_hours', 72) * 3600)
+        logger.info(f"{len(files)} file URLs expire within {horizon_hours} hours")
+        candidate_ids = [row[0] for row in files]
+        
+        refreshed_count = 0
+        if files and url_refresh_config.get('bulk', True):
+            refreshed_count, files = await refresh_urls_in_bulk(files)
+        
+        # Fall back to fetching the message for URLs the endpoint could not refresh
+        batch_size = 10  # Process in smaller batches
+        
+        for i in range(0, len(files), batch_size):
+            batch = files[i:i + batch_size]
+            
+            for file_id, message_id, channel_id, filename, _ in batch:
+                try:
+                    if await refresh_from_message(file_id, message_id, channel_id, filename):
+                        refreshed_count += 1
+                except Exception as e:
+                    logger.warning(f"Could not refresh URL for file {filename} (ID: {file_id}): {e}")
+                    continue
+            
+            # Small delay between batches to reduce database pressure
+            if i + batch_size < len(files):
+                await asyncio.sleep(0.1)
+        
+        # Refreshed files now expire later; the rest wait out retry_hours
+        await adb.mark_urls_checked(candidate_ids)
+        
+        logger.info(f"Refreshed {refreshed_count} file URLs")
+        return refreshed_count
+        
+    except Exception as e:
+        logger.error(f"Error refreshing file URLs: {e}")
+        return 0
+
+# Messages returned per history API request
+HISTORY_PAGE_SIZE = 100
+
+# Threads returned per archived threads API request
+ARCHIVED_THREADS_PAGE_SIZE = 100
+
+# Save channel checkpoints at least every this many messages
+CHECKPOINT_INTERVAL = 1000
 
 async def process_message(message):
-    """Process a message for attachments and links"""
+    """Process a message for attachments and links
+    
+    Rows are handed to the write queue. Returns the number of files and
+    links queued plus an acknowledgement that resolves once their batch is
+    committed, so callers decide whether to wait for the commit.
+    """
     if message.author.bot:
-        return 0, 0  # Skip bot messages
+        return 0, 0, None  # Skip bot messages
     
-    files_indexed = 0
-    links_indexed = 0
+    acks = []
     
     # Process attachments
     for attachment in message.attachments:
-        db.insert_file(message, attachment)
-        files_indexed += 1
+        acks.append(write_queue.submit_file(db.file_row(message, attachment)))
+    files_indexed = len(acks)
     
     # Process links in message content
     if message.content:
         urls = extract_urls(message.content)
         for url in urls:
-            db.insert_link(message, url)
-            links_indexed += 1
+            acks.append(write_queue.submit_link(db.link_row(message, url)))
+    links_indexed = len(acks) - files_indexed
+    
+    return files_indexed, links_indexed, asyncio.gather(*acks)
+
+async def index_channel(channel, budget=None, fetcher=None, gap_only=False):
+    """Index one channel or thread, resuming from its checkpoint
+    
+    Without a checkpoint the whole history is walked newest to oldest.
+    Otherwise only messages after the newest checkpointed message are
+    fetched, followed by the rest of an unfinished backfill from before the
+    oldest one. The checkpoint only advances past rows that are committed.
+    Every history page takes a token from the shared rate-limit budget.
+    
+    With a RawHistoryFetcher, history is read as raw JSON payloads instead
+    of discord.Message objects. With gap_only, only messages after the
+    checkpoint are fetched and an unfinished backfill is left to /index.
+    """
+    checkpoint = await adb.get_checkpoint(channel.id)
+    result = {'messages': 0, 'files': 0, 'links': 0, 'mode': 'full', 'pages_saved': 0}
+    
+    if gap_only and (not checkpoint or checkpoint['newest_message_id'] is None):
+        return result
+    
+    if checkpoint:
+        if gap_only:
+            result['mode'] = 'gap_fill'
+        else:
+            result['mode'] = 'incremental' if checkpoint['backfill_complete'] else 'resume'
+        # Pages a full walk would have fetched again for already covered messages
+        result['pages_saved'] = -(-checkpoint['messages_seen'] // HISTORY_PAGE_SIZE)
+    else:
+        checkpoint = {
+            'newest_message_id': None,
+            'oldest_message_id': None,
+            'backfill_complete': False,
+            'messages_seen': 0
+        }
+    
+    # Nothing new since the last run; skip the history request entirely
+    last_message_id = getattr(channel, 'last_message_id', None)
+    if ((checkpoint['backfill_complete'] or gap_only) and last_message_id is not None
+            and checkpoint['newest_message_id'] is not None
+            and last_message_id <= checkpoint['newest_message_id']):
+        result['pages_saved'] += 1
+        return result
+    
+    pending_acks = []
+    guild_id = channel.guild.id if channel.guild else None
+    guild_name = channel.guild.name if channel.guild else None
+    route = f"GET /channels/{channel.id}/messages"
+    
+    async def commit():
+        nonlocal pending_acks
+        acks, pending_acks = pending_acks, []
+        # The saved checkpoint still ends at the last fully committed batch,
+        # so if this raises the next run fetches these messages again
+        await require_committed(acks, f"Rows from {channel.name} were not committed; checkpoint not advanced")
+        await adb.save_checkpoint(channel.id, guild_id, checkpoint)
+    
+    async def model_entries(before=None, after=None):
+        history = channel.history(limit=None, before=before and discord.Object(id=before),
+                                  after=after and discord.Object(id=after), oldest_first=after is not None)
+        walked = 0
+        if budget:
+            await budget.acquire(route)
+        async for message in history:
+            walked += 1
+            if budget and walked % HISTORY_PAGE_SIZE == 0:
+                # The next message comes from a new page
+                await budget.acquire(route)
+            files_indexed, links_indexed, ack = await process_message(message)
+            yield message.id, files_indexed, links_indexed, ack
+    
+    async def raw_entries(before=None, after=None):
+        async for page in fetcher.pages(channel.id, before=before, after=after):
+            for payload in page:
+                file_rows, link_rows = project_message(payload, channel.name, guild_id, guild_name)
+                acks = [write_queue.submit_file(row) for row in file_rows]
+                acks += [write_queue.submit_link(row) for row in link_rows]
+                yield int(payload['id']), len(file_rows), len(link_rows), asyncio.gather(*acks)
+    
+    entries = raw_entries if fetcher else model_entries
+    
+    async def walk(before=None, after=None):
+        async for message_id, files_indexed, links_indexed, ack in entries(before=before, after=after):
+            result['messages'] += 1
+            result['files'] += files_indexed
+            result['links'] += links_indexed
+            if files_indexed or links_indexed:
+                pending_acks.append(ack)
+            
+            newest = checkpoint['newest_message_id']
+            oldest = checkpoint['oldest_message_id']
+            checkpoint['newest_message_id'] = message_id if newest is None else max(newest, message_id)
+            checkpoint['oldest_message_id'] = message_id if oldest is None else min(oldest, message_id)
+            checkpoint['messages_seen'] += 1
+            
+            if result['messages'] % 100 == 0:
+                logger.info(f"Progress: {channel.name}: {result['messages']} messages processed")
+            
+            # Keep the crawl at most one batch ahead of the writer
+            if len(pending_acks) >= write_queue.batch_size or result['messages'] % CHECKPOINT_INTERVAL == 0:
+                await commit()
+        await commit()
+    
+    if checkpoint['newest_message_id'] is not None:
+        # Messages posted since the last run, oldest first
+        await walk(after=checkpoint['newest_message_id'])
+    
+    if not gap_only and (not checkpoint['backfill_complete'] or checkpoint['newest_message_id'] is None):
+        # Full walk, or the remainder of an interrupted one
+        await walk(before=checkpoint['oldest_message_id'])
+        checkpoint['backfill_complete'] = True
+        await commit()
+    
+    return result
+
+async def enumerate_threads(guild, budget=None, concurrency=4):
+    """List the active and archived threads of a guild
+    
+    Covers threads in text channels and posts in forum channels. Archived
+    threads are listed per parent channel concurrently; private archived
+    threads are only included where the bot can manage threads.
+    """
+    threads = {}
+    
+    try:
+        if budget:
+            await budget.acquire(f"GET /guilds/{guild.id}/threads/active")
+        for thread in await guild.active_threads():
+            threads[thread.id] = thread
+    except discord.Forbidden:
+        logger.warning(f"No permission to list active threads in {guild.name}")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def list_archived(parent, private):
+        kind = 'private' if private else 'public'
+        route = f"GET /channels/{parent.id}/threads/archived/{kind}"
+        found = []
+        async with semaphore:
+            try:
+                if budget:
+                    await budget.acquire(route)
+                async for thread in parent.archived_threads(limit=None, private=private):
+                    found.append(thread)
+                    if budget and len(found) % ARCHIVED_THREADS_PAGE_SIZE == 0:
+                        await budget.acquire(route)
+            except discord.Forbidden:
+                logger.warning(f"No permission to list {kind} archived threads in {parent.name}")
+        return found
+    
+    jobs = []
+    for parent in list(guild.text_channels) + list(guild.forums):
+        permissions = parent.permissions_for(guild.me)
+        if not permissions.read_message_history:
+            continue
+        jobs.append(list_archived(parent, private=False))
+        if isinstance(parent, discord.TextChannel) and permissions.manage_threads:
+            jobs.append(list_archived(parent, private=True))
+    
+    for found in await asyncio.gather(*jobs):
+        for thread in found:
+            threads[thread.id] = thread
+    
+    return list(threads.values())
+
+# Channels whose checkpoint on_message keeps current. Cleared whenever the
+# gateway connection drops, since events may be missed until the next gap-fill.
+live_channels = set()
+
+# Newest committed live message and number of live messages per channel,
+# written to channel_checkpoints in one transaction by flush_live_heads
+live_heads = {}
+gap_fill_task = None
+
+async def fill_gaps(reason):
+    """Index messages posted while the bot was not receiving events
+    
+    Compares each checkpointed channel's newest indexed message with its
+    last_message_id and fetches only the missing window, several channels
+    at a time under the shared rate-limit budget. Channels that were never
+    indexed are left to /index.
+    """
+    started = time.monotonic()
+    lagging = []
+    
+    for guild in bot.guilds:
+        heads = await adb.get_checkpoint_heads(guild.id)
+        for channel in list(guild.text_channels) + list(guild.threads):
+            newest = heads.get(channel.id)
+            if newest is None:
+                continue
+            if channel.last_message_id is not None and channel.last_message_id > newest:
+                lagging.append(channel)
+            else:
+                live_channels.add(channel.id)
+    
+    if not lagging:
+        logger.info(f"No gaps to fill after {reason}")
+        return
+    
+    logger.info(f"Filling gaps in {len(lagging)} channels after {reason}")
+    operation_id = await adb.start_indexing_operation("gap_fill")
+    
+    concurrency = config.get('gap_fill', {}).get('concurrency', crawler_config.get('concurrency', 4))
+    crawler = ChannelCrawler(functools.partial(index_channel, gap_only=True), rate_budget, concurrency=concurrency)
+    results = await crawler.crawl(lagging)
     
-    return files_indexed, links_indexed
+    total_messages = 0
+    total_files = 0
+    total_links = 0
+    for channel, result, error in results:
+        if error:
+            logger.warning(f"Could not fill gap in channel {channel.name}: {error}")
+            continue
+        live_channels.add(channel.id)
+        total_messages += result['messages']
+        total_files += result['files']
+        total_links += result['links']
+    
+    await adb.complete_indexing_operation(operation_id, total_messages, total_files, total_links,
+                                          index_mode='gap_fill')
+    logger.info(f"Gap-fill complete in {time.monotonic() - started:.1f}s: {total_messages} messages, "
+                f"{total_files} files, {total_links} links")
+
+migration_task = None
+
+async def run_migrations():
+    """Run pending schema migrations a chunk at a time alongside normal writes"""
+    chunk_size = config.get('migrations', {}).get('chunk_size', 5000)
+    logger.info(f"Running schema migrations in the background: {', '.join(db.pending_migrations)}")
+    started = time.monotonic()
+    
+    try:
+        while await adb.migrate_step(chunk_size):
+            # Let queued writes and reads in between chunks
+            await asyncio.sleep(0)
+        db.pending_migrations = []
+        logger.info(f"Schema migrations complete in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        logger.error(f"Error running schema migrations: {e}")
+
+def start_gap_fill(reason):
+    """Start a gap-fill, or queue another pass after the running one"""
+    global gap_fill_task
+    if gap_fill_task and not gap_fill_task.done():
+        # The running pass may have compared positions before this reconnect
+        gap_fill_task.add_done_callback(lambda _: start_gap_fill(reason))
+        return
+    gap_fill_task = asyncio.create_task(fill_gaps(reason))
+
+@tasks.loop(seconds=config.get('gap_fill', {}).get('checkpoint_interval', 5))
+async def flush_live_heads():
+    """Write the checkpoints of live channels that moved since the last flush"""
+    global live_heads
+    if not live_heads:
+        return
+    heads, live_heads = live_heads, {}
+    try:
+        await adb.advance_checkpoints(heads)
+    except Exception as e:
+        # The checkpoints stay behind, so the next gap-fill fetches these again
+        logger.error(f"Error advancing checkpoints of {len(heads)} live channels: {e}")
 
 @tasks.loop(hours=24)
 async def daily_url_refresh():
     """Daily task to refresh all file URLs"""
     logger.info("Starting daily URL refresh...")
     try:
-        refreshed_count = await db.refresh_file_urls()
+        refreshed_count = await refresh_file_urls()
         logger.info(f"Daily URL refresh completed. Refreshed {refreshed_count} URLs.")
     except Exception as e:
         logger.error(f"Error during daily URL refresh: {e}")
@@ -345,10 +1082,23 @@ async def daily_url_refresh():
 async def on_ready():
     logger.info(f'{bot.user} has connected to Discord!')
     
-    # Start the daily URL refresh task
+    # Start the group-commit writer and the event loop lag monitor
+    write_queue.start()
+    loop_monitor.start()
+    
+    # Start the daily URL refresh task and the live checkpoint writer
     if not daily_url_refresh.is_running():
         daily_url_refresh.start()
+    if not flush_live_heads.is_running():
+        flush_live_heads.start()
     
+    # Convert older database layouts without stopping indexing
+    global migration_task
+    if db.pending_migrations and migration_task is None:
+        migration_task = asyncio.create_task(run_migrations())
+    
+    # Catch up on messages posted while the bot was offline
+    start_gap_fill("startup" if gap_fill_task is None else "reconnect")
 
     
     # Sync slash commands
@@ -358,6 +1108,16 @@ async def on_ready():
     except Exception as e:
         logger.error(f"Failed to sync commands: {e}")
 
+@bot.event
+async def on_resumed():
+    logger.info("Gateway session resumed")
+    start_gap_fill("resume")
+
+@bot.event
+async def on_disconnect():
+    # Events may be missed until the next gap-fill has run
+    live_channels.clear()
+
 @bot.event
 async def on_message(message):
     """Automatically index new messages"""
@@ -365,20 +1125,100 @@ async def on_message(message):
         return
     
     # Process the message for attachments and links
-    files_indexed, links_indexed = await process_message(message)
+    files_indexed, links_indexed, ack = await process_message(message)
+    committed = all(await ack)
     
     if files_indexed > 0 or links_indexed > 0:
-        logger.info(f"Auto-indexed message {message.id}: {files_indexed} files, {links_indexed} links")
+        if committed:
+            logger.info(f"Auto-indexed message {message.id}: {files_indexed} files, {links_indexed} links")
+        else:
+            logger.error(f"Rows of message {message.id} were not committed")
+    
+    channel_id = message.channel.id
+    if channel_id in live_channels:
+        if committed:
+            newest, seen = live_heads.get(channel_id, (0, 0))
+            live_heads[channel_id] = (max(newest, message.id), seen + 1)
+        else:
+            # Keep the checkpoint behind this message and let a gap-fill
+            # fetch the channel again from there
+            live_channels.discard(channel_id)
+            live_heads.pop(channel_id, None)
+            start_gap_fill("failed write")
     
     # Process commands
     await bot.process_commands(message)
 
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.name != after.name:
+        await adb.rename_channel(after.id, after.name)
+
+@bot.event
+async def on_thread_update(before, after):
+    if before.name != after.name:
+        await adb.rename_channel(after.id, after.name)
+
+@bot.event
+async def on_guild_update(before, after):
+    if before.name != after.name:
+        await adb.rename_guild(after.id, after.name)
+
+@bot.event
+async def on_raw_message_edit(payload):
+    """Keep the rows of edited messages in line with their attachments and links"""
+    data = payload.data
+    author = data.get('author')
+    if not author or author.get('bot'):
+        return
+    
+    channel = bot.get_channel(payload.channel_id)
+    guild = bot.get_guild(payload.guild_id) if payload.guild_id else None
+    file_rows, link_rows = project_message(data, getattr(channel, 'name', None), payload.guild_id,
+                                           guild.name if guild else None)
+    
+    try:
+        # Rows of a just-posted message may still be waiting in the write queue
+        await write_queue.flush()
+        added, removed = await adb.sync_message(
+            payload.message_id,
+            data.get('content'),
+            file_rows if 'attachments' in data else None,
+            link_rows if 'content' in data else None
+        )
+        if added or removed:
+            logger.info(f"Updated edited message {payload.message_id}: {added} rows added, {removed} removed")
+    except Exception as e:
+        logger.error(f"Error updating edited message {payload.message_id}: {e}")
+
+@bot.event
+async def on_raw_message_delete(payload):
+    """Tombstone the rows of a deleted message"""
+    try:
+        await write_queue.flush()
+        removed = await adb.tombstone_messages([payload.message_id])
+        if removed:
+            logger.info(f"Removed {removed} rows of deleted message {payload.message_id}")
+    except Exception as e:
+        logger.error(f"Error removing deleted message {payload.message_id}: {e}")
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    """Tombstone the rows of bulk-deleted messages"""
+    try:
+        await write_queue.flush()
+        removed = await adb.tombstone_messages(payload.message_ids)
+        if removed:
+            logger.info(f"Removed {removed} rows of {len(payload.message_ids)} bulk-deleted messages")
+    except Exception as e:
+        logger.error(f"Error removing {len(payload.message_ids)} bulk-deleted messages: {e}")
+
 @bot.tree.command(name="stats", description="Display indexing statistics")
 async def stats_command(interaction: discord.Interaction):
     """Display current indexing statistics"""
     await interaction.response.defer()
     
-    stats = db.get_stats()
+    stats = await adb.get_stats()
     if not stats:
         await interaction.followup.send("❌ Error retrieving statistics.")
         return
@@ -411,29 +1251,51 @@ async def stats_command(interaction: discord.Interaction):
         op = stats['latest_operation']
         embed.add_field(
             name="🔄 Latest Operation",
-            value=f"Type: {op[0]}\nStatus: {op[3]}\nProcessed: {op[4]} messages",
+            value=f"Type: {op[0]}\nMode: {op[7] or 'n/a'}\nStatus: {op[3]}\nProcessed: {op[4]} messages\n"
+                  f"Pages skipped: {op[8] or 0:,}",
             inline=False
         )
     
+    queue_stats = write_queue.get_stats()
+    embed.add_field(
+        name="💾 Write Queue",
+        value=f"Batches: {queue_stats['batches_written']:,} ({queue_stats['batches_failed']} failed)\n"
+              f"Rows: {queue_stats['rows_written']:,}, pending: {queue_stats['pending']}\n"
+              f"Latency: avg {queue_stats['avg_batch_ms']} ms, max {queue_stats['max_batch_ms']} ms",
+        inline=False
+    )
+    
+    lag_stats = loop_monitor.get_stats()
+    embed.add_field(
+        name="⏱️ Event Loop",
+        value=f"Stalls over {lag_stats['threshold_ms']} ms: {lag_stats['stalls']:,}\n"
+              f"Max lag: {lag_stats['max_lag_ms']} ms",
+        inline=False
+    )
+    
     embed.set_footer(text="Discord Indexer Bot")
     
     await interaction.followup.send(embed=embed)
 
 @bot.tree.command(name="index", description="Index all channels and historical messages")
-async def index_command(interaction: discord.Interaction):
+@app_commands.describe(raw_history="Read history as raw JSON pages instead of full message objects")
+async def index_command(interaction: discord.Interaction, raw_history: bool = None):
     """Index all channels with historical messages"""
     await interaction.response.defer()
     
+    if raw_history is None:
+        raw_history = crawler_config.get('raw_history', False)
+    
     if not interaction.guild:
         await interaction.followup.send("❌ This command can only be used in a server.")
         return
     
     # Start indexing operation
-    operation_id = db.start_indexing_operation("full_index", str(interaction.guild.id), interaction.guild.name)
+    operation_id = await adb.start_indexing_operation("full_index", str(interaction.guild.id), interaction.guild.name)
     
     embed = discord.Embed(
         title="🔄 Starting Full Index",
-        description="Indexing all channels and historical messages...",
+        description="Indexing all channels, threads and historical messages...",
         color=discord.Color.orange()
     )
     
@@ -442,31 +1304,56 @@ async def index_command(interaction: discord.Interaction):
     total_messages = 0
     total_files = 0
     total_links = 0
+    pages_saved = 0
+    modes = set()
     
     try:
-        # Process all text channels
-        for channel in interaction.guild.text_channels:
-            try:
-                logger.info(f"Indexing channel: {channel.name}")
-                
-                async for message in channel.history(limit=None):
-                    files_indexed, links_indexed = await process_message(message)
-                    total_messages += 1
-                    total_files += files_indexed
-                    total_links += links_indexed
-                    
-                    # Update progress every 100 messages
-                    if total_messages % 100 == 0:
-                        logger.info(f"Progress: {total_messages} messages processed")
-                        
-            except discord.Forbidden:
+        # Process all text channels, threads and forum posts, several at a time
+        concurrency = crawler_config.get('concurrency', 4)
+        started = time.monotonic()
+        
+        threads = await enumerate_threads(interaction.guild, rate_budget, concurrency)
+        logger.info(f"Found {len(threads)} threads and forum posts to index")
+        channels = list(interaction.guild.text_channels) + threads
+        
+        if raw_history:
+            async with aiohttp.ClientSession() as session:
+                fetcher = RawHistoryFetcher(session, config['discord']['token'],
+                                            base_url=crawler_config.get('api_base_url', DISCORD_API),
+                                            budget=rate_budget)
+                crawler = ChannelCrawler(functools.partial(index_channel, fetcher=fetcher), rate_budget,
+                                         concurrency=concurrency)
+                results = await crawler.crawl(channels)
+        else:
+            crawler = ChannelCrawler(index_channel, rate_budget, concurrency=concurrency)
+            results = await crawler.crawl(channels)
+        
+        for channel, result, error in results:
+            if isinstance(error, (discord.Forbidden, HistoryForbidden)):
                 logger.warning(f"No permission to read channel: {channel.name}")
-            except Exception as e:
-                logger.error(f"Error indexing channel {channel.name}: {e}")
+                continue
+            if error:
+                logger.error(f"Error indexing channel {channel.name}: {error}")
+                continue
+            
+            live_channels.add(channel.id)
+            total_messages += result['messages']
+            total_files += result['files']
+            total_links += result['links']
+            pages_saved += result['pages_saved']
+            modes.add(result['mode'])
+        
+        elapsed = time.monotonic() - started
+        logger.info(f"Crawled {total_messages} messages in {elapsed:.1f}s "
+                    f"({total_messages / elapsed if elapsed else 0:.1f} msg/s, peak RSS {peak_rss_mb():.0f} MB, "
+                    f"{'raw' if raw_history else 'model'} history), budget: {rate_budget.get_stats()}")
+        
+        index_mode = modes.pop() if len(modes) == 1 else ('mixed' if modes else None)
         
         # Complete the operation
         if operation_id:
-            db.complete_indexing_operation(operation_id, total_messages, total_files, total_links)
+            await adb.complete_indexing_operation(operation_id, total_messages, total_files, total_links,
+                                                  index_mode, pages_saved)
         
         # Send completion message
         completion_embed = discord.Embed(
@@ -480,6 +1367,12 @@ async def index_command(interaction: discord.Interaction):
             inline=False
         )
         
+        completion_embed.add_field(
+            name="⏩ Mode",
+            value=f"{index_mode or 'n/a'} ({pages_saved:,} history pages skipped)",
+            inline=False
+        )
+        
         await interaction.followup.send(embed=completion_embed)
         logger.info(f"Full indexing completed: {total_messages} messages, {total_files} files, {total_links} links")
         
@@ -492,7 +1385,7 @@ async def index_command(interaction: discord.Interaction):
         )
         await interaction.followup.send(embed=error_embed)
 
-@bot.tree.command(name="refresh_urls", description="Manually refresh all file URLs to prevent expiration")
+@bot.tree.command(name="refresh_urls", description="Manually refresh file URLs that are about to expire")
 async def refresh_urls_command(interaction: discord.Interaction):
     """Manually trigger URL refresh"""
     await interaction.response.defer()
@@ -501,13 +1394,13 @@ async def refresh_urls_command(interaction: discord.Interaction):
         # Start refresh
         start_embed = discord.Embed(
             title="🔄 Refreshing URLs",
-            description="Starting to refresh all file URLs...",
+            description="Starting to refresh file URLs that are about to expire...",
             color=discord.Color.orange()
         )
         await interaction.followup.send(embed=start_embed)
         
         # Perform refresh
-        refreshed_count = await db.refresh_file_urls()
+        refreshed_count = await refresh_file_urls()
         
         # Send completion message
         completion_embed = discord.Embed(
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import string
+from collections import namedtuple
+
+from result_cache import ResultCache
+
+# Searches stop counting after this many matches and report "at least"
+DEFAULT_COUNT_LIMIT = 10000
+
+# A listing total. at_least is set when counting stopped at the limit, so
+# count is a lower bound.
+Total = namedtuple('Total', ['count', 'at_least'])
+
+# LIKE and FTS5 both match ASCII letters case-insensitively
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def filter_key(source, search=None, value=None, tag_ids=None):
+    """Normalize listing filters into a cache key
+
+    Filters that select the same rows give the same key: ASCII letters are
+    lowercased and tag ids become an unordered set. search should be the
+    FTS5 MATCH expression when searching the index, so that differently
+    spaced or quoted input building the same expression shares its count,
+    and the raw LIKE text otherwise.
+    """
+    if tag_ids is not None and not isinstance(tag_ids, list):
+        tag_ids = [tag_ids]
+    return (
+        source,
+        (search or '').translate(ASCII_LOWER),
+        (value or '').translate(ASCII_LOWER),
+        tuple(sorted(set(tag_ids or []))),
+    )
+
+class CountCache:
+    """Cache listing totals per filter key until the database changes"""
+
+    def __init__(self, db_path, limit=DEFAULT_COUNT_LIMIT, max_entries=1000):
+        self.limit = limit
+        self.cache = ResultCache(db_path, max_entries=max_entries)
+
+    def count(self, conn, key, from_sql, params, distinct_column=None, capped=False):
+        """Count the rows of a listing, from the cache when possible
+
+        from_sql is the listing's FROM and WHERE clauses and params their
+        parameters. distinct_column counts distinct values of that column
+        instead of rows, for joins that can repeat a row. capped stops at
+        the count limit, for filters too costly to count exhaustively.
+        """
+        def compute():
+            rows = f'SELECT DISTINCT {distinct_column} {from_sql}' if distinct_column else f'SELECT 1 {from_sql}'
+            if capped:
+                count = conn.execute(f'SELECT COUNT(*) FROM ({rows} LIMIT ?)', params + [self.limit + 1]).fetchone()[0]
+                return Total(min(count, self.limit), count > self.limit)
+            return Total(conn.execute(f'SELECT COUNT(*) FROM ({rows})', params).fetchone()[0], False)
+
+        return self.cache.cached(key, compute)
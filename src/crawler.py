@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import re
+import resource
+import sys
+import time
+
+import aiohttp
+
+logger = logging.getLogger('DiscordIndexer.Crawler')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in megabytes"""
+    # VmHWM is reset on exec, unlike ru_maxrss which inherits the parent's peak
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class RateLimitBudget:
+    """Token bucket shared by every crawl worker.
+
+    Tokens refill at a steady rate up to a burst size and each history
+    request takes one. Rate-limit headers returned by Discord tighten the
+    budget further: an exhausted route bucket blocks requests on that route
+    until it resets, and a global limit pauses every route.
+    """
+
+    def __init__(self, rate=40.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        # route -> (remaining requests, monotonic time the bucket resets)
+        self._routes = {}
+        self._global_reset_at = 0.0
+
+        self.requests = 0
+        self.waited = 0.0
+        self.rate_limited = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, route=None):
+        """Wait for a token and for the route's bucket to allow a request"""
+        started = time.monotonic()
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                wait = max(0.0, self._global_reset_at - now)
+
+                if route in self._routes:
+                    remaining, reset_at = self._routes[route]
+                    if remaining <= 0 and reset_at > now:
+                        wait = max(wait, reset_at - now)
+
+                if wait <= 0:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        if route in self._routes:
+                            remaining, reset_at = self._routes[route]
+                            self._routes[route] = (remaining - 1, reset_at)
+                        break
+                    wait = (1 - self._tokens) / self.rate
+
+            await asyncio.sleep(wait)
+
+        self.requests += 1
+        self.waited += time.monotonic() - started
+
+    def update_from_headers(self, route, headers, status=None):
+        """Apply X-RateLimit-* headers from a Discord API response"""
+        now = time.monotonic()
+
+        if status == 429:
+            self.rate_limited += 1
+            retry_after = float(headers.get('Retry-After') or headers.get('X-RateLimit-Reset-After') or 1.0)
+            if headers.get('X-RateLimit-Global', '').lower() == 'true' or headers.get('X-RateLimit-Scope') == 'global':
+                self._global_reset_at = max(self._global_reset_at, now + retry_after)
+                logger.warning(f"Global rate limit hit, pausing all requests for {retry_after:.2f}s")
+            else:
+                self._routes[route] = (0, now + retry_after)
+                logger.warning(f"Rate limited on {route}, retrying in {retry_after:.2f}s")
+            return
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_after = headers.get('X-RateLimit-Reset-After')
+        if remaining is not None and reset_after is not None:
+            self._routes[route] = (int(remaining), now + float(reset_after))
+
+    def get_stats(self):
+        return {
+            'requests': self.requests,
+            'waited_seconds': round(self.waited, 2),
+            'rate_limited': self.rate_limited
+        }
+
+
+def api_route(method, url):
+    """The budget route of a Discord API request, e.g. 'GET /channels/1/messages'"""
+    return f"{method} {re.sub(r'^/api(/v[0-9]+)?', '', url.path)}"
+
+
+def rate_limit_trace(budget):
+    """An aiohttp TraceConfig that feeds every response's rate-limit headers
+    into budget, for clients such as discord.py's that make the requests"""
+    async def on_request_end(session, context, params):
+        budget.update_from_headers(api_route(params.method, params.url), params.response.headers,
+                                   params.response.status)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+class ChannelCrawler:
+    """Crawl several channel histories concurrently.
+
+    index_fn(channel, budget) does the work for a single channel and
+    returns a result dict with at least a 'messages' count. At most
+    `concurrency` channels are crawled at once and all of them share one
+    RateLimitBudget.
+    """
+
+    def __init__(self, index_fn, budget, concurrency=4):
+        self.index_fn = index_fn
+        self.budget = budget
+        self.concurrency = concurrency
+
+    async def crawl(self, channels):
+        """Crawl all channels, returning (channel, result, error) tuples"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(channel):
+            async with semaphore:
+                started = time.monotonic()
+                logger.info(f"Indexing channel: {channel.name}")
+                try:
+                    result = await self.index_fn(channel, self.budget)
+                except Exception as e:
+                    return channel, None, e
+
+                elapsed = time.monotonic() - started
+                result['elapsed'] = elapsed
+                rate = result['messages'] / elapsed if elapsed > 0 else 0.0
+                logger.info(f"Finished channel {channel.name}: {result['messages']} messages "
+                            f"in {elapsed:.1f}s ({rate:.1f} msg/s)")
+                return channel, result, None
+
+        return await asyncio.gather(*(run(channel) for channel in channels))
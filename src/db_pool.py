@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import threading
+import time
+
+# Pragmas for the web process's read connections. Each connection keeps its
+# own page cache, so reusing connections keeps hot pages warm, and the
+# memory map lets them share the OS page cache for the rest.
+READ_PRAGMAS = {
+    'busy_timeout': 5000,
+    'cache_size': -16000,  # KiB
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'query_only': 'ON',
+}
+
+WRITE_PRAGMAS = {
+    'busy_timeout': 30000,
+    'journal_mode': 'WAL',
+}
+
+def open_connection(db_path, pragmas):
+    conn = sqlite3.connect(db_path, timeout=pragmas.get('busy_timeout', 5000) / 1000, check_same_thread=False)
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+class ConnectionPool:
+    """Reusable read-only connections plus one shared writer connection.
+
+    acquire() hands out an idle read connection, most recently used first
+    so its cache is the warmest, or opens a new one. release() returns it,
+    keeping up to max_idle connections open. Readers never write, so with
+    WAL they never wait for the writer or for each other.
+
+    acquire_writer() serializes writes through a single connection; the
+    bot is the main writer and the web process only changes tags.
+    """
+
+    def __init__(self, db_path, max_idle=8, read_pragmas=None):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.read_pragmas = dict(READ_PRAGMAS, **(read_pragmas or {}))
+        self.idle = []
+        self.lock = threading.Lock()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.stats = {
+            'opened': 0,
+            'reused': 0,
+            'closed': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'writes': 0,
+            'write_wait_ms': 0.0,
+        }
+
+    def acquire(self):
+        """Get a read-only connection; give it back with release()"""
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+            self.stats['reused' if conn else 'opened'] += 1
+            self.stats['in_use'] += 1
+            self.stats['peak_in_use'] = max(self.stats['peak_in_use'], self.stats['in_use'])
+        if conn is None:
+            conn = open_connection(self.db_path, self.read_pragmas)
+        return conn
+
+    def release(self, conn):
+        """Return a connection from acquire() or acquire_writer()"""
+        if conn is self.writer:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.set_trace_callback(None)
+            self.writer_lock.release()
+            return
+
+        if conn.in_transaction:
+            conn.rollback()
+        conn.set_trace_callback(None)
+        with self.lock:
+            self.stats['in_use'] -= 1
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+            self.stats['closed'] += 1
+        conn.close()
+
+    def acquire_writer(self):
+        """Get the writer connection, waiting for any other write to finish"""
+        waited = time.perf_counter()
+        self.writer_lock.acquire()
+        if self.writer is None:
+            self.writer = open_connection(self.db_path, WRITE_PRAGMAS)
+        with self.lock:
+            self.stats['writes'] += 1
+            self.stats['write_wait_ms'] += (time.perf_counter() - waited) * 1000
+        return self.writer
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, idle=len(self.idle), max_idle=self.max_idle)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""Attachment MIME types the previews and the document viewer handle
+
+Kept free of the rendering dependencies so the bot can use them without
+importing Pillow, pdf2image or requests.
+"""
+
+OFFICE_TYPES = [
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.ms-excel',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.ms-powerpoint',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+]
+
+IMAGE_TYPES = ['image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/bmp', 'image/webp', 'image/svg+xml']
+
+# File types /preview can render a first page image for
+PREVIEW_TYPES = ['application/pdf'] + OFFICE_TYPES + ['text/plain', 'application/rtf']
+
+# File types the document viewer can page through. Office documents and
+# RTF are converted to PDF first.
+CONVERTED_TYPES = OFFICE_TYPES + ['application/rtf']
+VIEWER_TYPES = ['application/pdf'] + CONVERTED_TYPES + ['text/plain'] + IMAGE_TYPES
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('DiscordIndexer.LoopMonitor')
+
+
+class LoopLagMonitor:
+    """Measure asyncio event loop lag.
+
+    A background task sleeps for a fixed interval and measures how late it
+    wakes up. Any lag above the threshold is logged and counted as a stall,
+    which makes blocking calls on the event loop visible before they cost
+    the gateway its heartbeat.
+    """
+
+    def __init__(self, interval=0.5, threshold=0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self._task = None
+
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.last_stall_at = None
+
+    def start(self):
+        """Start monitoring the running event loop"""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag > self.threshold:
+                self.stalls += 1
+                self.last_stall_at = time.time()
+                logger.warning(f"Event loop stalled for {lag * 1000:.0f} ms (stall #{self.stalls})")
+
+    def get_stats(self):
+        """Get lag statistics for reporting"""
+        return {
+            'stalls': self.stalls,
+            'threshold_ms': round(self.threshold * 1000),
+            'last_lag_ms': round(self.last_lag * 1000, 1),
+            'max_lag_ms': round(self.max_lag * 1000, 1)
+        }
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""Chunked, online schema migrations
+
+Tables are rebuilt into their new layout while the bot and web app keep
+using them. Triggers mirror every write into a shadow table while existing
+rows are copied over in small transactions, and the shadow table replaces
+the original in one final transaction. Progress is kept in
+schema_migrations, so an interrupted run picks up where it stopped.
+The full-text search indexes, derived columns and stats rollups are filled
+the same way, after the rebuilds.
+
+The bot runs pending migrations in the background on startup. This script
+runs them to completion from the command line instead.
+
+Usage: python src/migrations.py [--db path] [--chunk-size 5000]
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import time
+
+from schema import (FILES_TABLE_SQL, INDEXES_SQL, LINKS_TABLE_SQL, SCHEMA_SQL, ensure_schema, fts_triggers_sql,
+                    get_column_type, get_columns, rollup_backfill_sql, rollup_reset_sql, rollup_triggers_sql)
+from normalize import mime_major, mime_minor, suffix_list_version, url_registrable_domain
+
+logger = logging.getLogger('DiscordIndexer.Migrations')
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Registrable domains depend on the public suffix list, so the migrations
+# computing and counting them are named after its version and run again
+# whenever the bundled list changes
+SUFFIX_LIST_VERSION = suffix_list_version()
+
+
+class ChunkedMigration:
+    """A migration that works through a table in chunks of ids.
+
+    Subclasses implement start(), copy(conn, low, high) and finish(). Rows
+    are processed from the newest id down, so recent rows are done first.
+    Rows written after start() are expected to be handled by triggers it
+    creates.
+    """
+
+    def __init__(self, name, table, needed):
+        self.name = name
+        self.table = table
+        self.needed = needed
+
+    def get_state(self, conn):
+        return conn.execute(
+            'SELECT position, completed_at FROM schema_migrations WHERE name = ?', (self.name,)
+        ).fetchone()
+
+    def pending(self, conn):
+        state = self.get_state(conn)
+        if state:
+            return state[1] is None
+        return self.needed(conn)
+
+    def record_start(self, conn):
+        """Store the first copy position; rows above it are left to the triggers"""
+        top = conn.execute(f'SELECT MAX(id) FROM {self.table}').fetchone()[0]
+        conn.execute('INSERT INTO schema_migrations (name, position) VALUES (?, ?)', (self.name, (top or 0) + 1))
+
+    def copy_chunk(self, conn, position, chunk_size):
+        """Process the rows just below position, returning the new position"""
+        low = conn.execute(f'''
+            SELECT MIN(id) FROM (SELECT id FROM {self.table} WHERE id < ? ORDER BY id DESC LIMIT ?)
+        ''', (position, chunk_size)).fetchone()[0]
+        if low is None:
+            low = 0
+
+        with conn:
+            self.copy(conn, low, position)
+            conn.execute('UPDATE schema_migrations SET position = ? WHERE name = ?', (low, self.name))
+        return low
+
+    def complete_sql(self):
+        return f'''
+            UPDATE schema_migrations SET position = NULL, completed_at = CURRENT_TIMESTAMP
+            WHERE name = '{self.name}';
+        '''
+
+    def step(self, conn, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Do the next unit of work: start, copy one chunk or finish"""
+        state = self.get_state(conn)
+        if not state:
+            self.start(conn)
+            logger.info(f"Started migration {self.name} on {self.table}")
+        elif state[0] > 0:
+            self.copy_chunk(conn, state[0], chunk_size)
+        else:
+            self.finish(conn)
+            logger.info(f"Completed migration {self.name}")
+
+
+class TableRebuild(ChunkedMigration):
+    """Rebuild a table into a new layout while it stays in use.
+
+    columns lists (column, expression) pairs for the new layout, where the
+    expression is SQL over the old row written with a {row} placeholder for
+    the row's table or trigger alias. before_copy(conn, table, low, high)
+    runs in the same transaction as each chunk.
+    """
+
+    def __init__(self, name, table, create_sql, columns, needed, before_copy=None):
+        super().__init__(name, table, needed)
+        self.shadow = f'{table}_rebuild'
+        self.create_sql = create_sql
+        self.columns = columns
+        self.before_copy = before_copy
+
+    def _names(self):
+        return ', '.join(column for column, _ in self.columns)
+
+    def _values(self, row):
+        return ', '.join(expression.format(row=row) for _, expression in self.columns)
+
+    def start(self, conn):
+        """Create the shadow table and the triggers that keep it in sync"""
+        with conn:
+            conn.execute(self.create_sql.format(name=self.shadow))
+            for event in ('INSERT', 'UPDATE'):
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {self.shadow}_{event.lower()} AFTER {event} ON {self.table}
+                    BEGIN
+                        INSERT OR REPLACE INTO {self.shadow} ({self._names()}) VALUES ({self._values('NEW')});
+                    END
+                ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {self.shadow}_delete AFTER DELETE ON {self.table}
+                BEGIN
+                    DELETE FROM {self.shadow} WHERE id = OLD.id;
+                END
+            ''')
+            self.record_start(conn)
+
+    def copy(self, conn, low, high):
+        if self.before_copy:
+            self.before_copy(conn, self.table, low, high)
+        # Rows the triggers already mirrored are newer than the old copy
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {self.shadow} ({self._names()})
+            SELECT {self._values(self.table)} FROM {self.table} WHERE id >= ? AND id < ?
+        ''', (low, high))
+
+    def finish(self, conn):
+        """Replace the table with its rebuilt copy in one transaction"""
+        # Other triggers on the table are dropped with it and recreated on the copy
+        triggers = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND name NOT LIKE ?",
+            (self.table, f'{self.shadow}_%')
+        )]
+        # Legacy rename leaves views and triggers that name the table alone;
+        # they resolve to the rebuilt copy once it has the original name
+        conn.executescript(f'''
+            PRAGMA legacy_alter_table = ON;
+            BEGIN IMMEDIATE;
+            DROP TRIGGER IF EXISTS {self.shadow}_insert;
+            DROP TRIGGER IF EXISTS {self.shadow}_update;
+            DROP TRIGGER IF EXISTS {self.shadow}_delete;
+            DROP TABLE {self.table};
+            ALTER TABLE {self.shadow} RENAME TO {self.table};
+            {SCHEMA_SQL}
+            {INDEXES_SQL}
+            {';'.join(triggers)}{';' if triggers else ''}
+            {self.complete_sql()}
+            COMMIT;
+            PRAGMA legacy_alter_table = OFF;
+        ''')
+
+
+class Backfill(ChunkedMigration):
+    """Fill a structure derived from a table, such as an index, in chunks.
+
+    start() runs setup_sql and creates triggers_sql, which keep the derived
+    data up to date from then on, so the chunks only cover rows that
+    existed before it. copy_sql runs once per chunk with :low and :high
+    bounding the ids, after registering functions, a dict of Python
+    functions copy_sql may call by name. ready() tells readers when the
+    backfill is complete.
+    """
+
+    def __init__(self, name, table, needed, triggers_sql, copy_sql, setup_sql='', functions=None):
+        super().__init__(name, table, needed)
+        self.triggers_sql = triggers_sql
+        self.copy_sql = copy_sql
+        self.setup_sql = setup_sql
+        self.functions = functions or {}
+
+    def start(self, conn):
+        conn.executescript(f'''
+            BEGIN IMMEDIATE;
+            {self.setup_sql}
+            {self.triggers_sql}
+            INSERT INTO schema_migrations (name, position)
+            SELECT '{self.name}', COALESCE(MAX(id), 0) + 1 FROM {self.table};
+            COMMIT;
+        ''')
+
+    def copy(self, conn, low, high):
+        for name, function in self.functions.items():
+            conn.create_function(name, -1, function, deterministic=True)
+        conn.execute(self.copy_sql, {'low': low, 'high': high})
+
+    def finish(self, conn):
+        with conn:
+            conn.execute(self.complete_sql())
+
+    def ready(self, conn):
+        state = self.get_state(conn)
+        return bool(state and state[1])
+
+
+class SearchIndexBackfill(Backfill):
+    """Fill an external-content FTS5 index from its source view"""
+
+    def __init__(self, name, table, fts, view, columns, triggers_sql, rank):
+        columns = ', '.join(columns)
+        super().__init__(
+            name, table, needed=lambda conn: table_exists(conn, fts), triggers_sql=triggers_sql,
+            copy_sql=f'''
+                INSERT INTO {fts} (rowid, {columns})
+                SELECT id, {columns} FROM {view} WHERE id >= :low AND id < :high
+            ''',
+            setup_sql=f"INSERT INTO {fts} ({fts}, rank) VALUES ('rank', '{rank}');"
+        )
+
+
+def table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def has_column(table, column):
+    return lambda conn: column in get_columns(conn, table)
+
+
+def has_text_ids(table):
+    return lambda conn: get_column_type(conn, table, 'message_id') == 'TEXT'
+
+
+def copy_dimensions(conn, table, low, high):
+    """Fill the dimension tables from denormalized fact rows
+
+    For each id the name on its newest row wins. Existing dimension rows
+    are kept, since they were written from live data.
+    """
+    newest = f'''
+        SELECT MAX(id) FROM {table}
+        WHERE id >= ? AND id < ? AND {{column}} IS NOT NULL GROUP BY {{key}}
+    '''
+    conn.execute(f'''
+        INSERT OR IGNORE INTO guilds (guild_id, name)
+        SELECT CAST(guild_id AS INTEGER), guild_name FROM {table}
+        WHERE id IN ({newest.format(column='guild_name', key='guild_id')}) AND guild_id IS NOT NULL
+    ''', (low, high))
+    conn.execute(f'''
+        INSERT OR IGNORE INTO channels (channel_id, guild_id, name)
+        SELECT CAST(channel_id AS INTEGER), CAST(guild_id AS INTEGER), channel_name FROM {table}
+        WHERE id IN ({newest.format(column='channel_name', key='channel_id')})
+    ''', (low, high))
+    conn.execute(f'''
+        INSERT OR IGNORE INTO authors (author_id, name)
+        SELECT CAST(author_id AS INTEGER), author_name FROM {table}
+        WHERE id IN ({newest.format(column='author_name', key='author_id')})
+    ''', (low, high))
+    conn.execute(f'''
+        INSERT OR IGNORE INTO messages (message_id, channel_id, author_id, content)
+        SELECT CAST(message_id AS INTEGER), CAST(channel_id AS INTEGER), CAST(author_id AS INTEGER), message_content
+        FROM {table}
+        WHERE id IN ({newest.format(column='message_content', key='message_id')})
+    ''', (low, high))
+
+
+def same_columns(*columns):
+    return [(column, f'{{row}}.{column}') for column in columns]
+
+
+def integer_columns(*columns):
+    return [(column, f'CAST({{row}}.{column} AS INTEGER)') for column in columns]
+
+
+# Text timestamps as written by sqlite3's datetime adapter become epoch
+# milliseconds; anything unparseable falls back to the message snowflake.
+TIMESTAMP_MS = [('timestamp', '''
+    CASE WHEN typeof({row}.timestamp) = 'integer' THEN {row}.timestamp
+    ELSE COALESCE(CAST(ROUND((julianday({row}.timestamp) - 2440587.5) * 86400000) AS INTEGER),
+                  (CAST({row}.message_id AS INTEGER) >> 22) + 1420070400000)
+    END
+''')]
+
+FILE_COLUMNS = (
+    same_columns('id') + integer_columns('message_id', 'channel_id', 'guild_id', 'author_id')
+    + same_columns('filename', 'file_url', 'file_size', 'file_type', 'mime_major', 'mime_minor') + TIMESTAMP_MS
+    + same_columns('indexed_at', 'url_expires_at', 'url_checked_at', 'deleted_at')
+)
+
+LINK_COLUMNS = (
+    same_columns('id') + integer_columns('message_id', 'channel_id', 'guild_id', 'author_id')
+    + same_columns('link_url', 'link_domain', 'registrable_domain') + TIMESTAMP_MS
+    + same_columns('indexed_at', 'deleted_at')
+)
+
+
+MIGRATIONS = [
+    # Move names and message text out of the fact tables
+    TableRebuild(
+        'normalize_files', 'indexed_files', FILES_TABLE_SQL, FILE_COLUMNS,
+        needed=has_column('indexed_files', 'channel_name'),
+        before_copy=copy_dimensions
+    ),
+    TableRebuild(
+        'normalize_links', 'indexed_links', LINKS_TABLE_SQL, LINK_COLUMNS,
+        needed=has_column('indexed_links', 'channel_name'),
+        before_copy=copy_dimensions
+    ),
+    # Store snowflakes and timestamps as integers. Databases that still had
+    # names on their fact rows get this as part of the rebuild above.
+    TableRebuild(
+        'integer_ids_files', 'indexed_files', FILES_TABLE_SQL, FILE_COLUMNS,
+        needed=has_text_ids('indexed_files')
+    ),
+    TableRebuild(
+        'integer_ids_links', 'indexed_links', LINKS_TABLE_SQL, LINK_COLUMNS,
+        needed=has_text_ids('indexed_links')
+    ),
+    # Build the full-text indexes. bm25 weights favour filename and URL
+    # matches over message text, and author matches over both.
+    SearchIndexBackfill(
+        'search_files', 'indexed_files', 'files_fts', 'files_search', ('filename', 'content', 'author'),
+        fts_triggers_sql('files_fts', 'indexed_files', 'filename', 'search_files'), rank='bm25(10.0, 1.0, 2.0)'
+    ),
+    SearchIndexBackfill(
+        'search_links', 'indexed_links', 'links_fts', 'links_search', ('link_url', 'content', 'author'),
+        fts_triggers_sql('links_fts', 'indexed_links', 'link_url', 'search_links'), rank='bm25(10.0, 1.0, 2.0)'
+    ),
+    # Fill the normalized MIME type and registrable domain columns of rows
+    # indexed before the bot computed them. New rows get them on insert.
+    Backfill(
+        'mime_files', 'indexed_files', needed=lambda conn: True, triggers_sql='',
+        copy_sql='''
+            UPDATE indexed_files SET mime_major = mime_major(file_type, filename),
+                                     mime_minor = mime_minor(file_type, filename)
+            WHERE id >= :low AND id < :high
+        ''',
+        functions={'mime_major': mime_major, 'mime_minor': mime_minor}
+    ),
+    Backfill(
+        f'registrable_domain_links_{SUFFIX_LIST_VERSION}', 'indexed_links', needed=lambda conn: True, triggers_sql='',
+        copy_sql='''
+            UPDATE indexed_links SET registrable_domain = url_registrable_domain(link_url)
+            WHERE id >= :low AND id < :high
+        ''',
+        functions={'url_registrable_domain': url_registrable_domain}
+    ),
+    # Count the existing rows into stats_rollup. rollup_files_2 replaces the
+    # first files backfill, recounting types from the columns above, and the
+    # links backfill recounts domains for each version of the suffix list.
+    Backfill(
+        'rollup_files_2', 'indexed_files', needed=lambda conn: True,
+        setup_sql=rollup_reset_sql('indexed_files'),
+        triggers_sql=rollup_triggers_sql('indexed_files', 'rollup_files_2'),
+        copy_sql=rollup_backfill_sql('indexed_files')
+    ),
+    Backfill(
+        f'rollup_links_{SUFFIX_LIST_VERSION}', 'indexed_links', needed=lambda conn: True,
+        setup_sql=rollup_reset_sql('indexed_links'),
+        triggers_sql=rollup_triggers_sql('indexed_links', f'rollup_links_{SUFFIX_LIST_VERSION}'),
+        copy_sql=rollup_backfill_sql('indexed_links')
+    ),
+]
+
+SEARCH_BACKFILLS = {migration.table: migration for migration in MIGRATIONS
+                    if isinstance(migration, SearchIndexBackfill)}
+
+COLUMN_BACKFILLS = {migration.table: migration for migration in MIGRATIONS
+                    if migration.name == 'mime_files' or migration.name.startswith('registrable_domain_links')}
+
+ROLLUP_BACKFILLS = {migration.table: migration for migration in MIGRATIONS
+                    if migration.name.startswith('rollup_')}
+
+
+def pending_migrations(conn):
+    """Names of the migrations that still have work to do"""
+    return [migration.name for migration in MIGRATIONS if migration.pending(conn)]
+
+
+def migrate_step(conn, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Advance the first pending migration by one step
+
+    Returns False once nothing is left to do.
+    """
+    for migration in MIGRATIONS:
+        if migration.pending(conn):
+            migration.step(conn, chunk_size)
+            return True
+    return False
+
+
+def migrate(conn, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run all pending migrations to completion"""
+    steps = 0
+    started = time.monotonic()
+    while migrate_step(conn, chunk_size):
+        steps += 1
+        if steps % 100 == 0:
+            logger.info(f"Migration progress: {steps} steps in {time.monotonic() - started:.1f}s")
+    return steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='database path (default: database.path from config/config.json)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    db_path = args.db
+    if not db_path:
+        with open('config/config.json', 'r') as f:
+            db_path = json.load(f)['database']['path']
+
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    pending = pending_migrations(conn)
+    if not pending:
+        print("Nothing to migrate")
+    else:
+        print(f"Running migrations: {', '.join(pending)}")
+        started = time.monotonic()
+        migrate(conn, args.chunk_size)
+        print(f"Done in {time.monotonic() - started:.1f}s")
+    conn.close()
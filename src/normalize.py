@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import hashlib
+import ipaddress
+import logging
+import mimetypes
+import os
+from urllib.parse import urlparse
+
+logger = logging.getLogger('DiscordIndexer.Normalize')
+
+SUFFIX_LIST_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'public_suffix_list.dat')
+
+# Top-level media types registered with IANA
+MIME_MAJOR_TYPES = {'application', 'audio', 'font', 'image', 'message', 'model', 'multipart', 'text', 'video'}
+
+_suffix_rules = None
+
+def mime_category(content_type, filename=None):
+    """Split a content type into lowercase (major, minor) parts
+
+    Parameters such as charset are dropped. Without a content type the
+    type is guessed from the filename. Parts that cannot be found are None.
+    """
+    if not content_type and filename:
+        content_type = mimetypes.guess_type(filename)[0]
+    if not content_type:
+        return None, None
+    major, _, minor = content_type.split(';')[0].strip().lower().partition('/')
+    return major or None, minor.strip() or None
+
+def mime_major(content_type, filename=None):
+    return mime_category(content_type, filename)[0]
+
+def mime_minor(content_type, filename=None):
+    return mime_category(content_type, filename)[1]
+
+def load_suffix_rules(path=SUFFIX_LIST_PATH):
+    """Read a public suffix list into (rules, wildcards, exceptions) sets
+
+    wildcards holds the parent of each '*.' rule and exceptions the name
+    of each '!' rule. A missing file leaves only the implicit '*' rule.
+    """
+    rules, wildcards, exceptions = set(), set(), set()
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                rule = line.split()[0].lower() if line.strip() else ''
+                if not rule or rule.startswith('//'):
+                    continue
+                if rule.startswith('!'):
+                    exceptions.add(rule[1:])
+                elif rule.startswith('*.'):
+                    wildcards.add(rule[2:])
+                else:
+                    rules.add(rule)
+    except OSError as e:
+        logger.warning(f"Could not read public suffix list {path}: {e}")
+    return rules, wildcards, exceptions
+
+def _rules():
+    global _suffix_rules
+    if _suffix_rules is None:
+        _suffix_rules = load_suffix_rules()
+    return _suffix_rules
+
+def suffix_list_version():
+    """Short digest of the public suffix rules in use, which changes with the list"""
+    rules, wildcards, exceptions = _rules()
+    text = '\n'.join(sorted(rules) + [f'*.{rule}' for rule in sorted(wildcards)]
+                     + [f'!{rule}' for rule in sorted(exceptions)])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+def registrable_domain(host):
+    """The registrable domain (eTLD+1) of a host name
+
+    Follows the public suffix list algorithm: the longest matching rule
+    gives the public suffix, exceptions shorten it by one label, and hosts
+    matching no rule use their last label. IP addresses and hosts that are
+    themselves a public suffix are returned unchanged.
+    """
+    if not host:
+        return None
+    host = host.strip().lower().rstrip('.')
+    if not host:
+        return None
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return host
+    except ValueError:
+        pass
+
+    rules, wildcards, exceptions = _rules()
+    labels = host.split('.')
+    suffix_labels = 1
+    for i in range(len(labels)):
+        name = '.'.join(labels[i:])
+        if name in exceptions:
+            suffix_labels = len(labels) - i - 1
+            break
+        if name in rules or '.'.join(labels[i + 1:]) in wildcards:
+            suffix_labels = len(labels) - i
+            break
+
+    if suffix_labels >= len(labels):
+        return host
+    return '.'.join(labels[-suffix_labels - 1:])
+
+def url_registrable_domain(url):
+    """The registrable domain of a URL's host"""
+    try:
+        host = urlparse(url).hostname if url else None
+    except ValueError:
+        return None
+    return registrable_domain(host)
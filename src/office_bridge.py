@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Convert documents to PDF on a running headless soffice over UNO
+
+office_pool.py runs one of these next to each long-lived soffice, under a
+Python that can import LibreOffice's uno module (the system python3 with
+python3-uno installed, or LibreOffice's own), so the app's interpreter
+never needs the bindings. Requests are read as one JSON object per line
+on stdin and each gets one JSON line back on stdout:
+
+    {"convert": path, "out_dir": dir}  ->  {"pdf": path} or {"error": message}
+    {"ping": true}                     ->  {"ok": true} or {"error": message}
+
+The first line written is {"ok": true} once connected, or an error. When
+stdin closes the soffice instance is told to exit.
+
+Usage: python3 src/office_bridge.py <pipe name> <connect timeout>
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+# PDF export filter for each kind of document LibreOffice can load
+PDF_FILTERS = [
+    ('com.sun.star.text.TextDocument', 'writer_pdf_Export'),
+    ('com.sun.star.sheet.SpreadsheetDocument', 'calc_pdf_Export'),
+    ('com.sun.star.presentation.PresentationDocument', 'impress_pdf_Export'),
+    ('com.sun.star.drawing.DrawingDocument', 'draw_pdf_Export'),
+]
+
+
+def connect(pipe, timeout):
+    """The Desktop of the soffice accepting connections on pipe"""
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f'uno:pipe,name={pipe};urp;StarOffice.ComponentContext')
+            break
+        except NoConnectException:
+            if time.monotonic() > deadline:
+                raise TimeoutError("soffice did not start in time")
+            time.sleep(0.1)
+    return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+
+
+def properties(**values):
+    result = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        result.append(prop)
+    return tuple(result)
+
+
+def convert(desktop, path, out_dir):
+    document = desktop.loadComponentFromURL(
+        Path(path).resolve().as_uri(), '_blank', 0, properties(Hidden=True, ReadOnly=True)
+    )
+    if document is None:
+        raise ValueError(f"LibreOffice could not open {os.path.basename(path)}")
+    try:
+        export = next((f for service, f in PDF_FILTERS if document.supportsService(service)), 'writer_pdf_Export')
+        pdf_path = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '.pdf')
+        document.storeToURL(Path(pdf_path).resolve().as_uri(), properties(FilterName=export))
+    finally:
+        document.close(True)
+    return pdf_path
+
+
+def describe(error):
+    # UNO exceptions carry their text in Message
+    return getattr(error, 'Message', '') or str(error) or type(error).__name__
+
+
+def reply(**values):
+    sys.stdout.write(json.dumps(values) + '\n')
+    sys.stdout.flush()
+
+
+def main(pipe, timeout):
+    try:
+        desktop = connect(pipe, timeout)
+    except Exception as e:
+        reply(error=describe(e))
+        return 1
+    reply(ok=True)
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            if 'convert' in request:
+                reply(pdf=convert(desktop, request['convert'], request['out_dir']))
+            else:
+                desktop.getCurrentComponent()
+                reply(ok=True)
+        except Exception as e:
+            reply(error=describe(e))
+
+    try:
+        desktop.terminate()
+    except Exception:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1], float(sys.argv[2])))
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from pathlib import Path
+
+logger = logging.getLogger('DiscordIndexer.OfficePool')
+
+# Talks UNO to a long-lived soffice on behalf of UnoInstance
+BRIDGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'office_bridge.py')
+
+# Interpreter with LibreOffice's uno module, which the app's venv lacks;
+# python3-uno installs it for the system python3
+DEFAULT_UNO_PYTHON = '/usr/bin/python3'
+
+
+class ConversionError(Exception):
+    pass
+
+
+class ConversionTimeout(ConversionError):
+    pass
+
+
+def profile_args(profile):
+    return ['--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+            f'-env:UserInstallation={Path(profile).resolve().as_uri()}']
+
+
+def pdf_path_for(path, out_dir):
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '.pdf')
+
+
+def uno_available(python):
+    """Whether python can import LibreOffice's uno module"""
+    try:
+        result = subprocess.run([python, '-c', 'import uno'], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+class SubprocessInstance:
+    """Runs one soffice --convert-to per job with a profile of its own"""
+
+    def __init__(self, binary, profile, pipe, python=None):
+        self.binary = binary
+        self.profile = profile
+        self.process = None
+        self.jobs = 0
+
+    def start(self, timeout):
+        os.makedirs(self.profile, exist_ok=True)
+
+    def healthy(self):
+        return True
+
+    def convert(self, path, out_dir):
+        self.process = subprocess.Popen(
+            [self.binary, *profile_args(self.profile), '--convert-to', 'pdf', '--outdir', out_dir, path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        _, stderr = self.process.communicate()
+        self.jobs += 1
+        if self.process.returncode != 0:
+            raise ConversionError(stderr.decode(errors='replace').strip() or f"exit code {self.process.returncode}")
+        return pdf_path_for(path, out_dir)
+
+    def kill(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+
+    def stop(self):
+        self.kill()
+
+
+class UnoInstance:
+    """A long-lived headless soffice taking conversions over a named pipe
+
+    The UNO calls are made by office_bridge.py running under python, which
+    takes requests as JSON lines on its stdin.
+    """
+
+    def __init__(self, binary, profile, pipe, python=DEFAULT_UNO_PYTHON):
+        self.binary = binary
+        self.profile = profile
+        self.pipe = pipe
+        self.python = python
+        self.process = None
+        self.bridge = None
+        self.jobs = 0
+
+    def start(self, timeout):
+        os.makedirs(self.profile, exist_ok=True)
+        # The profile belongs to this instance alone, so any lock is stale
+        lock = os.path.join(self.profile, '.lock')
+        if os.path.exists(lock):
+            os.unlink(lock)
+        self.process = subprocess.Popen(
+            [self.binary, *profile_args(self.profile), f'--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.bridge = subprocess.Popen(
+            [self.python, BRIDGE_PATH, self.pipe, str(timeout)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        try:
+            reply = self._read(timeout + 5)
+        except ConversionError:
+            reply = None
+        if reply is None or 'error' in reply:
+            code = self.process.poll()
+            self.stop()
+            if code is not None:
+                raise ConversionError(f"soffice exited with code {code} on startup")
+            if reply is None:
+                raise ConversionTimeout("soffice did not start in time")
+            raise ConversionError(f"Could not connect to soffice: {reply['error']}")
+
+    def _read(self, timeout=None):
+        """The bridge's next reply, or None if none came within timeout"""
+        if timeout is not None:
+            ready, _, _ = select.select([self.bridge.stdout], [], [], timeout)
+            if not ready:
+                return None
+        line = self.bridge.stdout.readline()
+        if not line:
+            raise ConversionError(f"office bridge exited with code {self.bridge.wait()}")
+        return json.loads(line)
+
+    def _request(self, timeout=None, **request):
+        try:
+            self.bridge.stdin.write(json.dumps(request) + '\n')
+            self.bridge.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise ConversionError("office bridge is not running")
+        return self._read(timeout)
+
+    def healthy(self):
+        if self.process is None or self.process.poll() is not None or self.bridge.poll() is not None:
+            return False
+        try:
+            reply = self._request(5, ping=True)
+        except ConversionError:
+            return False
+        return reply is not None and 'ok' in reply
+
+    def convert(self, path, out_dir):
+        pdf_path = pdf_path_for(path, out_dir)
+        reply = self._request(convert=str(Path(path).resolve()), out_dir=str(Path(out_dir).resolve()))
+        if 'error' in reply:
+            raise ConversionError(reply['error'])
+        self.jobs += 1
+        return pdf_path
+
+    def kill(self):
+        for process in (self.process, self.bridge):
+            if process and process.poll() is None:
+                process.kill()
+
+    def stop(self):
+        # Closing its stdin makes the bridge tell soffice to exit
+        if self.bridge is not None:
+            try:
+                self.bridge.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+        for process in (self.bridge, self.process):
+            if process is None:
+                continue
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.bridge = None
+
+
+class OfficePool:
+    """A pool of headless LibreOffice instances converting documents to PDF.
+
+    Each worker thread owns one instance with its own profile directory
+    under profile_dir, so instances never contend for a profile and keep
+    it warm between jobs. When uno_python can import LibreOffice's Python
+    bindings (uno) an instance is a long-lived soffice taking jobs over a
+    named pipe, so a conversion costs only the rendering; without them each
+    job runs soffice --convert-to on the worker's profile.
+
+    Jobs run at most timeout seconds before their instance is killed.
+    Instances are health checked when idle and before reuse, and
+    restarted when found dead, after a failed job and every max_jobs
+    jobs. The pool starts on its first conversion.
+    """
+
+    def __init__(self, size=2, binary='libreoffice', profile_dir='cache/office', name='office', timeout=60,
+                 start_timeout=30, queue_timeout=120, max_jobs=200, health_interval=30, uno_python=DEFAULT_UNO_PYTHON):
+        self.size = size
+        self.binary = binary
+        self.profile_dir = profile_dir
+        self.name = name
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.queue_timeout = queue_timeout
+        self.max_jobs = max_jobs
+        self.health_interval = health_interval
+        self.uno_python = uno_python
+        self.instance_class = None
+
+        self.jobs = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.stats = {
+            'completed': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'restarts': 0,
+            'busy': 0,
+            'max_queue_depth': 0,
+            'wait_ms': 0.0,
+            'convert_ms': 0.0,
+        }
+
+    def start(self):
+        with self.lock:
+            if self.workers:
+                return
+            if self.instance_class is None:
+                self.instance_class = UnoInstance if uno_available(self.uno_python) else SubprocessInstance
+                if self.instance_class is SubprocessInstance:
+                    logger.warning(f"{self.uno_python} cannot import uno; starting soffice for every conversion")
+            for index in range(self.size):
+                worker = threading.Thread(target=self._work, args=(index,), name=f'{self.name}-{index}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        logger.info(f"Started {self.size} {self.instance_class.__name__} office workers")
+
+    def stop(self):
+        """Stop the workers and their instances once queued jobs are done"""
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for _ in workers:
+            self.jobs.put(None)
+        for worker in workers:
+            worker.join(self.timeout)
+
+    def convert(self, path, out_dir):
+        """Convert a document to PDF in out_dir and return the PDF's path
+
+        Raises ConversionTimeout when the job waits or runs too long and
+        ConversionError when LibreOffice fails.
+        """
+        self.start()
+        future = Future()
+        self.jobs.put((path, out_dir, future, time.monotonic()))
+        with self.lock:
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.jobs.qsize())
+        try:
+            return future.result(timeout=self.queue_timeout + self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise ConversionTimeout(f"Conversion of {os.path.basename(path)} timed out")
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def _instance(self, instance, index, check):
+        """A started, healthy instance for worker index, restarting instance if needed"""
+        if instance is not None:
+            if instance.jobs < self.max_jobs and (not check or instance.healthy()):
+                return instance
+            logger.info(f"Restarting office instance {self.name}-{index} after {instance.jobs} jobs")
+            instance.stop()
+            self._count('restarts')
+        instance = self.instance_class(
+            self.binary, os.path.join(self.profile_dir, f'{self.name}-{index}'), f'{self.name}_{os.getpid()}_{index}',
+            self.uno_python
+        )
+        instance.start(self.start_timeout)
+        return instance
+
+    def _work(self, index):
+        instance = None
+        checked_at = time.monotonic()
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.health_interval)
+            except queue.Empty:
+                # Idle health check, so a dead instance is replaced before a job needs it
+                if instance is not None and not instance.healthy():
+                    try:
+                        instance = self._instance(instance, index, check=True)
+                    except Exception as e:
+                        logger.error(f"Could not restart office instance {self.name}-{index}: {e}")
+                        instance = None
+                checked_at = time.monotonic()
+                continue
+            if job is None:
+                break
+
+            path, out_dir, future, queued_at = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._count('wait_ms', (time.monotonic() - queued_at) * 1000)
+            self._count('busy')
+            timer = None
+            try:
+                check = time.monotonic() - checked_at > self.health_interval
+                instance = self._instance(instance, index, check)
+                checked_at = time.monotonic() if check else checked_at
+
+                timed_out = threading.Event()
+
+                def kill():
+                    timed_out.set()
+                    instance.kill()
+
+                timer = threading.Timer(self.timeout, kill)
+                timer.start()
+                started = time.perf_counter()
+                try:
+                    result = instance.convert(path, out_dir)
+                except Exception as e:
+                    if timed_out.is_set():
+                        raise ConversionTimeout(f"Conversion of {os.path.basename(path)} timed out")
+                    raise e if isinstance(e, ConversionError) else ConversionError(str(e))
+                self._count('convert_ms', (time.perf_counter() - started) * 1000)
+                self._count('completed')
+                future.set_result(result)
+            except Exception as e:
+                self._count('timeouts' if isinstance(e, ConversionTimeout) else 'failed')
+                logger.error(f"Office conversion failed on {self.name}-{index}: {e}")
+                # The instance may be wedged; start a fresh one for the next job
+                if instance is not None:
+                    instance.stop()
+                    self._count('restarts')
+                    instance = None
+                future.set_exception(e)
+            finally:
+                if timer:
+                    timer.cancel()
+                self._count('busy', -1)
+
+        if instance is not None:
+            instance.stop()
+
+    def get_stats(self):
+        with self.lock:
+            done = self.stats['completed'] + self.stats['failed'] + self.stats['timeouts']
+            return dict(
+                self.stats,
+                mode={UnoInstance: 'uno', SubprocessInstance: 'subprocess'}.get(self.instance_class),
+                size=self.size,
+                workers=len(self.workers),
+                queue_depth=self.jobs.qsize(),
+                wait_ms=round(self.stats['wait_ms'], 1),
+                convert_ms=round(self.stats['convert_ms'], 1),
+                avg_wait_ms=round(self.stats['wait_ms'] / done, 1) if done else None,
+                avg_convert_ms=round(self.stats['convert_ms'] / self.stats['completed'], 1) if self.stats['completed'] else None,
+            )
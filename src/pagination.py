@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import base64
+import json
+from collections import namedtuple
+
+# A position in a listing: the sort key of the row a page starts after, and
+# whether the page runs on past it ('next') or back before it ('prev').
+# order names the sort the key belongs to, e.g. 'time' or 'rank'.
+Cursor = namedtuple('Cursor', ['order', 'direction', 'key'])
+
+def encode_cursor(order, direction, key):
+    """Pack a cursor into an opaque URL-safe token"""
+    data = json.dumps([order, direction, *key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_cursor(token, order):
+    """Unpack a token made by encode_cursor
+
+    Returns None for a missing or malformed token, or one made for a
+    different sort order, so the listing starts from its first page.
+    """
+    if not token:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        token_order, direction, *key = data
+    except (ValueError, TypeError):
+        return None
+    if token_order != order or direction not in ('next', 'prev') or len(key) != 2:
+        return None
+    return Cursor(token_order, direction, tuple(key))
+
+def keyset_condition(columns, cursor, descending):
+    """Build the WHERE condition and ORDER BY clause for one page
+
+    columns is the (sort column, unique tiebreaker) pair the listing is
+    ordered by. Returns (condition, params, order_by); condition is None on
+    the first page. A 'prev' page is read in reverse and flipped back by
+    paginate(). The condition leads with a plain range on the sort column
+    so SQLite can seek its index straight to the cursor.
+    """
+    backwards = cursor is not None and cursor.direction == 'prev'
+    forwards_desc = descending != backwards
+    direction = 'DESC' if forwards_desc else 'ASC'
+    order_by = f' ORDER BY {columns[0]} {direction}, {columns[1]} {direction}'
+    if cursor is None:
+        return None, [], order_by
+
+    op = '<' if forwards_desc else '>'
+    condition = f'{columns[0]} {op}= ? AND ({columns[0]} {op} ? OR {columns[1]} {op} ?)'
+    return condition, [cursor.key[0], cursor.key[0], cursor.key[1]], order_by
+
+def paginate(rows, cursor, order, key, per_page):
+    """Trim a page fetched with LIMIT per_page + 1 and make its cursors
+
+    key(row) gives a row's sort key. Returns (rows, next_cursor,
+    prev_cursor) with the rows in listing order and a None cursor where
+    there is nothing further in that direction.
+    """
+    backwards = cursor is not None and cursor.direction == 'prev'
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    next_cursor = encode_cursor(order, 'next', key(rows[-1])) if (backwards or more) else None
+    prev_cursor = encode_cursor(order, 'prev', key(rows[0])) if (more if backwards else cursor) else None
+    return rows, next_cursor, prev_cursor
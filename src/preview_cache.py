@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from url_refresh import url_identity
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Eviction frees space down to this fraction of the budget, so a full cache
+# does not evict on every new entry
+LOW_WATER = 0.9
+
+# Staging directories older than this were left by a crashed renderer
+STAGING_MAX_AGE = 3600
+
+# Hits and access times are counted in memory and written to the index at
+# most this often, so lookups do not each take a write transaction
+HIT_FLUSH_INTERVAL = 5.0
+
+INDEX_SQL = '''
+CREATE TABLE IF NOT EXISTS previews (
+    key TEXT PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    variant TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    mimetype TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    render_ms REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_previews_accessed ON previews(accessed_at);
+'''
+
+PreviewEntry = namedtuple('PreviewEntry', ['key', 'path', 'etag', 'mimetype', 'size'])
+
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/webp': '.webp', 'image/png': '.png', 'image/gif': '.gif',
+              'application/pdf': '.pdf', 'application/json': '.json'}
+
+
+def preview_key(file_id, file_url, variant='preview'):
+    """Cache key of one rendering of an attachment
+
+    The attachment is identified without its URL signature, so a refreshed
+    CDN link still finds its previews while a replaced file does not.
+    """
+    identity = f'{file_id}\n{url_identity(file_url)}\n{variant}'
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+class PreviewCache:
+    """Rendered previews on disk, bounded in total size with LRU eviction.
+
+    Each entry is stored in a file named after its key and written
+    atomically, next to an SQLite index of its size, strong ETag (a hash of
+    the bytes), render cost, hits and last access. The index lives in the
+    cache directory, so every process using the directory shares entries
+    and the byte budget. Hit, miss and eviction counters are per process.
+
+    Lookups read the index on a connection of their thread's own and only
+    take the cache lock to count the hit, which reaches the index with the
+    next batch of hits.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.db')
+        self.index = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.execute('PRAGMA synchronous=NORMAL')
+        self.index.executescript(INDEX_SQL)
+        self._remove_stale_staging()
+        self.lock = threading.Lock()
+        self.rendering = {}  # key -> [lock held while that key renders, threads using the lock]
+        self.pending_hits = {}  # key -> (hits, last access) not yet written to the index
+        self.hits_flushed_at = time.monotonic()
+        self._local = threading.local()
+        self.stats = {'hits': 0, 'misses': 0, 'renders': 0, 'render_ms': 0.0, 'evictions': 0}
+
+    def _path(self, key, mimetype):
+        return os.path.join(self.directory, key[:2], key + EXTENSIONS.get(mimetype, ''))
+
+    def _reader(self):
+        """This thread's connection for lookups, which WAL lets run alongside writes"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.index_path, timeout=30)
+        return conn
+
+    def get(self, key):
+        """The cached entry for key, or None"""
+        row = self._reader().execute('SELECT etag, mimetype, size FROM previews WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        entry = PreviewEntry(key, self._path(key, row[1]), *row)
+        if not os.path.exists(entry.path):
+            # Removed behind the index's back; render it again
+            with self.lock:
+                with self.index:
+                    self.index.execute('DELETE FROM previews WHERE key = ?', (key,))
+            return None
+        with self.lock:
+            hits, _ = self.pending_hits.get(key, (0, 0.0))
+            self.pending_hits[key] = (hits + 1, time.time())
+            if time.monotonic() - self.hits_flushed_at >= HIT_FLUSH_INTERVAL:
+                self._flush_hits()
+        return entry
+
+    def _flush_hits(self):
+        """Write the hits counted since the last flush; called with the lock held"""
+        pending, self.pending_hits = self.pending_hits, {}
+        self.hits_flushed_at = time.monotonic()
+        if not pending:
+            return
+        with self.index:
+            self.index.executemany(
+                'UPDATE previews SET hits = hits + ?, accessed_at = MAX(accessed_at, ?) WHERE key = ?',
+                [(hits, accessed_at, key) for key, (hits, accessed_at) in pending.items()]
+            )
+
+    def staging_dir(self):
+        """A new directory for a renderer to write files that put_file moves into the cache"""
+        return tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+
+    def _remove_stale_staging(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.startswith('.staging-') and time.time() - os.path.getmtime(path) > STAGING_MAX_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def put(self, key, data, mimetype, render_ms, file_id=0, variant='preview'):
+        """Store rendered bytes under key and return their entry"""
+        path = self._path(key, mimetype)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+        entry = PreviewEntry(key, path, hashlib.sha256(data).hexdigest()[:32], mimetype, len(data))
+        return self._add(entry, render_ms, file_id, variant)
+
+    def put_file(self, key, source, mimetype, render_ms, file_id=0, variant='preview'):
+        """Move a rendered file into the cache under key and return its entry
+
+        source should be in a staging_dir(), so the move is a rename on the
+        same file system and the file is never held in memory.
+        """
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        size = os.path.getsize(source)
+        path = self._path(key, mimetype)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(source, path)
+        return self._add(PreviewEntry(key, path, digest.hexdigest()[:32], mimetype, size), render_ms, file_id, variant)
+
+    def _add(self, entry, render_ms, file_id, variant):
+        key = entry.key
+        now = time.time()
+        with self.lock:
+            with self.index:
+                self.index.execute('''
+                    INSERT OR REPLACE INTO previews
+                    (key, file_id, variant, etag, mimetype, size, render_ms, created_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (key, file_id, variant, entry.etag, entry.mimetype, entry.size, render_ms, now, now))
+            self._evict(keep=key)
+        return entry
+
+    def get_or_render(self, key, render, file_id=0, variant='preview'):
+        """The entry for key, calling render() for (bytes, mimetype) on a miss
+
+        render() may instead return the path of a file it wrote to a
+        staging_dir(), which is moved into the cache. Concurrent requests
+        for the same key wait for a single render. Exceptions from render()
+        propagate and nothing is cached.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            self._count('hits')
+            return entry
+
+        with self.lock:
+            # The lock stays in the map until the last thread waiting on it
+            # is done, so a later request cannot start a second render
+            rendering = self.rendering.setdefault(key, [threading.Lock(), 0])
+            rendering[1] += 1
+        try:
+            with rendering[0]:
+                entry = self.get(key)
+                if entry is not None:
+                    self._count('hits')
+                    return entry
+                self._count('misses')
+                started = time.perf_counter()
+                data, mimetype = render()
+                render_ms = (time.perf_counter() - started) * 1000
+                self._count('renders')
+                self._count('render_ms', render_ms)
+                if isinstance(data, bytes):
+                    return self.put(key, data, mimetype, render_ms, file_id, variant)
+                return self.put_file(key, data, mimetype, render_ms, file_id, variant)
+        finally:
+            with self.lock:
+                rendering[1] -= 1
+                if not rendering[1]:
+                    del self.rendering[key]
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def _evict(self, keep):
+        """Drop least recently used entries other than keep while over the byte budget"""
+        self._flush_hits()
+        total = self.index.execute('SELECT COALESCE(SUM(size), 0) FROM previews').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * LOW_WATER
+        evicted = []
+        for key, mimetype, size in self.index.execute('SELECT key, mimetype, size FROM previews ORDER BY accessed_at'):
+            if total <= target:
+                break
+            if key == keep:
+                continue
+            evicted.append((key, mimetype))
+            total -= size
+        with self.index:
+            self.index.executemany('DELETE FROM previews WHERE key = ?', [(key,) for key, _ in evicted])
+        for key, mimetype in evicted:
+            try:
+                os.unlink(self._path(key, mimetype))
+            except FileNotFoundError:
+                pass
+        self.stats['evictions'] += len(evicted)
+
+    def get_stats(self):
+        with self.lock:
+            self._flush_hits()
+            entries, size, saved_ms = self.index.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits * render_ms), 0) FROM previews'
+            ).fetchone()
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                entries=entries,
+                bytes=size,
+                max_bytes=self.max_bytes,
+                hit_ratio=round(self.stats['hits'] / lookups, 3) if lookups else None,
+                render_ms=round(self.stats['render_ms'], 1),
+                render_ms_saved=round(saved_ms, 1),
+            )
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import io
+import logging
+import os
+import re
+import subprocess
+import tempfile
+
+import requests
+from PIL import Image, ImageDraw, ImageFont, features
+from pdf2image import pdfinfo_from_path
+
+from office_pool import ConversionError, ConversionTimeout
+
+DOWNLOAD_TIMEOUT = 30
+
+# Resolution of the page images in the document viewer; the sizes in its
+# page manifest are at this resolution
+PAGE_DPI = 150
+
+# Text files are shown as pages of this many characters
+TEXT_PAGE_SIZE = 3000
+TEXT_MAX_PAGES = 20
+
+WEBP_SUPPORTED = features.check('webp')
+
+
+class PreviewError(Exception):
+    """A preview could not be made; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def download_bytes(file_url):
+    """Download an attachment"""
+    response = requests.get(file_url, timeout=DOWNLOAD_TIMEOUT)
+    if response.status_code != 200:
+        raise PreviewError("Could not download file", 400)
+    return response.content
+
+
+def download(file_url, filename):
+    """Download an attachment to a temporary file and return its path"""
+    data = download_bytes(file_url)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
+        temp_file.write(data)
+        return temp_file.name
+
+
+def convert_to_pdf(path, out_dir, office=None):
+    """Convert an Office document to PDF with LibreOffice, returning the PDF path
+
+    With an OfficePool the conversion runs on one of its warm instances,
+    otherwise on a LibreOffice started for this document alone.
+    """
+    if office is not None:
+        try:
+            return office.convert(path, out_dir)
+        except ConversionTimeout:
+            raise PreviewError("Document conversion timeout")
+        except ConversionError as e:
+            logging.error(f"LibreOffice conversion failed: {e}")
+            raise PreviewError("Error converting document to preview")
+    try:
+        result = subprocess.run([
+            'libreoffice', '--headless', '--convert-to', 'pdf',
+            '--outdir', out_dir, path
+        ], capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        raise PreviewError("Document conversion timeout")
+    if result.returncode != 0:
+        logging.error(f"LibreOffice conversion failed: {result.stderr}")
+        raise PreviewError("Error converting document to preview")
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '.pdf')
+
+
+def render_text(path):
+    """Draw the start of a text file onto a page-sized image"""
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read(2000)  # Read first 2000 characters
+
+    img_width, img_height = 800, 600
+    image = Image.new('RGB', (img_width, img_height), color='white')
+    draw = ImageDraw.Draw(image)
+
+    try:
+        font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 12)
+    except OSError:
+        font = ImageFont.load_default()
+
+    # Split content into lines and draw
+    y_offset = 10
+    for line in content.split('\n')[:40]:  # First 40 lines
+        if y_offset > img_height - 20:
+            break
+        draw.text((10, y_offset), line[:100], fill='black', font=font)  # First 100 chars per line
+        y_offset += 15
+    return image
+
+
+def encode_image(image, image_format='JPEG'):
+    """Encode a PIL image as JPEG or WebP bytes"""
+    img_io = io.BytesIO()
+    image.convert('RGB').save(img_io, image_format, quality=85)
+    return img_io.getvalue()
+
+
+def render_text_preview(file_url, filename):
+    """Render the start of a text file as JPEG bytes"""
+    temp_file_path = download(file_url, filename)
+    try:
+        return encode_image(render_text(temp_file_path))
+    except Exception as e:
+        logging.error(f"Error creating text preview: {str(e)}")
+        raise PreviewError("Error generating text preview")
+    finally:
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+
+def document_pdf(file_url, filename, file_type, office=None):
+    """The PDF bytes of a PDF or convertible document"""
+    if file_type == 'application/pdf':
+        return download_bytes(file_url)
+
+    temp_file_path = download(file_url, filename)
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_path = convert_to_pdf(temp_file_path, temp_dir, office)
+            if not os.path.exists(pdf_path):
+                raise PreviewError("Error converting document")
+            with open(pdf_path, 'rb') as f:
+                return f.read()
+    finally:
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+
+def pdf_page_sizes(pdf_path, max_pages, dpi=PAGE_DPI):
+    """Pixel (width, height) of the first max_pages pages rendered at dpi"""
+    try:
+        info = pdfinfo_from_path(pdf_path, first_page=1, last_page=max_pages, timeout=DOWNLOAD_TIMEOUT)
+    except Exception as e:
+        logging.error(f"Error reading PDF info: {str(e)}")
+        raise PreviewError("Error reading PDF")
+
+    count = min(info['Pages'], max_pages)
+    sizes = {}
+    rotated = set()
+    for key, value in info.items():
+        page = re.match(r'Page\s+(\d+) (size|rot)$', key)
+        if not page:
+            continue
+        number = int(page.group(1))
+        if page.group(2) == 'rot':
+            if value.strip() in ('90', '270'):
+                rotated.add(number)
+            continue
+        points = re.match(r'([\d.]+) x ([\d.]+)', value)
+        if points:
+            sizes[number] = (round(float(points.group(1)) * dpi / 72), round(float(points.group(2)) * dpi / 72))
+
+    pages = []
+    for number in range(1, count + 1):
+        width, height = sizes.get(number, (None, None))
+        pages.append((height, width) if number in rotated else (width, height))
+    return pages
+
+
+def image_size(data):
+    """(width, height) of image bytes, or (None, None) for formats PIL cannot read"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+def text_pages(data):
+    """Split a text file into viewer pages"""
+    content = data.decode('utf-8', errors='ignore')
+    return [content[i:i + TEXT_PAGE_SIZE] for i in range(0, len(content), TEXT_PAGE_SIZE)][:TEXT_MAX_PAGES]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import shutil
+import time
+
+from office_pool import DEFAULT_UNO_PYTHON, OfficePool
+from preview_cache import DEFAULT_MAX_BYTES, PreviewCache, preview_key
+from preview_render import PreviewError, document_pdf, download_bytes, render_text_preview
+from rasterize import Rasterizer, page_variant
+
+DOCUMENT_MAX_PAGES = 200
+
+# Rendering a page also renders this many pages after it, since the viewer
+# usually asks for them next
+RENDER_AHEAD = 2
+
+
+class PreviewService:
+    """Renders attachments into a PreviewCache, each rendering at most once.
+
+    The web app renders on request and preview_worker.py renders newly
+    indexed attachments ahead of time; both use the same cache directory,
+    so whichever renders first saves the other the work.
+    """
+
+    def __init__(self, cache, office=None, rasterizer=None, max_pages=DOCUMENT_MAX_PAGES, render_ahead=RENDER_AHEAD):
+        self.cache = cache
+        self.office = office
+        self.rasterizer = rasterizer
+        self.max_pages = max_pages
+        self.render_ahead = render_ahead
+
+    def original(self, file_id, file_url, file_type):
+        """Cache entry of an attachment's own bytes"""
+        return self.cache.get_or_render(
+            preview_key(file_id, file_url, 'original'), lambda: (download_bytes(file_url), file_type),
+            file_id=file_id, variant='original'
+        )
+
+    def document_pdf(self, file_id, filename, file_url, file_type):
+        """Cache entry of a document as PDF, converting it on first use"""
+        return self.cache.get_or_render(
+            preview_key(file_id, file_url, 'pdf'),
+            lambda: (document_pdf(file_url, filename, file_type, self.office), 'application/pdf'),
+            file_id=file_id, variant='pdf'
+        )
+
+    def page(self, file_id, filename, file_url, file_type, page_number, tier='viewer', image_format='JPEG'):
+        """Cache entry of one page image of a document, rendering it on first use
+
+        A miss renders the next render_ahead pages in the same pdftoppm run
+        and caches them too. Pages are written to disk and moved into the
+        cache.
+        """
+        mimetype = f'image/{image_format.lower()}'
+        staging = []
+
+        def render():
+            pdf = self.document_pdf(file_id, filename, file_url, file_type)
+            staging.append(self.cache.staging_dir())
+            started = time.perf_counter()
+            pages = self.rasterizer.render(pdf.path, page_number, min(page_number + self.render_ahead, self.max_pages),
+                                           tier, image_format, staging[0])
+            if page_number not in pages:
+                raise PreviewError("Page not found", 404)
+            render_ms = (time.perf_counter() - started) * 1000 / len(pages)
+            for number, path in pages.items():
+                if number == page_number:
+                    continue
+                key = preview_key(file_id, file_url, page_variant(number, tier, image_format))
+                if self.cache.get(key) is None:
+                    self.cache.put_file(key, path, mimetype, render_ms, file_id, f'page-{number}')
+            return pages[page_number], mimetype
+
+        try:
+            return self.cache.get_or_render(
+                preview_key(file_id, file_url, page_variant(page_number, tier, image_format)), render,
+                file_id=file_id, variant=f'page-{page_number}'
+            )
+        finally:
+            for directory in staging:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def preview(self, file_id, filename, file_url, file_type):
+        """Cache entry of the /preview image: a text file's start or a document's first page"""
+        if file_type == 'text/plain':
+            return self.cache.get_or_render(
+                preview_key(file_id, file_url), lambda: (render_text_preview(file_url, filename), 'image/jpeg'),
+                file_id=file_id
+            )
+        # The first page as the document viewer shows it, sharing its cache entry
+        return self.page(file_id, filename, file_url, file_type, 1)
+
+
+def preview_service_from_config(config, name):
+    """The PreviewService of one process, set up from the previews and office config sections
+
+    name tells the processes' LibreOffice profiles apart.
+    """
+    preview_config = config.get('previews', {})
+    office_config = config.get('office', {})
+    cache = PreviewCache(preview_config.get('directory', 'cache/previews'),
+                         max_bytes=preview_config.get('max_bytes', DEFAULT_MAX_BYTES))
+    office = OfficePool(size=office_config.get('pool_size', 2),
+                        binary=office_config.get('binary', 'libreoffice'),
+                        profile_dir=office_config.get('profile_dir', 'cache/office'),
+                        name=name,
+                        timeout=office_config.get('timeout', 60),
+                        max_jobs=office_config.get('max_jobs', 200),
+                        uno_python=office_config.get('uno_python', DEFAULT_UNO_PYTHON))
+    rasterizer = Rasterizer(workers=preview_config.get('render_workers'))
+    return PreviewService(cache, office, rasterizer,
+                          max_pages=preview_config.get('max_pages', DOCUMENT_MAX_PAGES),
+                          render_ahead=preview_config.get('render_ahead', RENDER_AHEAD))
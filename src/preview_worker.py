@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import signal
+import threading
+import time
+
+from db_pool import WRITE_PRAGMAS, open_connection
+from preview_render import WEBP_SUPPORTED
+from preview_service import preview_service_from_config
+from schema import ensure_schema
+
+logger = logging.getLogger('DiscordIndexer.PreviewWorker')
+
+# A claimed job is offered to other workers again after this long, in case
+# the worker that claimed it died
+LEASE_SECONDS = 600
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+
+POLL_INTERVAL = 5
+
+NEXT_JOB_SQL = '''
+    SELECT j.file_id, j.attempts, f.filename, f.file_url, f.file_type, f.deleted_at
+    FROM preview_jobs j
+    LEFT JOIN indexed_files f ON f.id = j.file_id
+    WHERE j.status != 'failed' AND j.run_after <= ?
+    ORDER BY j.priority DESC
+    LIMIT 1
+'''
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed attempts times"""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+class PreviewWorker:
+    """Renders queued previews into the preview cache ahead of the first viewer.
+
+    Jobs come from the preview_jobs table, newest attachment first. Each of
+    concurrency threads claims one job at a time by pushing its run_after
+    past the lease, renders the /preview image and the viewer's first page
+    and thumbnail, then deletes the job. Failed jobs are retried with
+    exponential backoff and marked failed after MAX_ATTEMPTS. Office
+    conversions and rasterizing are further bounded by the service's pools.
+    """
+
+    def __init__(self, db_path, service, concurrency=2, poll_interval=POLL_INTERVAL):
+        self.db_path = db_path
+        self.service = service
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {'rendered': 0, 'retried': 0, 'failed': 0, 'dropped': 0, 'render_ms': 0.0}
+
+        conn = open_connection(db_path, WRITE_PRAGMAS)
+        try:
+            ensure_schema(conn)
+        finally:
+            conn.close()
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def claim(self, conn):
+        """Claim the newest ready job, returning its row or None"""
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            job = conn.execute(NEXT_JOB_SQL, (now,)).fetchone()
+            if job is not None:
+                conn.execute('''
+                    UPDATE preview_jobs SET status = 'running', attempts = attempts + 1, run_after = ?
+                    WHERE file_id = ?
+                ''', (now + LEASE_SECONDS, job[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return job
+
+    def render(self, file_id, filename, file_url, file_type):
+        """Render what the first viewer of a file would ask for"""
+        self.service.preview(file_id, filename, file_url, file_type)
+        if file_type != 'text/plain':
+            image_format = 'WEBP' if WEBP_SUPPORTED else 'JPEG'
+            self.service.page(file_id, filename, file_url, file_type, 1, 'viewer', image_format)
+            self.service.page(file_id, filename, file_url, file_type, 1, 'thumbnail', image_format)
+
+    def run_job(self, conn, job):
+        file_id, attempts, filename, file_url, file_type, deleted_at = job
+        attempts += 1
+        if file_url is None or deleted_at is not None:
+            conn.execute('DELETE FROM preview_jobs WHERE file_id = ?', (file_id,))
+            self._count('dropped')
+            return
+
+        started = time.perf_counter()
+        try:
+            self.render(file_id, filename, file_url, file_type)
+        except Exception as e:
+            error = getattr(e, 'message', None) or str(e)
+            if attempts >= MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE preview_jobs SET status = 'failed', last_error = ? WHERE file_id = ?", (error, file_id)
+                )
+                self._count('failed')
+                logger.error(f"Giving up on preview of file {file_id} after {attempts} attempts: {error}")
+            else:
+                conn.execute(
+                    "UPDATE preview_jobs SET status = 'pending', run_after = ?, last_error = ? WHERE file_id = ?",
+                    (time.time() + backoff(attempts), error, file_id)
+                )
+                self._count('retried')
+                logger.warning(f"Preview of file {file_id} failed (attempt {attempts}), retrying later: {error}")
+            return
+
+        render_ms = (time.perf_counter() - started) * 1000
+        conn.execute('DELETE FROM preview_jobs WHERE file_id = ?', (file_id,))
+        self._count('rendered')
+        self._count('render_ms', render_ms)
+        logger.info(f"Rendered previews of file {file_id} ({filename}) in {render_ms:.0f} ms")
+
+    def work(self):
+        conn = open_connection(self.db_path, WRITE_PRAGMAS)
+        conn.isolation_level = None  # claim() manages its own transaction
+        try:
+            while not self.stopping.is_set():
+                try:
+                    job = self.claim(conn)
+                    if job is None:
+                        self.stopping.wait(self.poll_interval)
+                        continue
+                    self.run_job(conn, job)
+                except Exception as e:
+                    logger.error(f"Preview worker error: {e}")
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            conn.close()
+
+    def run(self):
+        """Work through the queue until stop() is called"""
+        threads = [threading.Thread(target=self.work, name=f'prerender-{i}') for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        logger.info(f"Preview worker started with {self.concurrency} threads")
+        for thread in threads:
+            thread.join()
+        self.service.office.stop()
+        self.service.rasterizer.shutdown()
+        logger.info(f"Preview worker stopped: {self.get_stats()}")
+
+    def stop(self):
+        self.stopping.set()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, render_ms=round(self.stats['render_ms'], 1))
+
+
+if __name__ == '__main__':
+    with open('config/config.json', 'r') as f:
+        config = json.load(f)
+
+    logging.basicConfig(
+        level=getattr(logging, config['logging']['level']),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    preview_config = config.get('previews', {})
+    worker = PreviewWorker(
+        config['database']['path'],
+        preview_service_from_config(config, 'worker'),
+        concurrency=preview_config.get('prerender_concurrency', 2)
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
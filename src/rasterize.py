@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from PIL import Image
+from pdf2image import convert_from_path
+
+from preview_render import PAGE_DPI, PreviewError
+
+logger = logging.getLogger('DiscordIndexer.Rasterizer')
+
+# Resolution of each use of a page image, so a sidebar thumbnail does not
+# pay for a zoomed-in page
+DPI_TIERS = {
+    'thumbnail': 50,
+    'viewer': PAGE_DPI,
+    'zoom': 300,
+}
+
+RENDER_TIMEOUT = 120
+
+JPEG_QUALITY = 85
+
+
+def page_variant(page_number, tier, image_format):
+    """Preview cache variant of one page image"""
+    return f'page-{page_number}-{tier}-{image_format}'
+
+
+def _render_range(pdf_path, first_page, last_page, dpi, image_format, out_dir):
+    """Render pages first_page..last_page into out_dir, one file per page
+
+    pdftoppm writes each page straight to disk and only one page at a time
+    is decoded when transcoding to WebP. Returns {page_number: path} for
+    the pages the PDF has.
+    """
+    jpeg = image_format == 'JPEG'
+    paths = convert_from_path(
+        pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, output_folder=out_dir,
+        output_file='page', paths_only=True, fmt='jpeg' if jpeg else 'ppm',
+        jpegopt={'quality': JPEG_QUALITY, 'optimize': True} if jpeg else None, timeout=RENDER_TIMEOUT
+    )
+    pages = {}
+    for path in paths:
+        number = int(re.search(r'-(\d+)\.\w+$', path).group(1))
+        if not jpeg:
+            with Image.open(path) as image:
+                encoded = os.path.splitext(path)[0] + '.' + image_format.lower()
+                image.convert('RGB').save(encoded, image_format, quality=JPEG_QUALITY)
+            os.unlink(path)
+            path = encoded
+        pages[number] = path
+    return pages
+
+
+class Rasterizer:
+    """Renders PDF pages to image files with a bounded number of pdftoppm processes.
+
+    Each job runs one pdftoppm over a page range, and at most workers jobs
+    (the CPU count by default) run at once; the rest wait in a queue, so a
+    burst of page requests cannot start a process per request. Callers ask
+    for a page range at a DPI tier and get back one file per page.
+    """
+
+    def __init__(self, workers=None, timeout=RENDER_TIMEOUT):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+        self.stats = {'jobs': 0, 'pages': 0, 'failures': 0, 'in_flight': 0, 'render_ms': 0.0}
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rasterize')
+            return self.executor
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def render(self, pdf_path, first_page, last_page, tier='viewer', image_format='JPEG', out_dir=None):
+        """Render a page range at a DPI tier, returning {page_number: path}
+
+        Files are written to out_dir, or a new temporary directory, and
+        belong to the caller. Pages past the end of the PDF are left out.
+        """
+        if tier not in DPI_TIERS:
+            raise PreviewError(f"Unknown page size {tier}", 400)
+        out_dir = out_dir or tempfile.mkdtemp(prefix='pages-')
+        executor = self._executor()
+        self._count('in_flight')
+        started = time.perf_counter()
+        try:
+            future = executor.submit(
+                _render_range, pdf_path, first_page, last_page, DPI_TIERS[tier], image_format, out_dir
+            )
+            pages = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._count('failures')
+            raise PreviewError("Page rendering timeout")
+        except Exception as e:
+            self._count('failures')
+            logger.error(f"Error rendering pages {first_page}-{last_page} of {pdf_path}: {e}")
+            raise PreviewError("Error converting PDF")
+        finally:
+            self._count('in_flight', -1)
+        self._count('jobs')
+        self._count('pages', len(pages))
+        self._count('render_ms', (time.perf_counter() - started) * 1000)
+        return pages
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                self.stats,
+                workers=self.workers,
+                render_ms=round(self.stats['render_ms'], 1),
+                avg_page_ms=round(self.stats['render_ms'] / self.stats['pages'], 1) if self.stats['pages'] else None,
+            )
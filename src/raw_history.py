@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from url_utils import extract_urls, parse_cdn_expiry
+
+logger = logging.getLogger('DiscordIndexer.RawHistory')
+
+DISCORD_API = 'https://discord.com/api/v10'
+DISCORD_EPOCH = 1420070400000
+
+# Maximum number of messages the history endpoint returns per request
+PAGE_SIZE = 100
+
+
+class HistoryForbidden(Exception):
+    """Raised when the bot may not read a channel's history"""
+
+
+def snowflake_time(snowflake):
+    """Get the creation time encoded in a snowflake, like discord.Message.created_at"""
+    return datetime.fromtimestamp(((int(snowflake) >> 22) + DISCORD_EPOCH) / 1000, tz=timezone.utc)
+
+
+def author_name(author):
+    """Format a user payload the way str(discord.User) does"""
+    discriminator = author.get('discriminator', '0')
+    if discriminator == '0':
+        return author['username']
+    return f"{author['username']}#{discriminator}"
+
+
+def project_message(payload, channel_name, guild_id=None, guild_name=None):
+    """Project a raw message payload into indexed_files and indexed_links rows
+
+    The rows have the same layout as DatabaseManager.file_row and link_row.
+    Messages by bots produce no rows.
+    """
+    author = payload['author']
+    if author.get('bot'):
+        return [], []
+
+    content = payload.get('content') or ''
+    common = (
+        payload['id'],
+        payload['channel_id'],
+        channel_name,
+        str(guild_id) if guild_id else None,
+        guild_name,
+        author['id'],
+        author_name(author)
+    )
+    created_at = snowflake_time(payload['id'])
+
+    file_rows = [
+        common + (
+            attachment['filename'],
+            attachment['url'],
+            attachment.get('size'),
+            attachment.get('content_type'),
+            content,
+            created_at,
+            parse_cdn_expiry(attachment['url'])
+        )
+        for attachment in payload.get('attachments', [])
+    ]
+
+    link_rows = []
+    if content:
+        link_rows = [
+            common + (url, urlparse(url).netloc, content, created_at)
+            for url in extract_urls(content)
+        ]
+
+    return file_rows, link_rows
+
+
+class RawHistoryFetcher:
+    """Page through a channel's message history as raw JSON.
+
+    Talks to the REST endpoint directly instead of going through
+    discord.py, so no Message, Member or embed objects are built for
+    messages that only need a handful of fields indexed. base_url can point
+    at a local stand-in server for benchmarking.
+    """
+
+    def __init__(self, session, token, base_url=DISCORD_API, budget=None):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Authorization': f'Bot {token}'}
+        self.budget = budget
+        self.requests = 0
+
+    async def _get_page(self, channel_id, params):
+        route = f"GET /channels/{channel_id}/messages"
+        url = f"{self.base_url}/channels/{channel_id}/messages"
+
+        while True:
+            if self.budget:
+                await self.budget.acquire(route)
+
+            async with self.session.get(url, params=params, headers=self.headers) as response:
+                self.requests += 1
+                if self.budget:
+                    self.budget.update_from_headers(route, response.headers, response.status)
+
+                if response.status == 429:
+                    if not self.budget:
+                        await asyncio.sleep(float(response.headers.get('Retry-After', 1.0)))
+                    continue
+                if response.status == 403:
+                    raise HistoryForbidden(f"Missing access to channel {channel_id}")
+
+                response.raise_for_status()
+                return await response.json()
+
+    async def pages(self, channel_id, before=None, after=None):
+        """Yield pages of message payloads
+
+        Without `after` pages go from newest to oldest, starting before
+        `before` if given. With `after` they go from oldest to newest.
+        """
+        while True:
+            params = {'limit': PAGE_SIZE}
+            if after is not None:
+                params['after'] = str(after)
+            elif before is not None:
+                params['before'] = str(before)
+
+            page = await self._get_page(channel_id, params)
+            if not page:
+                return
+
+            ids = [int(message['id']) for message in page]
+            if after is not None:
+                page.sort(key=lambda message: int(message['id']))
+                after = max(ids)
+            else:
+                before = min(ids)
+
+            yield page
+
+            if len(page) < PAGE_SIZE:
+                return
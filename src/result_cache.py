@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+def deep_sizeof(value):
+    """Approximate memory held by a query result, in bytes"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_sizeof(item) for item in value)
+    return size
+
+class ResultCache:
+    """LRU cache of query results that drops everything when the database changes.
+
+    A dedicated connection watches PRAGMA data_version, which changes
+    whenever another connection commits, including the bot's writes and
+    this process's own writer connection. Entries also expire after ttl
+    seconds if given. Cached values are shared between callers, who must
+    not modify them.
+    """
+
+    def __init__(self, db_path, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, stored_at, size)
+        self.lock = threading.Lock()
+        self.watcher = sqlite3.connect(db_path, check_same_thread=False)
+        self.data_version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        version = self.watcher.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.data_version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.bytes = 0
+            self.data_version = version
+
+    def cached(self, key, compute):
+        """Return the cached result for key, or compute() and cache it
+
+        A result is only kept if the database did not change while it was
+        being computed. Exceptions from compute() propagate uncached.
+        """
+        with self.lock:
+            self._check_version()
+            version = self.data_version
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = compute()
+        size = deep_sizeof(value)
+
+        with self.lock:
+            self._check_version()
+            if self.data_version != version:
+                return value
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (value, time.monotonic(), size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+        return value
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+from migrations import ROLLUP_BACKFILLS
+from schema import ROLLUP_FACETS
+
+SOURCE_TABLES = {source: table for table, (source, _) in ROLLUP_FACETS.items()}
+
+
+class StatsRollup:
+    """Read counts of files and links from stats_rollup.
+
+    Every read touches only the rollup rows of one facet. Until the
+    backfill of a source has finished, counts come from the fact table
+    instead, so they are right from the first start.
+    """
+
+    def __init__(self):
+        self.ready = set()
+
+    def is_ready(self, conn, source):
+        if source not in self.ready and ROLLUP_BACKFILLS[SOURCE_TABLES[source]].ready(conn):
+            self.ready.add(source)
+        return source in self.ready
+
+    def _expression(self, source, facet):
+        table = SOURCE_TABLES[source]
+        return dict(ROLLUP_FACETS[table][1])[facet].format(row=table)
+
+    def total(self, conn, source):
+        """Number of live rows of 'files' or 'links'"""
+        if self.is_ready(conn, source):
+            row = conn.execute(
+                "SELECT count FROM stats_rollup WHERE source = ? AND facet = 'total' AND value = ''", (source,)
+            ).fetchone()
+            return row[0] if row else 0
+        return conn.execute(f'SELECT COUNT(*) FROM {SOURCE_TABLES[source]} WHERE deleted_at IS NULL').fetchone()[0]
+
+    def top(self, conn, source, facet, limit=10):
+        """The most common values of a facet as (value, count) pairs"""
+        if self.is_ready(conn, source):
+            return conn.execute('''
+                SELECT value, count FROM stats_rollup
+                WHERE source = ? AND facet = ? AND value != '' AND count > 0
+                ORDER BY count DESC LIMIT ?
+            ''', (source, facet, limit)).fetchall()
+        expression = self._expression(source, facet)
+        return conn.execute(f'''
+            SELECT {expression}, COUNT(*) AS count FROM {SOURCE_TABLES[source]}
+            WHERE deleted_at IS NULL AND {expression} != ''
+            GROUP BY 1 ORDER BY count DESC LIMIT ?
+        ''', (limit,)).fetchall()
+
+    def since(self, conn, source, hours):
+        """Rows indexed in the last hours, counted by whole hours"""
+        if self.is_ready(conn, source):
+            return conn.execute('''
+                SELECT COALESCE(SUM(count), 0) FROM stats_rollup
+                WHERE source = ? AND facet = 'hour' AND value > strftime('%Y-%m-%d %H', 'now', ?)
+            ''', (source, f'-{hours} hours')).fetchone()[0]
+        return conn.execute(f'''
+            SELECT COUNT(*) FROM {SOURCE_TABLES[source]}
+            WHERE indexed_at > datetime('now', ?) AND deleted_at IS NULL
+        ''', (f'-{hours} hours',)).fetchone()[0]
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+import logging
+import sqlite3
+
+logger = logging.getLogger('DiscordIndexer.Schema')
+
+# Fact tables, formatted with a table name so migrations can build a copy
+# of them under another name. Names and message text live in the dimension
+# tables; these only keep the snowflakes referencing them. timestamp is the
+# message time in epoch milliseconds.
+FILES_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    guild_id INTEGER,
+    author_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    file_url TEXT NOT NULL,
+    file_size INTEGER,
+    file_type TEXT,
+    mime_major TEXT,
+    mime_minor TEXT,
+    timestamp INTEGER NOT NULL,
+    indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    url_expires_at INTEGER,
+    url_checked_at INTEGER,
+    deleted_at DATETIME,
+    UNIQUE(message_id, file_url)
+);
+'''
+
+LINKS_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    guild_id INTEGER,
+    author_id INTEGER NOT NULL,
+    link_url TEXT NOT NULL,
+    link_domain TEXT,
+    registrable_domain TEXT,
+    timestamp INTEGER NOT NULL,
+    indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    deleted_at DATETIME,
+    UNIQUE(message_id, link_url)
+);
+'''
+
+# Tables shared by the bot and the web app. Everything is idempotent so both
+# processes can run ensure_schema() on startup against an existing database.
+SCHEMA_SQL = FILES_TABLE_SQL.format(name='indexed_files') + LINKS_TABLE_SQL.format(name='indexed_links') + '''
+-- Dimension tables keyed by snowflake. Each name and message text is stored
+-- once here instead of on every file and link row.
+CREATE TABLE IF NOT EXISTS guilds (
+    guild_id INTEGER PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS authors (
+    author_id INTEGER PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    content TEXT
+);
+
+CREATE TABLE IF NOT EXISTS indexing_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation_type TEXT NOT NULL,
+    channel_id TEXT,
+    channel_name TEXT,
+    started_at DATETIME,
+    completed_at DATETIME,
+    status TEXT DEFAULT 'running',
+    messages_processed INTEGER DEFAULT 0,
+    files_indexed INTEGER DEFAULT 0,
+    links_indexed INTEGER DEFAULT 0,
+    index_mode TEXT,
+    pages_saved INTEGER DEFAULT 0
+);
+
+-- Crawl position per channel or thread. newest/oldest are the snowflakes of
+-- the newest and oldest messages whose rows have been committed.
+CREATE TABLE IF NOT EXISTS channel_checkpoints (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    newest_message_id INTEGER,
+    oldest_message_id INTEGER,
+    backfill_complete INTEGER NOT NULL DEFAULT 0,
+    messages_seen INTEGER NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Row counts of the fact tables per facet, kept up to date by the triggers
+-- from rollup_triggers_sql() so stats never have to scan the tables. source
+-- is 'files' or 'links'; ROLLUP_FACETS lists the facets and their values.
+CREATE TABLE IF NOT EXISTS stats_rollup (
+    source TEXT NOT NULL,
+    facet TEXT NOT NULL,
+    value NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, facet, value)
+) WITHOUT ROWID;
+
+-- Progress of the chunked table rebuilds in migrations.py
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    name TEXT PRIMARY KEY,
+    position INTEGER,
+    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    completed_at DATETIME
+);
+
+-- Previews waiting to be rendered by preview_worker.py. The bot adds a job
+-- for each previewable attachment it indexes and the worker deletes it once
+-- rendered. priority is the message time, so the newest files go first;
+-- run_after holds back retries and jobs a worker has claimed. Jobs that
+-- keep failing are left with status 'failed'.
+CREATE TABLE IF NOT EXISTS preview_jobs (
+    file_id INTEGER PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_preview_jobs_queue ON preview_jobs(priority) WHERE status != 'failed';
+
+CREATE INDEX IF NOT EXISTS idx_files_channel ON indexed_files(channel_id);
+CREATE INDEX IF NOT EXISTS idx_files_author ON indexed_files(author_id);
+CREATE INDEX IF NOT EXISTS idx_files_timestamp ON indexed_files(timestamp);
+CREATE INDEX IF NOT EXISTS idx_links_channel ON indexed_links(channel_id);
+CREATE INDEX IF NOT EXISTS idx_links_author ON indexed_links(author_id);
+CREATE INDEX IF NOT EXISTS idx_links_timestamp ON indexed_links(timestamp);
+CREATE INDEX IF NOT EXISTS idx_files_message ON indexed_files(message_id);
+CREATE INDEX IF NOT EXISTS idx_links_message ON indexed_links(message_id);
+'''
+
+# Indexes on columns that may have been added by ADDED_COLUMNS
+INDEXES_SQL = '''
+CREATE INDEX IF NOT EXISTS idx_files_url_expires ON indexed_files(url_expires_at);
+-- Listing filters, newest first. Listings never show deleted rows, so
+-- the indexes leave them out and counts need not visit the table.
+CREATE INDEX IF NOT EXISTS idx_files_mime_major ON indexed_files(mime_major, timestamp) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_files_mime_minor ON indexed_files(mime_minor, timestamp) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_links_registrable_domain ON indexed_links(registrable_domain, timestamp)
+    WHERE deleted_at IS NULL;
+'''
+
+# Full-text search over files and links. The FTS5 tables are external
+# content indexes over the *_search views, so the text itself is only stored
+# once. The backfill in migrations.py fills them and creates FTS_TRIGGERS_SQL
+# once they are ready, after which the triggers keep them in sync.
+SEARCH_SQL = '''
+CREATE VIEW IF NOT EXISTS files_search AS
+SELECT f.id, f.filename, m.content, a.name AS author
+FROM indexed_files f
+LEFT JOIN messages m ON m.message_id = f.message_id
+LEFT JOIN authors a ON a.author_id = f.author_id;
+
+CREATE VIEW IF NOT EXISTS links_search AS
+SELECT l.id, l.link_url, m.content, a.name AS author
+FROM indexed_links l
+LEFT JOIN messages m ON m.message_id = l.message_id
+LEFT JOIN authors a ON a.author_id = l.author_id;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    filename, content, author,
+    content='files_search', content_rowid='id', prefix='2 3'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS links_fts USING fts5(
+    link_url, content, author,
+    content='links_search', content_rowid='id', prefix='2 3'
+);
+'''
+
+# Keeps {fts} in step with its fact table and the message and author text it
+# indexes. An external content index has to be given the old values to drop
+# a row, so each change deletes the old entry before inserting the new one.
+# Rows at or above the backfill position are already indexed; rows below it
+# are picked up by the backfill with their current text.
+FTS_TRIGGERS_TEMPLATE = '''
+CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table}
+BEGIN
+    INSERT INTO {fts} (rowid, {column}, content, author) VALUES (
+        NEW.id, NEW.{column},
+        (SELECT content FROM messages WHERE message_id = NEW.message_id),
+        (SELECT name FROM authors WHERE author_id = NEW.author_id)
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table}
+WHEN OLD.id >= {indexed_from}
+BEGIN
+    INSERT INTO {fts} ({fts}, rowid, {column}, content, author) VALUES (
+        'delete', OLD.id, OLD.{column},
+        (SELECT content FROM messages WHERE message_id = OLD.message_id),
+        (SELECT name FROM authors WHERE author_id = OLD.author_id)
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table}
+WHEN OLD.id >= {indexed_from}
+BEGIN
+    INSERT INTO {fts} ({fts}, rowid, {column}, content, author) VALUES (
+        'delete', OLD.id, OLD.{column},
+        (SELECT content FROM messages WHERE message_id = OLD.message_id),
+        (SELECT name FROM authors WHERE author_id = OLD.author_id)
+    );
+    INSERT INTO {fts} (rowid, {column}, content, author) VALUES (
+        NEW.id, NEW.{column},
+        (SELECT content FROM messages WHERE message_id = NEW.message_id),
+        (SELECT name FROM authors WHERE author_id = NEW.author_id)
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS {fts}_message_update AFTER UPDATE OF content ON messages
+BEGIN
+    INSERT INTO {fts} ({fts}, rowid, {column}, content, author)
+    SELECT 'delete', t.id, t.{column}, OLD.content, a.name
+    FROM {table} t LEFT JOIN authors a ON a.author_id = t.author_id
+    WHERE t.message_id = NEW.message_id AND t.id >= {indexed_from};
+    INSERT INTO {fts} (rowid, {column}, content, author)
+    SELECT t.id, t.{column}, NEW.content, a.name
+    FROM {table} t LEFT JOIN authors a ON a.author_id = t.author_id
+    WHERE t.message_id = NEW.message_id AND t.id >= {indexed_from};
+END;
+
+CREATE TRIGGER IF NOT EXISTS {fts}_author_update AFTER UPDATE OF name ON authors
+BEGIN
+    INSERT INTO {fts} ({fts}, rowid, {column}, content, author)
+    SELECT 'delete', t.id, t.{column}, m.content, OLD.name
+    FROM {table} t LEFT JOIN messages m ON m.message_id = t.message_id
+    WHERE t.author_id = NEW.author_id AND t.id >= {indexed_from};
+    INSERT INTO {fts} (rowid, {column}, content, author)
+    SELECT t.id, t.{column}, m.content, NEW.name
+    FROM {table} t LEFT JOIN messages m ON m.message_id = t.message_id
+    WHERE t.author_id = NEW.author_id AND t.id >= {indexed_from};
+END;
+'''
+
+
+def fts_triggers_sql(fts, table, column, migration):
+    """Triggers keeping an FTS table in sync, for the backfill named migration"""
+    indexed_from = f"(SELECT COALESCE(position, 0) FROM schema_migrations WHERE name = '{migration}')"
+    return FTS_TRIGGERS_TEMPLATE.format(fts=fts, table=table, column=column, indexed_from=indexed_from)
+
+
+# Facets counted in stats_rollup for each fact table, as (facet, expression)
+# pairs over a {row} alias. Rows of deleted messages are not counted. hour
+# buckets rows by the UTC hour they were indexed in, as 'YYYY-MM-DD HH'.
+# type and category count normalized MIME types and their major part, and
+# domain counts registrable domains, so www.example.com and
+# cdn.example.com add up under example.com.
+ROLLUP_FACETS = {
+    'indexed_files': ('files', [
+        ('total', "''"),
+        ('type', "COALESCE({row}.mime_major || '/' || {row}.mime_minor, {row}.mime_major, '')"),
+        ('category', "COALESCE({row}.mime_major, '')"),
+        ('channel', '{row}.channel_id'),
+        ('author', '{row}.author_id'),
+        ('hour', 'substr({row}.indexed_at, 1, 13)'),
+    ]),
+    'indexed_links': ('links', [
+        ('total', "''"),
+        ('domain', "COALESCE({row}.registrable_domain, {row}.link_domain, '')"),
+        ('channel', '{row}.channel_id'),
+        ('author', '{row}.author_id'),
+        ('hour', 'substr({row}.indexed_at, 1, 13)'),
+    ]),
+}
+
+# Columns the facets are computed from, whose updates move counts around
+ROLLUP_COLUMNS = {
+    'indexed_files': ['deleted_at', 'indexed_at', 'channel_id', 'author_id', 'mime_major', 'mime_minor'],
+    'indexed_links': ['deleted_at', 'indexed_at', 'channel_id', 'author_id', 'registrable_domain', 'link_domain'],
+}
+
+ROLLUP_UPSERT = '''
+    INSERT INTO stats_rollup (source, facet, value, count)
+    SELECT * FROM ({rows}) WHERE {condition}
+    ON CONFLICT (source, facet, value) DO UPDATE SET count = count + excluded.count;
+'''
+
+
+def rollup_rows(table, row, change):
+    """SELECTs giving one (source, facet, value, change) row per facet of row"""
+    source, facets = ROLLUP_FACETS[table]
+    return ' UNION ALL '.join(
+        f"SELECT '{source}', '{facet}', {expression.format(row=row)}, {change}" for facet, expression in facets
+    )
+
+
+def rollup_triggers_sql(table, migration):
+    """Triggers keeping the stats_rollup counts of a table, for the backfill named migration
+
+    Like the search triggers, changes to rows below the backfill position
+    are left to the backfill.
+    """
+    counted_from = f"(SELECT COALESCE(position, 0) FROM schema_migrations WHERE name = '{migration}')"
+    columns = ', '.join(ROLLUP_COLUMNS[table])
+    add_new = ROLLUP_UPSERT.format(rows=rollup_rows(table, 'NEW', 1), condition='NEW.deleted_at IS NULL')
+    remove_old = ROLLUP_UPSERT.format(rows=rollup_rows(table, 'OLD', -1), condition='OLD.deleted_at IS NULL')
+    return f'''
+CREATE TRIGGER IF NOT EXISTS {table}_rollup_insert AFTER INSERT ON {table}
+BEGIN
+    {add_new}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table}_rollup_delete AFTER DELETE ON {table}
+WHEN OLD.id >= {counted_from}
+BEGIN
+    {remove_old}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table}_rollup_update AFTER UPDATE OF {columns} ON {table}
+WHEN OLD.id >= {counted_from}
+BEGIN
+    {remove_old}
+    {add_new}
+END;
+'''
+
+
+def rollup_reset_sql(table):
+    """Drop a table's rollup triggers and counts, to recount it with new facets"""
+    source = ROLLUP_FACETS[table][0]
+    return f'''
+DROP TRIGGER IF EXISTS {table}_rollup_insert;
+DROP TRIGGER IF EXISTS {table}_rollup_delete;
+DROP TRIGGER IF EXISTS {table}_rollup_update;
+DELETE FROM stats_rollup WHERE source = '{source}';
+'''
+
+
+def rollup_backfill_sql(table):
+    """Add the counts of the rows with ids in [:low, :high) to stats_rollup"""
+    source, facets = ROLLUP_FACETS[table]
+    chunk = f'FROM {table} WHERE id >= :low AND id < :high AND deleted_at IS NULL'
+    rows = ' UNION ALL '.join(
+        f"SELECT '{source}', '{facet}', {expression.format(row=table)}, COUNT(*) {chunk} GROUP BY 3"
+        for facet, expression in facets
+    )
+    return ROLLUP_UPSERT.format(rows=rows, condition='true')
+
+
+# Columns added to existing tables after their first release
+ADDED_COLUMNS = {
+    'indexed_files': [
+        ('url_expires_at', 'INTEGER'),
+        ('deleted_at', 'DATETIME'),
+        ('mime_major', 'TEXT'),
+        ('mime_minor', 'TEXT'),
+        ('url_checked_at', 'INTEGER'),
+    ],
+    'indexed_links': [
+        ('deleted_at', 'DATETIME'),
+        ('registrable_domain', 'TEXT'),
+    ],
+    'indexing_stats': [
+        ('channel_id', 'TEXT'),
+        ('channel_name', 'TEXT'),
+        ('started_at', 'DATETIME'),
+        ('completed_at', 'DATETIME'),
+        ('messages_processed', 'INTEGER DEFAULT 0'),
+        ('files_indexed', 'INTEGER DEFAULT 0'),
+        ('links_indexed', 'INTEGER DEFAULT 0'),
+        ('index_mode', 'TEXT'),
+        ('pages_saved', 'INTEGER DEFAULT 0'),
+    ],
+}
+
+
+def get_columns(conn, table):
+    """Get the column names of a table"""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def get_column_type(conn, table, column):
+    """Get the declared type of a column, or None if it does not exist"""
+    for row in conn.execute(f'PRAGMA table_info({table})'):
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+
+def add_missing_columns(conn, table, columns):
+    """Add any of the given (name, definition) columns a table lacks"""
+    existing = set(get_columns(conn, table))
+    for name, definition in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            logger.info(f"Added column {table}.{name}")
+
+
+def ensure_schema(conn):
+    """Create missing tables, columns and indexes"""
+    conn.executescript(SCHEMA_SQL)
+    for table, columns in ADDED_COLUMNS.items():
+        add_missing_columns(conn, table, columns)
+    conn.executescript(INDEXES_SQL)
+    try:
+        conn.executescript(SEARCH_SQL)
+    except sqlite3.OperationalError as e:
+        # Search falls back to LIKE when SQLite is built without FTS5
+        logger.warning(f"Full-text search unavailable: {e}")
+    conn.commit()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import re
+
+from markupsafe import Markup, escape
+
+# Markers snippet() puts around matched terms, replaced when rendering
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+SEARCH_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+
+def build_match_query(text):
+    """Turn a search box entry into an FTS5 MATCH expression
+
+    "Quoted text" matches as a phrase, every other word as a prefix, and
+    all of them have to match. Returns None when nothing searchable is left,
+    e.g. for input made only of punctuation.
+    """
+    terms = []
+    for phrase, word in SEARCH_TOKEN.findall(text or ''):
+        term = phrase or word
+        if not re.search(r'\w', term):
+            continue
+        quoted = '"' + term.replace('"', '""') + '"'
+        terms.append(quoted if phrase else quoted + '*')
+    return ' '.join(terms) or None
+
+def highlight_snippet(snippet):
+    """Render a snippet() result as HTML with matches in <mark> tags"""
+    if not snippet:
+        return ''
+    html = str(escape(snippet))
+    return Markup(html.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
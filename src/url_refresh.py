@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+from urllib.parse import urlparse
+
+from raw_history import DISCORD_API
+from url_utils import parse_cdn_expiry
+
+logger = logging.getLogger('DiscordIndexer.URLRefresh')
+
+# Maximum number of URLs the refresh-urls endpoint accepts per request
+REFRESH_BATCH_SIZE = 50
+
+
+def url_identity(url):
+    """Identify an attachment URL independently of its signature parameters"""
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def apply_refreshed_urls(conn, updates):
+    """Write refreshed URLs back in a single transaction
+
+    updates is a list of (file_id, new_url) pairs. A row whose new URL
+    would duplicate another row of the same message is left unchanged.
+    Returns the number of rows updated.
+    """
+    before = conn.total_changes
+    with conn:
+        conn.executemany(
+            'UPDATE OR IGNORE indexed_files SET file_url = ?, url_expires_at = ? WHERE id = ?',
+            [(url, parse_cdn_expiry(url), file_id) for file_id, url in updates]
+        )
+    return conn.total_changes - before
+
+
+class AttachmentURLRefresher:
+    """Refresh signed CDN URLs in bulk via POST /attachments/refresh-urls.
+
+    One request refreshes up to REFRESH_BATCH_SIZE URLs, instead of one
+    message fetch per attachment. base_url can point at a local stand-in
+    server for benchmarking.
+    """
+
+    def __init__(self, session, token, base_url=DISCORD_API, budget=None):
+        self.session = session
+        self.url = f"{base_url.rstrip('/')}/attachments/refresh-urls"
+        self.headers = {'Authorization': f'Bot {token}'}
+        self.budget = budget
+        self.requests = 0
+
+    async def refresh(self, urls):
+        """Refresh up to REFRESH_BATCH_SIZE URLs
+
+        Returns a dict mapping each original URL that was refreshed to its
+        new URL. URLs the endpoint could not refresh are left out.
+        """
+        route = 'POST /attachments/refresh-urls'
+
+        while True:
+            if self.budget:
+                await self.budget.acquire(route)
+
+            async with self.session.post(self.url, json={'attachment_urls': list(urls)},
+                                         headers=self.headers) as response:
+                self.requests += 1
+                if self.budget:
+                    self.budget.update_from_headers(route, response.headers, response.status)
+
+                if response.status == 429:
+                    if not self.budget:
+                        await asyncio.sleep(float(response.headers.get('Retry-After', 1.0)))
+                    continue
+
+                response.raise_for_status()
+                data = await response.json()
+                break
+
+        # Match results by path so a re-encoded original still lines up
+        originals = {url_identity(url): url for url in urls}
+        refreshed = {}
+        for entry in data.get('refreshed_urls', []):
+            original = originals.get(url_identity(entry.get('original', '')))
+            if original and entry.get('refreshed'):
+                refreshed[original] = entry['refreshed']
+        return refreshed
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import re
+from urllib.parse import parse_qs, urlparse
+
+URL_PATTERN = re.compile(
+    r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+)
+
+def extract_urls(text):
+    """Extract URLs from text"""
+    urls = URL_PATTERN.findall(text)
+    
+    # Clean up URLs by removing trailing punctuation that's commonly found at sentence ends
+    cleaned_urls = []
+    for url in urls:
+        # Remove trailing punctuation like ), ,, ., ;, :, !, ?
+        cleaned_url = re.sub(r'[),.:;!?]+$', '', url)
+        cleaned_urls.append(cleaned_url)
+    
+    return cleaned_urls
+
+def parse_cdn_expiry(url):
+    """Get the expiry of a signed Discord CDN URL as a Unix timestamp
+    
+    Attachment URLs carry ex= (expiry), is= (issued) and hm= (signature)
+    query parameters, with the timestamps in hex. Returns None for URLs
+    without a valid ex= parameter.
+    """
+    try:
+        expiry = parse_qs(urlparse(url).query).get('ex')
+        return int(expiry[0], 16) if expiry else None
+    except (ValueError, TypeError):
+        return None
@@ -1,24 +1,31 @@
 #!/usr/bin/env python3
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, g, has_request_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import requests
 import sqlite3
 import json
 import hashlib
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 from urllib.parse import urlparse
 import logging
 from user_manager import UserManager
 from discord_auth import DiscordOAuth2
-
-import tempfile
-import io
-import base64
-from PIL import Image
-from pdf2image import convert_from_path
-import subprocess
+from schema import ensure_schema, get_columns
+from migrations import COLUMN_BACKFILLS, SEARCH_BACKFILLS
+from normalize import MIME_MAJOR_TYPES, registrable_domain, url_registrable_domain
+from db_pool import ConnectionPool
+from counts import DEFAULT_COUNT_LIMIT, CountCache, Total, filter_key
+from result_cache import ResultCache
+from pagination import decode_cursor, keyset_condition, paginate
+from rollups import StatsRollup
+from search import SNIPPET_END, SNIPPET_START, build_match_query, highlight_snippet
+from preview_cache import preview_key
+from file_types import IMAGE_TYPES, PREVIEW_TYPES, VIEWER_TYPES
+from preview_render import WEBP_SUPPORTED, PreviewError, download_bytes, image_size, pdf_page_sizes, text_pages
+from preview_service import preview_service_from_config
+from rasterize import DPI_TIERS
 
 # Load configuration
 with open('config/config.json', 'r') as f:
@@ -68,53 +75,173 @@ class User(UserMixin):
     def is_active(self):
         return self._is_active
 
+# Names and message text for a fact table aliased as {fact}
+FACT_DIMENSION_JOINS = '''
+    LEFT JOIN channels c ON c.channel_id = {fact}.channel_id
+    LEFT JOIN guilds g ON g.guild_id = {fact}.guild_id
+    LEFT JOIN authors a ON a.author_id = {fact}.author_id
+    LEFT JOIN messages m ON m.message_id = {fact}.message_id
+'''
+
+# Joined column and legacy inline column of each name and the message text
+DIMENSION_COLUMNS = {
+    'channel': ('c.name', 'channel_name'),
+    'guild': ('g.name', 'guild_name'),
+    'author': ('a.name', 'author_name'),
+    'content': ('m.content', 'message_content')
+}
+
+def glob_prefix(text):
+    """A GLOB pattern matching text as a literal prefix"""
+    return ''.join(f'[{char}]' if char in '*?[' else char for char in text) + '*'
+
+def file_type_condition(file_type):
+    """Filter on the indexed MIME columns: 'image' matches the type, 'pdf'
+    the subtype and 'image/jp' the subtype by prefix"""
+    major, slash, minor = file_type.strip().lower().partition('/')
+    if not slash:
+        return ('f.mime_major = ?' if major in MIME_MAJOR_TYPES else 'f.mime_minor = ?'), [major]
+    if not minor:
+        return 'f.mime_major = ?', [major]
+    return 'f.mime_major = ? AND f.mime_minor GLOB ?', [major, glob_prefix(minor)]
+
+def domain_condition(domain):
+    """Filter on the indexed registrable domain: host names and URLs match
+    their whole site, anything else is a prefix of the domain"""
+    domain = domain.strip().lower()
+    if '://' in domain:
+        return 'l.registrable_domain = ?', [url_registrable_domain(domain)]
+    if '.' in domain:
+        return 'l.registrable_domain = ?', [registrable_domain(domain)]
+    return 'l.registrable_domain GLOB ?', [glob_prefix(domain)]
+
+def count_query(statement):
+    # FTS5 reports the statements it runs on its shadow tables as comments
+    if has_request_context() and not statement.startswith('--'):
+        g.db_queries = g.get('db_queries', 0) + 1
+
 class DatabaseManager:
     def __init__(self, db_path):
         self.db_path = db_path
+        self.ready_backfills = set()
+        self.normalized_tables = set()
+        self.rollup = StatsRollup()
+        self.results = ResultCache(db_path, max_entries=config.get('web', {}).get('result_cache_size', 256),
+                                   ttl=config.get('web', {}).get('result_cache_ttl', 60))
+        self.counts = CountCache(db_path, limit=config.get('web', {}).get('count_limit', DEFAULT_COUNT_LIMIT))
+        self.pool = ConnectionPool(db_path, max_idle=config.get('web', {}).get('db_pool_size', 8))
+        conn = self.get_write_connection()
+        try:
+            ensure_schema(conn)
+        finally:
+            self.release_connection(conn)
     
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """Get a pooled read-only connection; return it with release_connection()"""
+        return self._track(self.pool.acquire())
+    
+    def get_write_connection(self):
+        """Get the shared writer connection; return it with release_connection()"""
+        return self._track(self.pool.acquire_writer())
+    
+    def release_connection(self, conn):
+        self.pool.release(conn)
+    
+    def _track(self, conn):
+        if has_request_context():
+            # Count connections and statements per request so N+1 query
+            # patterns show up in the response headers and the log
+            g.db_connections = g.get('db_connections', 0) + 1
+            conn.set_trace_callback(count_query)
+        return conn
+    
+    def backfill_ready(self, conn, migration):
+        """Whether a backfill migration has completed"""
+        if migration.name not in self.ready_backfills:
+            try:
+                if migration.ready(conn):
+                    self.ready_backfills.add(migration.name)
+            except sqlite3.Error:
+                pass
+        return migration.name in self.ready_backfills
+    
+    def dimension_columns(self, conn, table, fact):
+        """SQL for the names and message text of a fact table's rows, by DIMENSION_COLUMNS key
+        
+        Until the normalize rebuild of the table swaps in, rows it has not
+        reached yet only carry them inline, so those columns fill the gaps.
+        """
+        if table not in self.normalized_tables:
+            if 'channel_name' in get_columns(conn, table):
+                return {key: f'COALESCE({column}, {fact}.{inline})'
+                        for key, (column, inline) in DIMENSION_COLUMNS.items()}
+            self.normalized_tables.add(table)
+        return {key: column for key, (column, _) in DIMENSION_COLUMNS.items()}
+    
+    def search_index_ready(self, conn, table):
+        """Whether the full-text index of a table has been fully backfilled"""
+        return self.backfill_ready(conn, SEARCH_BACKFILLS[table])
+    
+    def get_files(self, per_page=50, search=None, file_type=None, tag_ids=None, page_cursor=None):
+        """Get a page of files with optional search and filtering
+
+        Pages are addressed by keyset cursors rather than offsets, so any
+        page costs the same however deep it is. page_cursor is a next or
+        previous token from an earlier call; returns (files, total,
+        next_cursor, prev_cursor) with total a counts.Total. Results are
+        cached until the database changes.
+        """
+        key = ('files', per_page, filter_key('files', search, file_type, tag_ids), page_cursor)
+        try:
+            return self.results.cached(key, lambda: self._query_files(per_page, search, file_type, tag_ids, page_cursor))
+        except Exception as e:
+            print(f"Error getting files: {e}")
+            return [], Total(0, False), None, None
     
-    def get_files(self, page=1, per_page=50, search=None, file_type=None, tag_ids=None):
-        """Get paginated files with optional search and filtering"""
+    def _query_files(self, per_page, search, file_type, tag_ids, page_cursor):
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
+            # Search through the full-text index once it is built, ranked by
+            # relevance with a highlighted snippet of the match
+            match = build_match_query(search) if search and self.search_index_ready(conn, 'indexed_files') else None
+            names = self.dimension_columns(conn, 'indexed_files', 'f')
+            
             # Build query
+            select_sql = f'''
+                SELECT {'DISTINCT' if tag_ids else ''} f.id, f.message_id, {names["channel"]}, {names["guild"]},
+                       {names["author"]}, f.filename, f.file_url, f.file_size, f.file_type, {names["content"]}, 
+                       f.timestamp, f.indexed_at
+                       {", snippet(files_fts, -1, ?, ?, '…', 16), files_fts.rank" if match else ''}
+            '''
+            from_sql = f'''
+                FROM {'files_fts JOIN indexed_files f ON f.id = files_fts.rowid' if match else 'indexed_files f'}
+            '''
+            dimension_joins = FACT_DIMENSION_JOINS.format(fact='f')
             if tag_ids:
                 # Join with file_tags when filtering by tags
-                query = '''
-                    SELECT DISTINCT f.id, f.message_id, f.channel_name, f.guild_name, f.author_name, 
-                           f.filename, f.file_url, f.file_size, f.file_type, f.message_content, 
-                           f.timestamp, f.indexed_at
-                    FROM indexed_files f
-                    JOIN file_tags ft ON f.id = ft.file_id
-                '''
-            else:
-                query = '''
-                    SELECT id, message_id, channel_name, guild_name, author_name, 
-                           filename, file_url, file_size, file_type, message_content, 
-                           timestamp, indexed_at
-                    FROM indexed_files
-                '''
+                from_sql += ' JOIN file_tags ft ON f.id = ft.file_id'
             
-            conditions = []
+            # Rows of deleted messages and attachments are kept as tombstones
+            conditions = ['f.deleted_at IS NULL']
             params = []
             
-            if search:
-                if tag_ids:
-                    conditions.append('(f.filename LIKE ? OR f.message_content LIKE ? OR f.author_name LIKE ?)')
-                else:
-                    conditions.append('(filename LIKE ? OR message_content LIKE ? OR author_name LIKE ?)')
+            if match:
+                conditions.append('files_fts MATCH ?')
+                params.append(match)
+            elif search:
+                conditions.append(f'(f.filename LIKE ? OR {names["content"]} LIKE ? OR {names["author"]} LIKE ?)')
                 search_param = f'%{search}%'
                 params.extend([search_param, search_param, search_param])
             
-            if file_type:
-                if tag_ids:
-                    conditions.append('f.file_type LIKE ?')
-                else:
-                    conditions.append('file_type LIKE ?')
+            # Until the MIME columns are backfilled, match the raw type text
+            if file_type and self.backfill_ready(conn, COLUMN_BACKFILLS['indexed_files']):
+                condition, condition_params = file_type_condition(file_type)
+                conditions.append(condition)
+                params.extend(condition_params)
+            elif file_type:
+                conditions.append('f.file_type LIKE ?')
                 params.append(f'%{file_type}%')
             
             if tag_ids:
@@ -126,81 +253,106 @@ class DatabaseManager:
                     conditions.append('ft.tag_id = ?')
                     params.append(tag_ids)
             
-            if conditions:
-                query += ' WHERE ' + ' AND '.join(conditions)
+            # Newest first, or best match first when searching the index
+            order = 'rank' if match else 'time'
+            sort_columns = ('files_fts.rank', 'f.id') if match else ('f.timestamp', 'f.id')
+            position = decode_cursor(page_cursor, order)
+            keyset, keyset_params, order_by = keyset_condition(sort_columns, position, descending=not match)
             
-            if tag_ids:
-                query += ' ORDER BY f.timestamp DESC'
-            else:
-                query += ' ORDER BY timestamp DESC'
+            where_sql = ' WHERE ' + ' AND '.join(conditions)
             
-            # Get total count
-            count_query = query.replace(
-                'SELECT id, message_id, channel_name, guild_name, author_name, filename, file_url, file_size, file_type, message_content, timestamp, indexed_at',
-                'SELECT COUNT(*)'
-            )
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
+            # Unfiltered totals come from the rollups. Filtered ones are
+            # counted from the same FROM and WHERE and cached; searches
+            # stop counting at the count limit. The dimension joins never
+            # drop or repeat rows, so counts only join them for LIKE search.
+            count_sql = from_sql + (dimension_joins if search and not match else '') + where_sql
+            from_sql += dimension_joins + where_sql
+            if search or file_type or tag_ids:
+                total = self.counts.count(
+                    conn, filter_key('files:fts' if match else 'files', match or search, file_type, tag_ids), count_sql, list(params),
+                    distinct_column='f.id' if tag_ids else None, capped=bool(search)
+                )
+            else:
+                total = Total(self.rollup.total(conn, 'files'), False)
             
-            # Add pagination
-            offset = (page - 1) * per_page
-            query += ' LIMIT ? OFFSET ?'
-            params.extend([per_page, offset])
+            # Add pagination, reading one extra row to see if more follow
+            if keyset:
+                from_sql += f' AND {keyset}'
+                params.extend(keyset_params)
+            params.append(per_page + 1)
             
-            cursor.execute(query, params)
-            files = cursor.fetchall()
+            select_params = [SNIPPET_START, SNIPPET_END] if match else []
+            cursor.execute(select_sql + from_sql + order_by + ' LIMIT ?', select_params + params)
+            files, next_cursor, prev_cursor = paginate(
+                cursor.fetchall(), position, order,
+                lambda row: (row[13], row[0]) if match else (row[10], row[0]), per_page
+            )
             
-            # Add tags for each file
-            files_with_tags = []
-            for file in files:
-                file_tags = self.get_file_tags(file[0])  # file[0] is the file ID
-                files_with_tags.append(list(file) + [file_tags])
+            # Add tags for each file, followed by the search snippet
+            tags = self.load_tags(conn, 'file_tags', 'file_id', [file[0] for file in files])
+            files_with_tags = [list(file[:12]) + [tags[file[0]], file[12] if match else None] for file in files]
             
-            return files_with_tags, total
-        except Exception as e:
-            print(f"Error getting files: {e}")
-            return [], 0
+            return files_with_tags, total, next_cursor, prev_cursor
         finally:
-            conn.close()
+            self.release_connection(conn)
+    
+    def get_links(self, per_page=50, search=None, domain=None, tag_ids=None, page_cursor=None):
+        """Get a page of links with optional search and filtering
+
+        Pages are addressed by keyset cursors rather than offsets, so any
+        page costs the same however deep it is. page_cursor is a next or
+        previous token from an earlier call; returns (links, total,
+        next_cursor, prev_cursor) with total a counts.Total. Results are
+        cached until the database changes.
+        """
+        key = ('links', per_page, filter_key('links', search, domain, tag_ids), page_cursor)
+        try:
+            return self.results.cached(key, lambda: self._query_links(per_page, search, domain, tag_ids, page_cursor))
+        except Exception as e:
+            print(f"Error getting links: {e}")
+            return [], Total(0, False), None, None
     
-    def get_links(self, page=1, per_page=50, search=None, domain=None, tag_ids=None):
-        """Get paginated links with optional search and filtering"""
+    def _query_links(self, per_page, search, domain, tag_ids, page_cursor):
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
+            match = build_match_query(search) if search and self.search_index_ready(conn, 'indexed_links') else None
+            names = self.dimension_columns(conn, 'indexed_links', 'l')
+            
             # Build query
+            select_sql = f'''
+                SELECT {'DISTINCT' if tag_ids else ''} l.id, l.message_id, {names["channel"]}, {names["guild"]},
+                       {names["author"]}, l.link_url, l.link_domain, {names["content"]}, l.timestamp, l.indexed_at
+                       {", snippet(links_fts, -1, ?, ?, '…', 16), links_fts.rank" if match else ''}
+            '''
+            from_sql = f'''
+                FROM {'links_fts JOIN indexed_links l ON l.id = links_fts.rowid' if match else 'indexed_links l'}
+            '''
+            dimension_joins = FACT_DIMENSION_JOINS.format(fact='l')
             if tag_ids:
                 # Join with link_tags when filtering by tags
-                query = '''
-                    SELECT DISTINCT l.id, l.message_id, l.channel_name, l.guild_name, l.author_name, 
-                           l.link_url, l.link_domain, l.message_content, l.timestamp, l.indexed_at
-                    FROM indexed_links l
-                    JOIN link_tags lt ON l.id = lt.link_id
-                '''
-            else:
-                query = '''
-                    SELECT id, message_id, channel_name, guild_name, author_name, 
-                           link_url, link_domain, message_content, timestamp, indexed_at
-                    FROM indexed_links
-                '''
+                from_sql += ' JOIN link_tags lt ON l.id = lt.link_id'
             
-            conditions = []
+            # Rows of deleted messages and links are kept as tombstones
+            conditions = ['l.deleted_at IS NULL']
             params = []
             
-            if search:
-                if tag_ids:
-                    conditions.append('(l.link_url LIKE ? OR l.message_content LIKE ? OR l.author_name LIKE ?)')
-                else:
-                    conditions.append('(link_url LIKE ? OR message_content LIKE ? OR author_name LIKE ?)')
+            if match:
+                conditions.append('links_fts MATCH ?')
+                params.append(match)
+            elif search:
+                conditions.append(f'(l.link_url LIKE ? OR {names["content"]} LIKE ? OR {names["author"]} LIKE ?)')
                 search_param = f'%{search}%'
                 params.extend([search_param, search_param, search_param])
             
-            if domain:
-                if tag_ids:
-                    conditions.append('l.link_domain LIKE ?')
-                else:
-                    conditions.append('link_domain LIKE ?')
+            # Until registrable domains are backfilled, match the host text
+            if domain and self.backfill_ready(conn, COLUMN_BACKFILLS['indexed_links']):
+                condition, condition_params = domain_condition(domain)
+                conditions.append(condition)
+                params.extend(condition_params)
+            elif domain:
+                conditions.append('l.link_domain LIKE ?')
                 params.append(f'%{domain}%')
             
             if tag_ids:
@@ -212,117 +364,102 @@ class DatabaseManager:
                     conditions.append('lt.tag_id = ?')
                     params.append(tag_ids)
             
-            if conditions:
-                query += ' WHERE ' + ' AND '.join(conditions)
+            # Newest first, or best match first when searching the index
+            order = 'rank' if match else 'time'
+            sort_columns = ('links_fts.rank', 'l.id') if match else ('l.timestamp', 'l.id')
+            position = decode_cursor(page_cursor, order)
+            keyset, keyset_params, order_by = keyset_condition(sort_columns, position, descending=not match)
             
-            if tag_ids:
-                query += ' ORDER BY l.timestamp DESC'
-            else:
-                query += ' ORDER BY timestamp DESC'
+            where_sql = ' WHERE ' + ' AND '.join(conditions)
             
-            # Get total count
-            count_query = query.replace(
-                'SELECT id, message_id, channel_name, guild_name, author_name, link_url, link_domain, message_content, timestamp, indexed_at',
-                'SELECT COUNT(*)'
-            )
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
+            # Unfiltered totals come from the rollups. Filtered ones are
+            # counted from the same FROM and WHERE and cached; searches
+            # stop counting at the count limit. The dimension joins never
+            # drop or repeat rows, so counts only join them for LIKE search.
+            count_sql = from_sql + (dimension_joins if search and not match else '') + where_sql
+            from_sql += dimension_joins + where_sql
+            if search or domain or tag_ids:
+                total = self.counts.count(
+                    conn, filter_key('links:fts' if match else 'links', match or search, domain, tag_ids), count_sql, list(params),
+                    distinct_column='l.id' if tag_ids else None, capped=bool(search)
+                )
+            else:
+                total = Total(self.rollup.total(conn, 'links'), False)
             
-            # Add pagination
-            offset = (page - 1) * per_page
-            query += ' LIMIT ? OFFSET ?'
-            params.extend([per_page, offset])
+            # Add pagination, reading one extra row to see if more follow
+            if keyset:
+                from_sql += f' AND {keyset}'
+                params.extend(keyset_params)
+            params.append(per_page + 1)
             
-            cursor.execute(query, params)
-            links = cursor.fetchall()
+            select_params = [SNIPPET_START, SNIPPET_END] if match else []
+            cursor.execute(select_sql + from_sql + order_by + ' LIMIT ?', select_params + params)
+            links, next_cursor, prev_cursor = paginate(
+                cursor.fetchall(), position, order,
+                lambda row: (row[11], row[0]) if match else (row[8], row[0]), per_page
+            )
             
-            # Add tags for each link
-            links_with_tags = []
-            for link in links:
-                link_tags = self.get_link_tags(link[0])  # link[0] is the link ID
-                links_with_tags.append(list(link) + [link_tags])
+            # Add tags for each link, followed by the search snippet
+            tags = self.load_tags(conn, 'link_tags', 'link_id', [link[0] for link in links])
+            links_with_tags = [list(link[:10]) + [tags[link[0]], link[10] if match else None] for link in links]
             
-            return links_with_tags, total
-        except Exception as e:
-            print(f"Error getting links: {e}")
-            return [], 0
+            return links_with_tags, total, next_cursor, prev_cursor
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def get_stats(self):
         """Get dashboard statistics"""
+        key = ('stats',)
+        try:
+            return self.results.cached(key, self._query_stats)
+        except Exception as e:
+            print(f"Error getting stats: {e}")
+            return {}
+    
+    def _query_stats(self):
         conn = self.get_connection()
-        cursor = conn.cursor()
         
         try:
             stats = {}
             
-            # Total counts
-            cursor.execute('SELECT COUNT(*) FROM indexed_files')
-            stats['total_files'] = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM indexed_links')
-            stats['total_links'] = cursor.fetchone()[0]
+            # Counts come from the trigger-maintained rollups
+            stats['total_files'] = self.rollup.total(conn, 'files')
+            stats['total_links'] = self.rollup.total(conn, 'links')
             
             # Recent activity (last 24 hours)
-            cursor.execute('''
-                SELECT COUNT(*) FROM indexed_files 
-                WHERE indexed_at > datetime('now', '-1 day')
-            ''')
-            stats['files_24h'] = cursor.fetchone()[0]
+            stats['files_24h'] = self.rollup.since(conn, 'files', 24)
+            stats['links_24h'] = self.rollup.since(conn, 'links', 24)
             
-            cursor.execute('''
-                SELECT COUNT(*) FROM indexed_links 
-                WHERE indexed_at > datetime('now', '-1 day')
-            ''')
-            stats['links_24h'] = cursor.fetchone()[0]
-            
-            # Top file types
-            cursor.execute('''
-                SELECT file_type, COUNT(*) as count 
-                FROM indexed_files 
-                WHERE file_type IS NOT NULL 
-                GROUP BY file_type 
-                ORDER BY count DESC 
-                LIMIT 10
-            ''')
-            stats['top_file_types'] = cursor.fetchall()
-            
-            # Top domains
-            cursor.execute('''
-                SELECT link_domain, COUNT(*) as count 
-                FROM indexed_links 
-                WHERE link_domain IS NOT NULL 
-                GROUP BY link_domain 
-                ORDER BY count DESC 
-                LIMIT 10
-            ''')
-            stats['top_domains'] = cursor.fetchall()
+            # Top file types and domains
+            stats['top_file_types'] = self.rollup.top(conn, 'files', 'type')
+            stats['top_domains'] = self.rollup.top(conn, 'links', 'domain')
             
             return stats
-        except Exception as e:
-            print(f"Error getting stats: {e}")
-            return {}
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def get_all_tags(self):
         """Get all available tags"""
+        key = ('tags',)
+        try:
+            return self.results.cached(key, self._query_all_tags)
+        except Exception as e:
+            print(f"Error getting tags: {e}")
+            return []
+    
+    def _query_all_tags(self):
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             cursor.execute('SELECT id, name, color, description, created_at FROM tags ORDER BY name')
             return cursor.fetchall()
-        except Exception as e:
-            print(f"Error getting tags: {e}")
-            return []
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def create_tag(self, name, color='#007bff', description='', created_by=None):
         """Create a new tag"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -336,11 +473,11 @@ class DatabaseManager:
             print(f"Error creating tag: {e}")
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def update_tag(self, tag_id, name=None, color=None, description=None):
         """Update a tag's properties"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -362,7 +499,7 @@ class DatabaseManager:
                 return True  # Nothing to update
             
             params.append(tag_id)
-            query = f'UPDATE tags SET {', '.join(updates)} WHERE id = ?'
+            query = f"UPDATE tags SET {', '.join(updates)} WHERE id = ?"
             
             cursor.execute(query, params)
             conn.commit()
@@ -371,11 +508,11 @@ class DatabaseManager:
             print(f"Error updating tag: {e}")
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def delete_tag(self, tag_id):
         """Delete a tag and all its associations"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -386,11 +523,11 @@ class DatabaseManager:
             print(f"Error deleting tag: {e}")
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def add_file_tag(self, file_id, tag_id, added_by=None):
         """Add a tag to a file"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -404,11 +541,11 @@ class DatabaseManager:
             print(f"Error adding file tag: {e}")
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def remove_file_tag(self, file_id, tag_id):
         """Remove a tag from a file"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -419,7 +556,34 @@ class DatabaseManager:
             print(f"Error removing file tag: {e}")
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
+    
+    def load_tags(self, conn, table, column, ids):
+        """Get the tags of many files or links in one query
+
+        table and column name the tag join table and its file or link id
+        column. Returns a dict mapping each id to its list of tags.
+        """
+        tags = {item_id: [] for item_id in ids}
+        if not tags:
+            return tags
+        
+        try:
+            placeholders = ','.join('?' for _ in tags)
+            rows = conn.execute(f'''
+                SELECT x.{column}, t.id, t.name, t.color, t.description
+                FROM tags t
+                JOIN {table} x ON t.id = x.tag_id
+                WHERE x.{column} IN ({placeholders})
+                ORDER BY t.name
+            ''', list(tags)).fetchall()
+        except Exception as e:
+            print(f"Error loading tags from {table}: {e}")
+            return tags
+        
+        for item_id, *tag in rows:
+            tags[item_id].append(tuple(tag))
+        return tags
     
     def get_file_tags(self, file_id):
         """Get all tags for a specific file"""
@@ -439,11 +603,11 @@ class DatabaseManager:
             print(f"Error getting file tags: {e}")
             return []
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def add_link_tag(self, link_id, tag_id, added_by=None):
         """Add a tag to a link"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -457,11 +621,11 @@ class DatabaseManager:
             print(f"Error adding link tag: {e}")
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def remove_link_tag(self, link_id, tag_id):
         """Remove a tag from a link"""
-        conn = self.get_connection()
+        conn = self.get_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -472,7 +636,7 @@ class DatabaseManager:
             print(f"Error removing link tag: {e}")
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def get_link_tags(self, link_id):
         """Get all tags for a specific link"""
@@ -492,10 +656,12 @@ class DatabaseManager:
             print(f"Error getting link tags: {e}")
             return []
         finally:
-            conn.close()
+            self.release_connection(conn)
 
 # Initialize managers
 db = DatabaseManager(config['database']['path'])
+renderer = preview_service_from_config(config, 'web')
+previews = renderer.cache
 user_manager = UserManager(config['database']['path'])
 
 @login_manager.user_loader
@@ -518,6 +684,41 @@ def format_file_size(size_bytes):
 
 app.jinja_env.filters['filesize'] = format_file_size
 
+def format_timestamp(value):
+    """Format a message time stored as epoch milliseconds or as text"""
+    if isinstance(value, int):
+        return str(datetime.fromtimestamp(value / 1000, tz=timezone.utc))
+    return value
+
+app.jinja_env.filters['timestamp'] = format_timestamp
+app.jinja_env.filters['highlight'] = highlight_snippet
+
+# Requests running more statements than this are logged as a warning
+QUERY_WARNING_THRESHOLD = config.get('web', {}).get('query_warning_threshold', 20)
+
+@app.after_request
+def report_query_count(response):
+    """Expose the database work done for each request"""
+    queries = g.get('db_queries', 0)
+    connections = g.get('db_connections', 0)
+    response.headers['X-DB-Queries'] = str(queries)
+    response.headers['X-DB-Connections'] = str(connections)
+    if queries > QUERY_WARNING_THRESHOLD:
+        app.logger.warning(f"{request.method} {request.path} ran {queries} queries on {connections} connections")
+    return response
+
+# Browsers may reuse a preview this long before revalidating its ETag
+PREVIEW_MAX_AGE = config.get('previews', {}).get('max_age', 86400)
+
+def send_preview(entry):
+    """Send a cached preview with its strong ETag, answering If-None-Match with a 304"""
+    response = send_file(entry.path, mimetype=entry.mimetype, etag=entry.etag, conditional=True,
+                         max_age=PREVIEW_MAX_AGE)
+    # Previews are only for logged in users
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 @app.route('/')
 @login_required
 def dashboard():
@@ -697,10 +898,9 @@ def admin_dashboard():
     admin_users = cursor.fetchone()[0]
     
     # Get file count
-    cursor.execute('SELECT COUNT(*) FROM indexed_files')
-    total_files = cursor.fetchone()[0]
+    total_files = db.rollup.total(conn, 'files')
     
-    conn.close()
+    db.release_connection(conn)
     
     stats = {
         'total_users': total_users,
@@ -963,7 +1163,7 @@ def toggle_user_admin(user_id):
 @login_required
 def files():
     """Files listing page"""
-    page = request.args.get('page', 1, type=int)
+    page_cursor = request.args.get('cursor')
     search = request.args.get('search', '')
     file_type = request.args.get('type', '')
     tag_ids = request.args.getlist('tags')
@@ -977,18 +1177,17 @@ def files():
     else:
         tag_ids = None
     
-    files_data, total = db.get_files(page=page, per_page=per_page, search=search, file_type=file_type, tag_ids=tag_ids)
+    files_data, total, next_cursor, prev_cursor = db.get_files(
+        per_page=per_page, search=search, file_type=file_type, tag_ids=tag_ids, page_cursor=page_cursor
+    )
     
     # Get all tags for the filter dropdown
     all_tags = db.get_all_tags()
     
-    # Calculate pagination
-    total_pages = (total + per_page - 1) // per_page
-    
     return render_template('files.html', 
                          files=files_data, 
-                         page=page, 
-                         total_pages=total_pages, 
+                         next_cursor=next_cursor, 
+                         prev_cursor=prev_cursor, 
                          total=total,
                          search=search,
                          file_type=file_type,
@@ -999,7 +1198,7 @@ def files():
 @login_required
 def links():
     """Links listing page"""
-    page = request.args.get('page', 1, type=int)
+    page_cursor = request.args.get('cursor')
     search = request.args.get('search', '')
     domain = request.args.get('domain', '')
     tag_ids = request.args.getlist('tags')
@@ -1013,18 +1212,17 @@ def links():
     else:
         tag_ids = None
     
-    links_data, total = db.get_links(page=page, per_page=per_page, search=search, domain=domain, tag_ids=tag_ids)
+    links_data, total, next_cursor, prev_cursor = db.get_links(
+        per_page=per_page, search=search, domain=domain, tag_ids=tag_ids, page_cursor=page_cursor
+    )
     
     # Get all tags for the filter dropdown
     all_tags = db.get_all_tags()
     
-    # Calculate pagination
-    total_pages = (total + per_page - 1) // per_page
-    
     return render_template('links.html', 
                          links=links_data, 
-                         page=page, 
-                         total_pages=total_pages, 
+                         next_cursor=next_cursor, 
+                         prev_cursor=prev_cursor, 
                          total=total,
                          search=search,
                          domain=domain,
@@ -1056,6 +1254,101 @@ def api_stats():
     stats = db.get_stats()
     return jsonify(stats)
 
+@app.route('/api/admin/db_stats')
+@login_required
+def api_db_stats():
+    """API endpoint for connection pool and cache statistics (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    conn = db.get_connection()
+    try:
+        # Jobs waiting for preview_worker.py, by status
+        prerender = dict(conn.execute('SELECT status, COUNT(*) FROM preview_jobs GROUP BY status').fetchall())
+    finally:
+        db.release_connection(conn)
+    
+    return jsonify({
+        'pool': db.pool.get_stats(),
+        'results': db.results.get_stats(),
+        'counts': db.counts.cache.get_stats(),
+        'previews': previews.get_stats(),
+        'office': renderer.office.get_stats(),
+        'rasterizer': renderer.rasterizer.get_stats(),
+        'prerender': prerender
+    })
+
+def snowflake(value):
+    """A Discord ID for JSON, as a string since JavaScript numbers lose precision past 2**53"""
+    return str(value) if value is not None else None
+
+def tag_dicts(tags_raw):
+    return [{'id': tag[0], 'name': tag[1], 'color': tag[2], 'description': tag[3]} for tag in tags_raw]
+
+def listing_args():
+    """Page size and tag filter shared by the listing APIs"""
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    tag_ids = [int(tag_id) for tag_id in request.args.getlist('tags') if tag_id.isdigit()]
+    return per_page, tag_ids or None
+
+@app.route('/api/files')
+@login_required
+def api_files():
+    """API endpoint for a page of files, addressed by the same cursors as /files"""
+    per_page, tag_ids = listing_args()
+    files_data, total, next_cursor, prev_cursor = db.get_files(
+        per_page=per_page, search=request.args.get('search', ''), file_type=request.args.get('type', ''),
+        tag_ids=tag_ids, page_cursor=request.args.get('cursor')
+    )
+    
+    files = [{
+        'id': file[0],
+        'message_id': snowflake(file[1]),
+        'channel_name': file[2],
+        'guild_name': file[3],
+        'author_name': file[4],
+        'filename': file[5],
+        'file_url': file[6],
+        'file_size': file[7],
+        'file_type': file[8],
+        'message_content': file[9],
+        'timestamp': file[10],
+        'indexed_at': file[11],
+        'tags': tag_dicts(file[12]),
+        'snippet': file[13]
+    } for file in files_data]
+    
+    return jsonify({'files': files, 'total': total.count, 'total_at_least': total.at_least,
+                    'next_cursor': next_cursor, 'prev_cursor': prev_cursor})
+
+@app.route('/api/links')
+@login_required
+def api_links():
+    """API endpoint for a page of links, addressed by the same cursors as /links"""
+    per_page, tag_ids = listing_args()
+    links_data, total, next_cursor, prev_cursor = db.get_links(
+        per_page=per_page, search=request.args.get('search', ''), domain=request.args.get('domain', ''),
+        tag_ids=tag_ids, page_cursor=request.args.get('cursor')
+    )
+    
+    links = [{
+        'id': link[0],
+        'message_id': snowflake(link[1]),
+        'channel_name': link[2],
+        'guild_name': link[3],
+        'author_name': link[4],
+        'link_url': link[5],
+        'link_domain': link[6],
+        'message_content': link[7],
+        'timestamp': link[8],
+        'indexed_at': link[9],
+        'tags': tag_dicts(link[10]),
+        'snippet': link[11]
+    } for link in links_data]
+    
+    return jsonify({'links': links, 'total': total.count, 'total_at_least': total.at_least,
+                    'next_cursor': next_cursor, 'prev_cursor': prev_cursor})
+
 @app.route('/api/file/<int:file_id>')
 def api_file_details(file_id):
     """API endpoint for file details"""
@@ -1063,12 +1356,14 @@ def api_file_details(file_id):
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-            SELECT id, message_id, channel_id, channel_name, guild_id, guild_name, 
-                   author_id, author_name, filename, file_url, file_size, file_type, 
-                   message_content, timestamp, indexed_at
-            FROM indexed_files 
-            WHERE id = ?
+        names = db.dimension_columns(conn, 'indexed_files', 'f')
+        cursor.execute(f'''
+            SELECT f.id, f.message_id, f.channel_id, {names["channel"]}, f.guild_id, {names["guild"]},
+                   f.author_id, {names["author"]}, f.filename, f.file_url, f.file_size, f.file_type,
+                   {names["content"]}, f.timestamp, f.indexed_at
+            FROM indexed_files f
+            {FACT_DIMENSION_JOINS.format(fact='f')}
+            WHERE f.id = ? AND f.deleted_at IS NULL
         ''', (file_id,))
         
         file_data = cursor.fetchone()
@@ -1078,12 +1373,12 @@ def api_file_details(file_id):
         # Convert to dictionary
         file_details = {
             'id': file_data[0],
-            'message_id': file_data[1],
-            'channel_id': file_data[2],
+            'message_id': snowflake(file_data[1]),
+            'channel_id': snowflake(file_data[2]),
             'channel_name': file_data[3],
-            'guild_id': file_data[4],
+            'guild_id': snowflake(file_data[4]),
             'guild_name': file_data[5],
-            'author_id': file_data[6],
+            'author_id': snowflake(file_data[6]),
             'author_name': file_data[7],
             'filename': file_data[8],
             'file_url': file_data[9],
@@ -1098,7 +1393,7 @@ def api_file_details(file_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 @app.route('/api/link/<int:link_id>')
 def api_link_details(link_id):
@@ -1107,12 +1402,14 @@ def api_link_details(link_id):
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-            SELECT id, message_id, channel_id, channel_name, guild_id, guild_name,
-                   author_id, author_name, link_url, link_domain, message_content, 
-                   timestamp, indexed_at
-            FROM indexed_links 
-            WHERE id = ?
+        names = db.dimension_columns(conn, 'indexed_links', 'l')
+        cursor.execute(f'''
+            SELECT l.id, l.message_id, l.channel_id, {names["channel"]}, l.guild_id, {names["guild"]},
+                   l.author_id, {names["author"]}, l.link_url, l.link_domain, {names["content"]}, 
+                   l.timestamp, l.indexed_at
+            FROM indexed_links l
+            {FACT_DIMENSION_JOINS.format(fact='l')}
+            WHERE l.id = ? AND l.deleted_at IS NULL
         ''', (link_id,))
         
         link_data = cursor.fetchone()
@@ -1122,12 +1419,12 @@ def api_link_details(link_id):
         # Convert to dictionary
         link_details = {
             'id': link_data[0],
-            'message_id': link_data[1],
-            'channel_id': link_data[2],
+            'message_id': snowflake(link_data[1]),
+            'channel_id': snowflake(link_data[2]),
             'channel_name': link_data[3],
-            'guild_id': link_data[4],
+            'guild_id': snowflake(link_data[4]),
             'guild_name': link_data[5],
-            'author_id': link_data[6],
+            'author_id': snowflake(link_data[6]),
             'author_name': link_data[7],
             'link_url': link_data[8],
             'link_domain': link_data[9],
@@ -1140,7 +1437,7 @@ def api_link_details(link_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 # Tag management routes (admin only)
 @app.route('/tags')
@@ -1313,38 +1610,18 @@ def document_viewer(file_id):
         cursor.execute('''
             SELECT filename, file_url, file_type, file_size
             FROM indexed_files
-            WHERE id = ?
+            WHERE id = ? AND deleted_at IS NULL
         ''', (file_id,))
         file_data = cursor.fetchone()
-        conn.close()
+        db.release_connection(conn)
         
         if not file_data:
-            flash('File not found', 'error')
-            return redirect(url_for('files'))
+            return "File not found", 404
             
         filename, file_url, file_type, file_size = file_data
         
         # Check if this is a document type that can be viewed
-        viewer_supported_types = [
-            'application/pdf',
-            'application/msword',
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            'application/vnd.ms-excel',
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            'application/vnd.ms-powerpoint',
-            'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-            'text/plain',
-            'application/rtf',
-            'image/png',
-            'image/jpeg',
-            'image/jpg',
-            'image/gif',
-            'image/bmp',
-            'image/webp',
-            'image/svg+xml'
-        ]
-        
-        if file_type not in viewer_supported_types:
+        if file_type not in VIEWER_TYPES:
             flash('Document viewer not supported for this file type', 'error')
             return redirect(url_for('files'))
         
@@ -1365,147 +1642,126 @@ def document_viewer(file_id):
         flash('Error loading document viewer', 'error')
         return redirect(url_for('files'))
 
+def get_file_source(file_id):
+    """The (filename, file_url, file_type) of a file, or None"""
+    conn = db.get_connection()
+    try:
+        return conn.execute('SELECT filename, file_url, file_type FROM indexed_files WHERE id = ? AND deleted_at IS NULL', (file_id,)).fetchone()
+    finally:
+        db.release_connection(conn)
+
+def document_manifest(file_id, filename, file_url, file_type):
+    """JSON listing a document's pages, with the size and URL of each page image"""
+    pages = []
+    if file_type == 'text/plain':
+        for i, text in enumerate(text_pages(download_bytes(file_url))):
+            pages.append({'page_number': i + 1, 'text_content': text, 'is_text': True})
+    else:
+        if file_type in IMAGE_TYPES:
+            with open(renderer.original(file_id, file_url, file_type).path, 'rb') as f:
+                sizes = [image_size(f.read())]
+        else:
+            pdf = renderer.document_pdf(file_id, filename, file_url, file_type)
+            sizes = pdf_page_sizes(pdf.path, renderer.max_pages)
+        for i, (width, height) in enumerate(sizes):
+            pages.append({
+                'page_number': i + 1,
+                'width': width,
+                'height': height,
+                'image_url': url_for('api_document_page', file_id=file_id, page_number=i + 1),
+                'is_text': False
+            })
+    
+    return json.dumps({
+        'pages': pages,
+        'total_pages': len(pages),
+        'filename': filename,
+        'file_type': file_type
+    }).encode()
+
 @app.route('/api/document_pages/<int:file_id>')
 @login_required
 def api_document_pages(file_id):
-    """Get document pages as images for viewer"""
+    """Get the page manifest of a document for the viewer
+    
+    Page images are fetched one at a time from api_document_page as the
+    viewer scrolls to them. Text pages are included inline.
+    """
     try:
-        # Get file information from database
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT filename, file_url, file_type FROM indexed_files WHERE id = ?', (file_id,))
-        file_data = cursor.fetchone()
-        conn.close()
-        
+        file_data = get_file_source(file_id)
         if not file_data:
             return jsonify({'error': 'File not found'}), 404
-            
+        
         filename, file_url, file_type = file_data
+        if file_type not in VIEWER_TYPES:
+            return jsonify({'error': 'Document viewer not supported for this file type'}), 400
         
-        # Download the file temporarily
-        response = requests.get(file_url)
-        if response.status_code != 200:
-            return jsonify({'error': 'Could not download file'}), 400
-            
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-            temp_file.write(response.content)
-            temp_file_path = temp_file.name
-            
-        try:
-            pages = []
-            
-            if file_type.startswith('image/'):
-                # Handle image files directly
-                try:
-                    import base64
-                    with open(temp_file_path, 'rb') as img_file:
-                        img_data = img_file.read()
-                    img_base64 = base64.b64encode(img_data).decode('utf-8')
-                    
-                    # Determine the correct MIME type for the data URL
-                    mime_type = file_type
-                    pages.append({
-                        'page_number': 1,
-                        'image_data': f'data:{mime_type};base64,{img_base64}',
-                        'is_text': False
-                    })
-                except Exception as e:
-                    return jsonify({'error': f'Error processing image: {str(e)}'}), 500
-                    
-            elif file_type == 'application/pdf':
-                # Handle PDF files with pdf2image
-                try:
-                    images = convert_from_path(temp_file_path, dpi=150)
-                    for i, image in enumerate(images[:20]):  # Limit to first 20 pages
-                        img_io = io.BytesIO()
-                        image.save(img_io, 'JPEG', quality=85)
-                        img_io.seek(0)
-                        
-                        # Convert to base64 for JSON response
-                        import base64
-                        img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
-                        pages.append({
-                            'page_number': i + 1,
-                            'image_data': f'data:image/jpeg;base64,{img_base64}'
-                        })
-                except Exception as e:
-                    return jsonify({'error': f'Error converting PDF: {str(e)}'}), 500
-                    
-            elif file_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-                # Handle Word documents by converting to PDF first, then to images
-                try:
-                    # Use LibreOffice to convert to PDF
-                    pdf_path = temp_file_path + '.pdf'
-                    result = subprocess.run([
-                        'libreoffice', '--headless', '--convert-to', 'pdf',
-                        '--outdir', os.path.dirname(temp_file_path), temp_file_path
-                    ], capture_output=True, text=True, timeout=30)
-                    
-                    if result.returncode == 0 and os.path.exists(pdf_path):
-                        images = convert_from_path(pdf_path, dpi=150)
-                        for i, image in enumerate(images[:20]):
-                            img_io = io.BytesIO()
-                            image.save(img_io, 'JPEG', quality=85)
-                            img_io.seek(0)
-                            
-                            import base64
-                            img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
-                            pages.append({
-                                'page_number': i + 1,
-                                'image_data': f'data:image/jpeg;base64,{img_base64}'
-                            })
-                        os.unlink(pdf_path)
-                except Exception as e:
-                    return jsonify({'error': f'Error converting document: {str(e)}'}), 500
-                    
-            elif file_type == 'text/plain':
-                # Handle text files by creating paginated text view
-                try:
-                    with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                    
-                    # Split content into pages (approximately 3000 characters per page)
-                    page_size = 3000
-                    for i in range(0, len(content), page_size):
-                        page_content = content[i:i + page_size]
-                        pages.append({
-                            'page_number': (i // page_size) + 1,
-                            'text_content': page_content,
-                            'is_text': True
-                        })
-                        if len(pages) >= 20:  # Limit to 20 pages
-                            break
-                except Exception as e:
-                    return jsonify({'error': f'Error reading text file: {str(e)}'}), 500
-            
-            return jsonify({
-                'pages': pages,
-                'total_pages': len(pages),
-                'filename': filename,
-                'file_type': file_type
-            })
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                
+        entry = previews.get_or_render(
+            preview_key(file_id, file_url, 'manifest'),
+            lambda: (document_manifest(file_id, filename, file_url, file_type), 'application/json'),
+            file_id=file_id, variant='manifest'
+        )
+        return send_preview(entry)
+    
+    except PreviewError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         app.logger.error(f"Error in api_document_pages for file {file_id}: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/document_pages/<int:file_id>/<int:page_number>')
+@login_required
+def api_document_page(file_id, page_number):
+    """Get one page of a document as an image, WebP if the browser accepts it
+    
+    The size argument picks the resolution: thumbnail, viewer (the default)
+    or zoom. Images are always sent as uploaded.
+    """
+    try:
+        tier = request.args.get('size', 'viewer')
+        if tier not in DPI_TIERS:
+            return "Unknown page size", 400
+        
+        file_data = get_file_source(file_id)
+        if not file_data:
+            return "File not found", 404
+        
+        filename, file_url, file_type = file_data
+        if file_type in IMAGE_TYPES and page_number == 1:
+            entry = renderer.original(file_id, file_url, file_type)
+        elif file_type in VIEWER_TYPES and file_type not in IMAGE_TYPES and file_type != 'text/plain' \
+                and 1 <= page_number <= renderer.max_pages:
+            image_format = 'WEBP' if WEBP_SUPPORTED and 'image/webp' in request.headers.get('Accept', '') else 'JPEG'
+            entry = renderer.page(file_id, filename, file_url, file_type, page_number, tier, image_format)
+        else:
+            return "Page not found", 404
+        
+        response = send_preview(entry)
+        response.vary.add('Accept')
+        if file_type in IMAGE_TYPES:
+            # Uploads are served from this origin as they are, and an SVG
+            # opened on its own would run its scripts here
+            response.headers['Content-Security-Policy'] = "sandbox; default-src 'none'"
+            response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+    
+    except PreviewError as e:
+        return e.message, e.status
+    except Exception as e:
+        app.logger.error(f"Error in api_document_page for file {file_id} page {page_number}: {str(e)}")
+        return "Internal server error", 500
+
 @app.route('/preview/<int:file_id>')
 @login_required
 def preview_file(file_id):
-    """Generate and serve a preview image for documents"""
+    """Serve a preview image for documents, rendered once and then cached"""
     try:
         # Get file information from database
         conn = db.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT filename, file_url, file_type FROM indexed_files WHERE id = ?', (file_id,))
+        cursor.execute('SELECT filename, file_url, file_type FROM indexed_files WHERE id = ? AND deleted_at IS NULL', (file_id,))
         file_data = cursor.fetchone()
-        conn.close()
+        db.release_connection(conn)
         
         if not file_data:
             return "File not found", 404
@@ -1513,125 +1769,13 @@ def preview_file(file_id):
         filename, file_url, file_type = file_data
         
         # Check if this is a document type that can be previewed
-        preview_supported_types = [
-            'application/pdf',
-            'application/msword',
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            'application/vnd.ms-excel',
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            'application/vnd.ms-powerpoint',
-            'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-            'text/plain',
-            'application/rtf'
-        ]
-        
-        if file_type not in preview_supported_types:
+        if file_type not in PREVIEW_TYPES:
             return "Preview not supported for this file type", 400
-            
-        # Download the file temporarily
-        response = requests.get(file_url)
-        if response.status_code != 200:
-            return "Could not download file", 400
-            
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-            temp_file.write(response.content)
-            temp_file_path = temp_file.name
-            
-        try:
-            preview_image = None
-            
-            if file_type == 'application/pdf':
-                # Handle PDF files with pdf2image
-                try:
-                    images = convert_from_path(temp_file_path, first_page=1, last_page=1, dpi=150)
-                    if images:
-                        preview_image = images[0]
-                except Exception as e:
-                    logging.error(f"Error converting PDF to image: {str(e)}")
-                    return "Error generating PDF preview", 500
-                    
-            elif file_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                             'application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                             'application/vnd.ms-powerpoint', 'application/vnd.openxmlformats-officedocument.presentationml.presentation']:
-                # Handle Office documents by converting to PDF first, then to image
-                try:
-                    # Convert to PDF using LibreOffice
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        result = subprocess.run([
-                            'libreoffice', '--headless', '--convert-to', 'pdf',
-                            '--outdir', temp_dir, temp_file_path
-                        ], capture_output=True, text=True, timeout=30)
-                        
-                        if result.returncode == 0:
-                            # Find the generated PDF
-                            pdf_name = os.path.splitext(os.path.basename(temp_file_path))[0] + '.pdf'
-                            pdf_path = os.path.join(temp_dir, pdf_name)
-                            
-                            if os.path.exists(pdf_path):
-                                # Convert PDF to image
-                                images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=150)
-                                if images:
-                                    preview_image = images[0]
-                        else:
-                            logging.error(f"LibreOffice conversion failed: {result.stderr}")
-                            return "Error converting document to preview", 500
-                except subprocess.TimeoutExpired:
-                    return "Document conversion timeout", 500
-                except Exception as e:
-                    logging.error(f"Error converting document: {str(e)}")
-                    return "Error generating document preview", 500
-                    
-            elif file_type == 'text/plain':
-                # Handle text files by creating a simple image
-                try:
-                    with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(2000)  # Read first 2000 characters
-                    
-                    # Create a simple text preview image
-                    from PIL import Image, ImageDraw, ImageFont
-                    
-                    img_width, img_height = 800, 600
-                    preview_image = Image.new('RGB', (img_width, img_height), color='white')
-                    draw = ImageDraw.Draw(preview_image)
-                    
-                    try:
-                        font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 12)
-                    except:
-                        font = ImageFont.load_default()
-                    
-                    # Split content into lines and draw
-                    lines = content.split('\n')[:40]  # First 40 lines
-                    y_offset = 10
-                    for line in lines:
-                        if y_offset > img_height - 20:
-                            break
-                        draw.text((10, y_offset), line[:100], fill='black', font=font)  # First 100 chars per line
-                        y_offset += 15
-                        
-                except Exception as e:
-                    logging.error(f"Error creating text preview: {str(e)}")
-                    return "Error generating text preview", 500
-            
-            if preview_image:
-                # Convert PIL image to JPEG and return
-                img_io = io.BytesIO()
-                preview_image.save(img_io, 'JPEG', quality=85)
-                img_io.seek(0)
-                
-                return send_file(
-                    img_io,
-                    mimetype='image/jpeg',
-                    as_attachment=False
-                )
-            else:
-                return "Could not generate preview", 500
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                
+        
+        return send_preview(renderer.preview(file_id, filename, file_url, file_type))
+        
+    except PreviewError as e:
+        return e.message, e.status
     except Exception as e:
         logging.error(f"Error in preview_file for file {file_id}: {str(e)}")
         return "Internal server error", 500
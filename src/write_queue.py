@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('DiscordIndexer.WriteQueue')
+
+
+class WriteFailed(Exception):
+    """Rows handed to the write queue were not committed"""
+
+
+async def require_committed(acks, message):
+    """Wait for acknowledgements, raising WriteFailed unless all committed
+
+    Each ack resolves to a bool or, when gathered per message, to a list
+    of them.
+    """
+    for committed in await asyncio.gather(*acks):
+        if not (all(committed) if isinstance(committed, list) else committed):
+            raise WriteFailed(message)
+
+
+class WriteQueue:
+    """Group-commit writer for indexed files and links.
+
+    Producers hand rows to the queue and get an awaitable acknowledgement
+    back. Pending rows are written with executemany in a single transaction
+    as soon as batch_size rows are waiting or max_delay seconds have passed
+    since the oldest pending row, whichever comes first.
+
+    An acknowledgement resolves to True once its rows are committed and to
+    False if their batch failed, so anything recording progress past those
+    rows, such as a checkpoint, must check it.
+    """
+
+    def __init__(self, db, batch_size=500, max_delay=0.5):
+        # db is an AsyncDatabase, so batches are written off the event loop
+        self.db = db
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+
+        self._files = []
+        self._links = []
+        self._waiters = []
+        self._first_pending_at = None
+        self._wakeup = None
+        self._task = None
+
+        # Batch statistics
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.rows_written = 0
+        self.last_batch_ms = 0.0
+        self.max_batch_ms = 0.0
+        self.total_batch_ms = 0.0
+
+    @property
+    def pending(self):
+        return len(self._files) + len(self._links)
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still pending and stop the flush task"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def submit_file(self, row):
+        """Queue an indexed_files row, returning a future for its commit"""
+        return self._submit(self._files, row)
+
+    def submit_link(self, row):
+        """Queue an indexed_links row, returning a future for its commit"""
+        return self._submit(self._links, row)
+
+    def _submit(self, rows, row):
+        future = asyncio.get_running_loop().create_future()
+        rows.append(row)
+        self._waiters.append(future)
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+        if self._wakeup:
+            self._wakeup.set()
+        return future
+
+    async def flush(self):
+        """Write all pending rows now"""
+        if not self.pending:
+            return True
+
+        files, links, waiters = self._files, self._links, self._waiters
+        self._files, self._links, self._waiters = [], [], []
+        self._first_pending_at = None
+
+        started = time.perf_counter()
+        try:
+            await self.db.insert_rows(files, links)
+            ok = True
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(files)} files and {len(links)} links: {e}")
+            ok = False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if ok:
+            self.batches_written += 1
+            self.rows_written += len(files) + len(links)
+            self.last_batch_ms = elapsed_ms
+            self.total_batch_ms += elapsed_ms
+            self.max_batch_ms = max(self.max_batch_ms, elapsed_ms)
+            logger.info(f"Committed batch: {len(files)} files, {len(links)} links in {elapsed_ms:.1f} ms")
+        else:
+            self.batches_failed += 1
+
+        for future in waiters:
+            if not future.done():
+                future.set_result(ok)
+        return ok
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # Wait until the batch is full or the oldest row hits its deadline
+            while self.pending and self.pending < self.batch_size:
+                remaining = self._first_pending_at + self.max_delay - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+
+            await self.flush()
+
+    def get_stats(self):
+        """Get batch statistics for reporting"""
+        return {
+            'pending': self.pending,
+            'batches_written': self.batches_written,
+            'batches_failed': self.batches_failed,
+            'rows_written': self.rows_written,
+            'last_batch_ms': round(self.last_batch_ms, 1),
+            'max_batch_ms': round(self.max_batch_ms, 1),
+            'avg_batch_ms': round(self.total_batch_ms / self.batches_written, 1) if self.batches_written else 0.0
+        }
@@ -0,0 +1,35 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The modules under test import each other by their flat names, as they do
+# when run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from schema import ensure_schema  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app_home(tmp_path_factory):
+    """A working directory with the config and database that bot.py and
+    web_app.py load when imported"""
+    home = tmp_path_factory.mktemp('indexer')
+    (home / 'config').mkdir()
+    (home / 'config' / 'config.json').write_text(json.dumps({
+        'discord': {'token': 'test', 'command_prefix': '!'},
+        'database': {'path': str(home / 'indexer.db')},
+        'logging': {'level': 'INFO', 'file': str(home / 'bot.log')},
+        'web': {'secret_key': 'test', 'host': '127.0.0.1', 'port': 5000, 'debug': False},
+        'auth': {'session_timeout': 3600}
+    }))
+    conn = sqlite3.connect(home / 'indexer.db')
+    ensure_schema(conn)
+    conn.close()
+
+    cwd = os.getcwd()
+    os.chdir(home)
+    yield home
+    os.chdir(cwd)
@@ -0,0 +1,64 @@
+"""Rate-limit headers of traced requests reaching the shared budget"""
+
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+from crawler import RateLimitBudget, api_route, rate_limit_trace
+
+
+def test_api_route():
+    url = URL('https://discord.com/api/v10/channels/12/messages?before=5&limit=100')
+    assert api_route('GET', url) == 'GET /channels/12/messages'
+    assert api_route('GET', URL('https://discord.com/api/guilds/3/threads/active')) == 'GET /guilds/3/threads/active'
+
+
+async def serve(handler, budget, *paths):
+    """Request each path from a local server through a traced session,
+    returning how long the budget then holds each route's next request"""
+    app = web.Application()
+    app.router.add_get('/api/v10/{tail:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with aiohttp.ClientSession(trace_configs=[rate_limit_trace(budget)]) as session:
+            for path in paths:
+                async with session.get(f'http://127.0.0.1:{port}/api/v10{path}') as response:
+                    await response.read()
+    finally:
+        await runner.cleanup()
+
+    waits = []
+    for path in paths:
+        started = time.monotonic()
+        await budget.acquire(f'GET {path}')
+        waits.append(time.monotonic() - started)
+    return waits
+
+
+def test_exhausted_route_waits_for_reset():
+    async def handler(request):
+        remaining = '0' if request.path.endswith('/1/messages') else '5'
+        return web.json_response([], headers={'X-RateLimit-Remaining': remaining, 'X-RateLimit-Reset-After': '0.3'})
+
+    budget = RateLimitBudget(rate=1000, burst=10)
+    exhausted, open_route = asyncio.run(serve(handler, budget, '/channels/1/messages', '/channels/2/messages'))
+    assert exhausted >= 0.2
+    assert open_route < 0.1
+
+
+def test_global_limit_pauses_every_route():
+    async def handler(request):
+        return web.json_response({'global': True}, status=429,
+                                 headers={'Retry-After': '0.3', 'X-RateLimit-Global': 'true'})
+
+    budget = RateLimitBudget(rate=1000, burst=10)
+    [waited] = asyncio.run(serve(handler, budget, '/channels/1/messages'))
+    assert waited >= 0.2
+    assert budget.get_stats()['rate_limited'] == 1
@@ -0,0 +1,269 @@
+"""Online migrations from the baseline schema, with writes between chunks"""
+
+import os
+import random
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from migrations import migrate_step, pending_migrations
+from normalize import mime_category, url_registrable_domain
+from rollups import StatsRollup
+from schema import ensure_schema, get_column_type, get_columns
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'current_schema.txt')
+
+LEGACY_ROWS = 400
+CHUNK_SIZE = 37
+
+FILE_TYPES = ['application/pdf', 'IMAGE/PNG', 'text/plain; charset=utf-8', None, 'video/mp4']
+LINK_URLS = ['https://www.youtube.com/watch?v={i}', 'https://news.bbc.co.uk/{i}', 'https://foo.github.io/{i}',
+             'https://cdn.example.com/{i}']
+
+
+def epoch_ms(text):
+    return int(datetime.strptime(text, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class Model:
+    """The rows a table should hold after migrating, by id"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def live_ids(self):
+        return [row_id for row_id, row in self.rows.items() if not row['deleted']]
+
+
+def baseline_connection(path):
+    conn = sqlite3.connect(path)
+    with open(BASELINE_SCHEMA) as f:
+        # sqlite_sequence is created by SQLite itself
+        conn.executescript(f.read().replace('CREATE TABLE sqlite_sequence(name,seq);', ''))
+    return conn
+
+
+def fill_baseline(conn, files, links):
+    """Rows as the baseline bot stored them, with names and text inline"""
+    conn.executemany("INSERT INTO tags (name) VALUES (?)", [('red',), ('blue',)])
+    for i in range(LEGACY_ROWS):
+        message_id = str(1100000000000000000 + (i << 22))
+        channel_id, author_id = 2000 + i % 7, 3000 + i % 11
+        timestamp = f'2024-01-{1 + i % 28:02d} 12:{i % 60:02d}:00'
+        common = (message_id, str(channel_id), f'channel{channel_id}', '1000', 'Guild', str(author_id),
+                  f'author{author_id}')
+        content = f'message body msgtoken{i}'
+
+        file_type = FILE_TYPES[i % len(FILE_TYPES)]
+        cursor = conn.execute('''
+            INSERT INTO indexed_files (message_id, channel_id, channel_name, guild_id, guild_name, author_id,
+                                       author_name, filename, file_url, file_size, file_type, message_content,
+                                       timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', common + (f'file{i}.pdf', f'https://cdn.discordapp.com/attachments/1/{i}/file{i}.pdf', i, file_type,
+                       content, timestamp))
+        files.rows[cursor.lastrowid] = {
+            'filename': f'file{i}.pdf', 'file_url': f'https://cdn.discordapp.com/attachments/1/{i}/file{i}.pdf',
+            'file_type': file_type, 'channel': f'channel{channel_id}', 'author': f'author{author_id}',
+            'content': content, 'timestamp': epoch_ms(timestamp), 'deleted': False, 'tags': set()
+        }
+
+        link_url = LINK_URLS[i % len(LINK_URLS)].format(i=i)
+        cursor = conn.execute('''
+            INSERT INTO indexed_links (message_id, channel_id, channel_name, guild_id, guild_name, author_id,
+                                       author_name, link_url, link_domain, message_content, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', common + (link_url, link_url.split('/')[2], content, timestamp))
+        links.rows[cursor.lastrowid] = {
+            'link_url': link_url, 'channel': f'channel{channel_id}', 'author': f'author{author_id}',
+            'content': content, 'timestamp': epoch_ms(timestamp), 'deleted': False, 'tags': set()
+        }
+
+    for row_id in list(files.rows)[::9]:
+        conn.execute('INSERT INTO file_tags (file_id, tag_id) VALUES (?, 1)', (row_id,))
+        files.rows[row_id]['tags'].add(1)
+    for row_id in list(links.rows)[::13]:
+        conn.execute('INSERT INTO link_tags (link_id, tag_id) VALUES (?, 2)', (row_id,))
+        links.rows[row_id]['tags'].add(2)
+    conn.commit()
+
+
+def live_write(conn, step, files, links, rng):
+    """What the running bot and web app do between two migration chunks"""
+    now = datetime(2025, 3, 1, tzinfo=timezone.utc).timestamp() * 1000 + step * 1000
+    integer_times = get_column_type(conn, 'indexed_files', 'timestamp') == 'INTEGER'
+    message_id, channel_id, author_id = 1300000000000000000 + (step << 22), 5000 + step, 6000 + step
+    content = f'live body livetoken{step}'
+
+    with conn:
+        # New messages upsert their names and text, then insert the fact rows
+        conn.execute('INSERT OR REPLACE INTO guilds (guild_id, name) VALUES (1000, ?)', ('Guild',))
+        conn.execute('INSERT OR REPLACE INTO channels (channel_id, guild_id, name) VALUES (?, 1000, ?)',
+                     (channel_id, f'live{channel_id}'))
+        conn.execute('INSERT OR REPLACE INTO authors (author_id, name) VALUES (?, ?)', (author_id, f'liver{author_id}'))
+        conn.execute('INSERT OR REPLACE INTO messages (message_id, channel_id, author_id, content) VALUES (?, ?, ?, ?)',
+                     (message_id, channel_id, author_id, content))
+        timestamp = int(now) if integer_times else datetime.fromtimestamp(now / 1000, timezone.utc).strftime(
+            '%Y-%m-%d %H:%M:%S')
+        major, minor = mime_category('image/gif', 'live.gif')
+        cursor = conn.execute('''
+            INSERT INTO indexed_files (message_id, channel_id, guild_id, author_id, filename, file_url, file_size,
+                                       file_type, mime_major, mime_minor, timestamp)
+            VALUES (?, ?, 1000, ?, ?, ?, 1, 'image/gif', ?, ?, ?)
+        ''', (message_id, channel_id, author_id, f'live{step}.gif', f'https://cdn/live{step}.gif', major, minor,
+              timestamp))
+        files.rows[cursor.lastrowid] = {
+            'filename': f'live{step}.gif', 'file_url': f'https://cdn/live{step}.gif', 'file_type': 'image/gif',
+            'channel': f'live{channel_id}', 'author': f'liver{author_id}', 'content': content,
+            'timestamp': int(now), 'deleted': False, 'tags': set()
+        }
+        if step % 2:
+            conn.execute('INSERT INTO file_tags (file_id, tag_id) VALUES (?, 2)', (cursor.lastrowid,))
+            files.rows[cursor.lastrowid]['tags'].add(2)
+        link_url = f'https://sub.live{step}.co.uk/page'
+        cursor = conn.execute('''
+            INSERT INTO indexed_links (message_id, channel_id, guild_id, author_id, link_url, link_domain,
+                                       registrable_domain, timestamp)
+            VALUES (?, ?, 1000, ?, ?, ?, ?, ?)
+        ''', (message_id, channel_id, author_id, link_url, f'sub.live{step}.co.uk', url_registrable_domain(link_url),
+              timestamp))
+        links.rows[cursor.lastrowid] = {
+            'link_url': link_url, 'channel': f'live{channel_id}', 'author': f'liver{author_id}', 'content': content,
+            'timestamp': int(now), 'deleted': False, 'tags': set()
+        }
+        # Refreshed URLs, tombstones and restores land on rows on either
+        # side of the migration's position
+        file_id = rng.choice(list(files.rows))
+        url = f'https://cdn.discordapp.com/refreshed/{step}/{file_id}'
+        conn.execute('UPDATE indexed_files SET file_url = ? WHERE id = ?', (url, file_id))
+        files.rows[file_id]['file_url'] = url
+
+        for table, model in (('indexed_files', files), ('indexed_links', links)):
+            row_id = rng.choice(list(model.rows))
+            deleted = not model.rows[row_id]['deleted']
+            conn.execute(f'UPDATE {table} SET deleted_at = {"CURRENT_TIMESTAMP" if deleted else "NULL"} WHERE id = ?',
+                         (row_id,))
+            model.rows[row_id]['deleted'] = deleted
+
+        # Rows without tags are occasionally removed outright
+        if step % 3 == 0:
+            for table, model in (('indexed_files', files), ('indexed_links', links)):
+                row_id = rng.choice([row_id for row_id, row in model.rows.items() if not row['tags']])
+                conn.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,))
+                del model.rows[row_id]
+
+
+@pytest.fixture
+def migrated(tmp_path):
+    """A baseline database migrated to completion while being written to"""
+    path = str(tmp_path / 'indexer.db')
+    files, links = Model(), Model()
+    conn = baseline_connection(path)
+    fill_baseline(conn, files, links)
+    ensure_schema(conn)
+    assert 'normalize_files' in pending_migrations(conn)
+
+    # Live writes come from a separate connection, as they do from the bot
+    writer = sqlite3.connect(path)
+    rng = random.Random(7)
+    steps = 0
+    while migrate_step(conn, CHUNK_SIZE):
+        steps += 1
+        live_write(writer, steps, files, links, rng)
+        assert steps < 1000
+    writer.close()
+
+    yield conn, files, links
+    conn.close()
+
+
+def test_nothing_left_pending(migrated):
+    conn, _, _ = migrated
+    assert pending_migrations(conn) == []
+    assert 'channel_name' not in get_columns(conn, 'indexed_files')
+    assert 'message_content' not in get_columns(conn, 'indexed_links')
+    assert get_column_type(conn, 'indexed_files', 'message_id') == 'INTEGER'
+    leftovers = conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%_rebuild%'").fetchall()
+    assert leftovers == []
+
+
+def test_rows_match(migrated):
+    conn, files, links = migrated
+    stored = {row[0]: row[1:] for row in conn.execute('''
+        SELECT f.id, f.filename, f.file_url, f.file_type, c.name, a.name, m.content, f.timestamp,
+               f.deleted_at IS NOT NULL
+        FROM indexed_files f
+        LEFT JOIN channels c ON c.channel_id = f.channel_id
+        LEFT JOIN authors a ON a.author_id = f.author_id
+        LEFT JOIN messages m ON m.message_id = f.message_id
+    ''')}
+    assert stored == {
+        row_id: (row['filename'], row['file_url'], row['file_type'], row['channel'], row['author'], row['content'],
+                 row['timestamp'], row['deleted'])
+        for row_id, row in files.rows.items()
+    }
+
+    stored = {row[0]: row[1:] for row in conn.execute('''
+        SELECT l.id, l.link_url, l.registrable_domain, c.name, a.name, m.content, l.timestamp,
+               l.deleted_at IS NOT NULL
+        FROM indexed_links l
+        LEFT JOIN channels c ON c.channel_id = l.channel_id
+        LEFT JOIN authors a ON a.author_id = l.author_id
+        LEFT JOIN messages m ON m.message_id = l.message_id
+    ''')}
+    assert stored == {
+        row_id: (row['link_url'], url_registrable_domain(row['link_url']), row['channel'], row['author'],
+                 row['content'], row['timestamp'], row['deleted'])
+        for row_id, row in links.rows.items()
+    }
+
+
+def test_mime_columns_filled(migrated):
+    conn, _, _ = migrated
+    for file_type, filename, major, minor in conn.execute(
+            'SELECT file_type, filename, mime_major, mime_minor FROM indexed_files'):
+        assert (major, minor) == mime_category(file_type, filename)
+
+
+def test_tags_kept(migrated):
+    conn, files, links = migrated
+    assert set(conn.execute('SELECT file_id, tag_id FROM file_tags')) == {
+        (row_id, tag) for row_id, row in files.rows.items() for tag in row['tags']
+    }
+    assert set(conn.execute('SELECT link_id, tag_id FROM link_tags')) == {
+        (row_id, tag) for row_id, row in links.rows.items() for tag in row['tags']
+    }
+    orphans = conn.execute('SELECT COUNT(*) FROM file_tags WHERE file_id NOT IN (SELECT id FROM indexed_files)')
+    assert orphans.fetchone()[0] == 0
+
+
+def test_search_index_matches(migrated):
+    conn, files, links = migrated
+    # Compares every index entry with the rows of its content view
+    conn.execute("INSERT INTO files_fts (files_fts) VALUES ('integrity-check')")
+    conn.execute("INSERT INTO links_fts (links_fts) VALUES ('integrity-check')")
+
+    for token in ('msgtoken17', 'livetoken5'):
+        expected = {row_id for row_id, row in files.rows.items() if row['content'].endswith(token)}
+        found = {row[0] for row in conn.execute('SELECT rowid FROM files_fts WHERE files_fts MATCH ?', (token,))}
+        assert found == expected and found
+    for row_id, row in list(links.rows.items())[::50]:
+        found = {row[0] for row in conn.execute('SELECT rowid FROM links_fts WHERE links_fts MATCH ?',
+                                                (f'"{row["link_url"]}"',))}
+        assert row_id in found
+
+
+def test_rollups_match_fact_tables(migrated):
+    conn, files, links = migrated
+    rollup = StatsRollup()
+    assert rollup.is_ready(conn, 'files') and rollup.is_ready(conn, 'links')
+    counted = StatsRollup()
+    counted.is_ready = lambda conn, source: False
+
+    assert rollup.total(conn, 'files') == counted.total(conn, 'files') == len(files.live_ids())
+    assert rollup.total(conn, 'links') == counted.total(conn, 'links') == len(links.live_ids())
+    for source, facets in (('files', ('type', 'category', 'channel', 'author', 'hour')),
+                           ('links', ('domain', 'channel', 'author', 'hour'))):
+        for facet in facets:
+            assert dict(rollup.top(conn, source, facet, 1000)) == dict(counted.top(conn, source, facet, 1000)), facet
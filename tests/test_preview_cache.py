@@ -0,0 +1,91 @@
+"""Rendering, hit accounting and eviction of the preview cache"""
+
+import threading
+import time
+
+import pytest
+
+from preview_cache import PreviewCache
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def test_waiters_share_one_render_after_a_failure(tmp_path):
+    cache = PreviewCache(str(tmp_path))
+    failed, rendering, finish = threading.Event(), threading.Event(), threading.Event()
+    calls = []
+
+    def render():
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            failed.wait(5)
+            raise RuntimeError('corrupt document')
+        rendering.set()
+        finish.wait(5)
+        return b'page', 'image/jpeg'
+
+    results = {}
+
+    def request(name):
+        try:
+            results[name] = cache.get_or_render('key', render)
+        except RuntimeError as e:
+            results[name] = e
+
+    def waiters():
+        return cache.rendering['key'][1] if 'key' in cache.rendering else 0
+
+    threads = {name: threading.Thread(target=request, args=(name,), name=name) for name in 'abc'}
+    threads['a'].start()
+    wait_for(lambda: calls)
+    threads['b'].start()
+    wait_for(lambda: waiters() == 2)
+
+    # a fails and b takes over the render; c must wait for it
+    failed.set()
+    wait_for(rendering.is_set)
+    threads['c'].start()
+    wait_for(lambda: waiters() == 2)
+    finish.set()
+    for thread in threads.values():
+        thread.join(5)
+
+    assert calls == ['a', 'b']
+    assert isinstance(results['a'], RuntimeError)
+    assert results['b'] == results['c']
+    assert cache.rendering == {}
+
+
+def test_hits_are_written_in_batches(tmp_path):
+    cache = PreviewCache(str(tmp_path))
+    cache.get_or_render('key', lambda: (b'page', 'image/jpeg'))
+    for _ in range(3):
+        assert cache.get_or_render('key', pytest.fail).etag
+
+    def stored_hits():
+        return cache.index.execute("SELECT hits FROM previews WHERE key = 'key'").fetchone()[0]
+
+    assert stored_hits() == 0
+    stats = cache.get_stats()
+    assert stats['hits'] == 3
+    assert stored_hits() == 3
+
+
+def test_eviction_sees_unwritten_accesses(tmp_path):
+    cache = PreviewCache(str(tmp_path), max_bytes=30)
+    for key in ('old', 'newer'):
+        cache.get_or_render(key, lambda: (b'x' * 10, 'image/jpeg'))
+        time.sleep(0.01)
+
+    # Only counted in memory so far, but it makes 'old' the most recent
+    cache.get('old')
+    cache.get_or_render('newest', lambda: (b'x' * 15, 'image/jpeg'))
+
+    assert cache.get('old') is not None
+    assert cache.get('newer') is None
+    assert cache.get_stats()['evictions'] == 1
@@ -0,0 +1,47 @@
+"""Routes of the web app against a scratch database"""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def web(app_home):
+    import web_app
+    web_app.app.config['LOGIN_DISABLED'] = True
+    return web_app
+
+
+def insert_file(web, file_type):
+    # The web app's own connections are read-only
+    conn = sqlite3.connect(web.config['database']['path'])
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO indexed_files (message_id, channel_id, guild_id, author_id, filename, file_url, file_size,
+                                       file_type, timestamp)
+            VALUES (1, 2, 3, 4, 'archive.zip', 'https://cdn.discordapp.com/attachments/1/2/archive.zip', 10, ?, 0)
+        ''', (file_type,))
+    conn.close()
+    return cursor.lastrowid
+
+
+def tombstone(web, file_id):
+    conn = sqlite3.connect(web.config['database']['path'])
+    with conn:
+        conn.execute('UPDATE indexed_files SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?', (file_id,))
+    conn.close()
+
+
+def test_deleted_files_are_not_served(web):
+    file_id = insert_file(web, 'application/zip')
+    paths = [f'/document_viewer/{file_id}', f'/api/document_pages/{file_id}', f'/api/document_pages/{file_id}/1',
+             f'/preview/{file_id}', f'/api/file/{file_id}']
+    client = web.app.test_client()
+
+    assert client.get(f'/api/file/{file_id}').status_code == 200
+    assert client.get(f'/preview/{file_id}').status_code == 400
+    assert client.get(f'/api/document_pages/{file_id}').status_code == 400
+
+    tombstone(web, file_id)
+    for path in paths:
+        assert client.get(path).status_code == 404, path
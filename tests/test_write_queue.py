@@ -0,0 +1,208 @@
+"""Acknowledgements from the group-commit write queue"""
+
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from write_queue import WriteFailed, WriteQueue, require_committed
+
+
+class FakeDatabase:
+    """Stands in for AsyncDatabase, failing the batches it is told to"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.files = []
+        self.links = []
+
+    async def insert_rows(self, files, links):
+        if self.fail:
+            raise RuntimeError('database is locked')
+        self.files += files
+        self.links += links
+
+
+class FlakyDatabase:
+    """Passes batches on to an AsyncDatabase, or fails them slowly"""
+
+    def __init__(self, adb):
+        self.adb = adb
+        self.fail = False
+
+    async def insert_rows(self, files, links):
+        if self.fail:
+            # Slow enough that a checkpoint saved without waiting lands first
+            await asyncio.sleep(0.2)
+            raise RuntimeError('disk I/O error')
+        await self.adb.insert_rows(files, links)
+
+
+class Author:
+    id = 4
+    bot = False
+
+    def __str__(self):
+        return 'author'
+
+
+class Channel:
+    """Enough of a discord TextChannel for index_channel"""
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = f'channel{channel_id}'
+        self.guild = SimpleNamespace(id=3, name='guild')
+        self.messages = []
+        self.last_message_id = None
+
+    def post(self, message_id):
+        self.messages.append(SimpleNamespace(
+            id=message_id, channel=self, guild=self.guild, author=Author(), attachments=[],
+            content=f'see https://example.com/{message_id}', created_at=datetime.now(timezone.utc)
+        ))
+        self.last_message_id = message_id
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=False):
+        messages = sorted(self.messages, key=lambda message: message.id, reverse=not oldest_first)
+        for message in messages:
+            if (before is None or message.id < before.id) and (after is None or message.id > after.id):
+                yield message
+
+
+def test_committed_batch_resolves_true():
+    async def run():
+        db = FakeDatabase()
+        queue = WriteQueue(db)
+        acks = [queue.submit_file({'id': 1}), queue.submit_link({'id': 2})]
+        assert await queue.flush() is True
+        return db, queue, await asyncio.gather(*acks)
+
+    db, queue, results = asyncio.run(run())
+    assert results == [True, True]
+    assert (db.files, db.links) == ([{'id': 1}], [{'id': 2}])
+    assert queue.get_stats()['batches_written'] == 1
+    assert queue.get_stats()['rows_written'] == 2
+
+
+def test_failed_batch_resolves_false():
+    async def run():
+        queue = WriteQueue(FakeDatabase(fail=True))
+        acks = [queue.submit_file({'id': 1}), queue.submit_link({'id': 2})]
+        assert await queue.flush() is False
+        return queue, await asyncio.gather(*acks)
+
+    queue, results = asyncio.run(run())
+    assert results == [False, False]
+    stats = queue.get_stats()
+    assert (stats['batches_failed'], stats['batches_written'], stats['rows_written'], stats['pending']) == (1, 0, 0, 0)
+
+
+def test_failure_only_affects_its_batch():
+    async def run():
+        db = FakeDatabase(fail=True)
+        queue = WriteQueue(db)
+        failed = queue.submit_file({'id': 1})
+        await queue.flush()
+        db.fail = False
+        committed = queue.submit_file({'id': 2})
+        await queue.flush()
+        return await failed, await committed, db.files
+
+    assert asyncio.run(run()) == (False, True, [{'id': 2}])
+
+
+def test_background_flush_acknowledges():
+    async def run():
+        queue = WriteQueue(FakeDatabase(fail=True), batch_size=2, max_delay=0.01)
+        queue.start()
+        acks = [queue.submit_file({'id': 1}), queue.submit_file({'id': 2}), queue.submit_link({'id': 3})]
+        results = await asyncio.wait_for(asyncio.gather(*acks), 5)
+        await queue.stop()
+        return results
+
+    assert asyncio.run(run()) == [False, False, False]
+
+
+def test_require_committed():
+    async def run(*results):
+        futures = [asyncio.get_running_loop().create_future() for _ in results]
+        for future, result in zip(futures, results):
+            future.set_result(result)
+        await require_committed(futures, 'not committed')
+
+    asyncio.run(run(True, [True, True]))
+    with pytest.raises(WriteFailed):
+        asyncio.run(run(True, False))
+    with pytest.raises(WriteFailed):
+        asyncio.run(run([True, False]))
+
+
+@pytest.fixture(scope='module')
+def bot(app_home):
+    import bot
+    return bot
+
+
+def crawl(bot, channel, fail=False):
+    """Run index_channel with a write queue whose batches fail if fail"""
+    async def run():
+        database = FlakyDatabase(bot.adb)
+        database.fail = fail
+        queue = WriteQueue(database, batch_size=3, max_delay=0.01)
+        bot.write_queue, saved = queue, bot.write_queue
+        queue.start()
+        try:
+            return await bot.index_channel(channel)
+        finally:
+            await queue.stop()
+            bot.write_queue = saved
+
+    return asyncio.run(run())
+
+
+def indexed_urls(bot, channel):
+    conn = bot.db.get_connection()
+    try:
+        rows = conn.execute('SELECT link_url FROM indexed_links WHERE channel_id = ?', (channel.id,)).fetchall()
+    finally:
+        bot.db.release_connection(conn)
+    return sorted(row[0] for row in rows)
+
+
+def test_failed_backfill_saves_no_checkpoint(bot):
+    channel = Channel(7001)
+    for message_id in range(101, 111):
+        channel.post(message_id)
+
+    with pytest.raises(WriteFailed):
+        crawl(bot, channel, fail=True)
+    assert bot.db.get_checkpoint(channel.id) is None
+
+    crawl(bot, channel)
+    assert bot.db.get_checkpoint(channel.id) == {
+        'newest_message_id': 110, 'oldest_message_id': 101, 'backfill_complete': True, 'messages_seen': 10
+    }
+    assert len(indexed_urls(bot, channel)) == 10
+
+
+def test_checkpoint_not_advanced_past_failed_rows(bot):
+    channel = Channel(7002)
+    for message_id in range(1, 11):
+        channel.post(message_id)
+    crawl(bot, channel)
+    committed = bot.db.get_checkpoint(channel.id)
+    assert committed['newest_message_id'] == 10
+
+    for message_id in range(11, 16):
+        channel.post(message_id)
+    with pytest.raises(WriteFailed):
+        crawl(bot, channel, fail=True)
+    assert bot.db.get_checkpoint(channel.id) == committed
+    assert len(indexed_urls(bot, channel)) == 10
+
+    # The next run fetches the messages of the failed batch again
+    crawl(bot, channel)
+    assert bot.db.get_checkpoint(channel.id)['newest_message_id'] == 15
+    assert indexed_urls(bot, channel) == sorted(f'https://example.com/{i}' for i in range(1, 16))